@@ -0,0 +1,77 @@
+# bench_normalize
+#
+# Compares plot.normalize with the row by row version it replaced (which set
+# one timestamp per row, with df.at standing in for the removed set_value) on
+# a synthetic Leda file, and checks that both give the same DataFrame.
+#
+# usage: python3 bench_normalize.py [rows]
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from plot.plot import normalize
+from query.catalog import splitFile
+from query.loader import loadSensorFile
+
+FILE_TS = 1478649825471
+
+# writes a Leda-like csv sampled at 32 Hz, with some blank time cells
+def writeLeda(path, nrows):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'data.time.data': np.arange(nrows) / 32,
+                       'analysis.phasicData': rng.random(nrows)})
+    df.loc[1::101, 'data.time.data'] = np.nan
+    df.to_csv(path, index=False)
+
+# the old normalize, starting from the same forward-filled frame
+def loopNormalize(fname, timestamp):
+    index_col = 'data.time.data'
+    df = loadSensorFile(fname, 'Leda').reset_index()
+    file_ts, compNumber = splitFile(fname)
+
+    for index in df.index:
+        new_ts = int(float(df[index_col][index]) * 1000 + int(file_ts))
+        df.at[index, index_col] = new_ts
+
+    df[index_col] = pd.to_datetime(df[index_col], unit='ms')
+    df.set_index(index_col, inplace=True)
+    df = df.resample('200ms').mean()
+    df.index = (df.index - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1)
+    df.set_index(np.round((df.index - timestamp) / 1000, 1), inplace=True)
+    return df
+
+def main():
+    nrows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    timestamp = FILE_TS + 60000
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, 'Leda_GSR_2016-11-08_S2_Leeps-02_'
+                             + str(FILE_TS) + '_.csv')
+        writeLeda(fname, nrows)
+        loadSensorFile(fname, 'Leda')
+
+        start = time.perf_counter()
+        old = loopNormalize(fname, timestamp)
+        loopTime = time.perf_counter() - start
+
+        start = time.perf_counter()
+        new = normalize('Leda', fname, timestamp)
+        vectorTime = time.perf_counter() - start
+
+    same = (np.array_equal(old.index, new.index)
+            and np.array_equal(old.values, new.values, equal_nan=True))
+    print(str(nrows) + ' rows')
+    print('row by row: %7.3f s' % loopTime)
+    print('vectorized: %7.3f s' % vectorTime)
+    print('speedup %.0fx, identical output: %s'
+          % (loopTime / vectorTime, same))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# bench_parse_ts
+#
+# Compares parsing screen timestamps one cell at a time with parse_ts against
+# parsing the whole column at once with parseTimestamps, on a mix of both
+# oTree timestamp formats, and checks that both give the same values.
+#
+# usage: python3 bench_parse_ts.py [count]
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from query.querymerge import parse_ts, parseTimestamps
+
+# returns count timestamps, alternating between the two formats oTree writes
+def makeTimestamps(count):
+    rng = np.random.default_rng(0)
+    ms = 1478650349944 + rng.integers(0, 10**9, count)
+    times = pd.to_datetime(ms, unit='ms')
+    isoZ = times.strftime('%Y-%m-%dT%H:%M:%S.%f').str[:-3] + 'Z'
+    utc = times.strftime('%Y-%m-%d %H:%M:%S.%f') + '+00:00'
+    return pd.Series(np.where(np.arange(count) % 2 == 0, isoZ, utc))
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    column = makeTimestamps(count)
+
+    start = time.perf_counter()
+    loop = [parse_ts(cell) for cell in column]
+    loopTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = parseTimestamps(column)
+    vectorizedTime = time.perf_counter() - start
+
+    # parse_ts goes through a float, so it can be 1 ms below the exact value
+    diff = np.abs(np.asarray(loop) - vectorized.data).max()
+    print(str(count) + ' timestamps')
+    print('parse_ts:        %7.3f s' % loopTime)
+    print('parseTimestamps: %7.3f s' % vectorizedTime)
+    print('speedup %.1fx, max difference %d ms'
+          % (loopTime / vectorizedTime, diff))
+
+
+if __name__ == '__main__':
+    main()
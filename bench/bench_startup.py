@@ -0,0 +1,73 @@
+# bench_startup
+#
+# Measures the cold start time of the query and plot packages: how long a new
+# Python process takes to import them or to print the command line help,
+# which every worker process and every notebook pays. Each command runs in a
+# fresh interpreter several times; the median, minus the time of an empty
+# interpreter, is compared with its budget.
+#
+# The budgets leave room for numpy and pandas, which querymerge and plot need,
+# but not for matplotlib, which is only imported when a plot is drawn. (pyarrow
+# is only imported by the packages when a sidecar is read, but pandas 3 imports
+# it on its own when it is installed.)
+#
+# usage: python3 bench_startup.py [runs]
+# exits with status 1 if a command is over its budget
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# (name, python arguments, budget in seconds on top of an empty interpreter)
+COMMANDS = [
+    ('import query', ['-c', 'import query'], 0.05),
+    ('import plot', ['-c', 'import plot'], 0.05),
+    ('import query.querymerge', ['-c', 'import query.querymerge'], 0.8),
+    ('import plot.plot', ['-c', 'import plot.plot'], 0.8),
+    ('python -m query --help', ['-m', 'query', '--help'], 0.8),
+    ('python -m plot --help', ['-m', 'plot', '--help'], 0.8),
+]
+
+
+# returns the median wall time of running python with args runs times
+def medianTime(args, runs):
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT, check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+# returns True if a command imports matplotlib, from the -X importtime report
+# python writes to stderr
+def importsMatplotlib(args):
+    err = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+                         cwd=ROOT, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.PIPE, text=True).stderr
+    imported = set(line.split('|')[-1].strip()
+                   for line in err.splitlines() if '|' in line)
+    return 'matplotlib' in imported
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    baseline = medianTime(['-c', 'pass'], runs)
+    print('empty interpreter: %.3f s' % baseline)
+    print('%-26s %9s %9s  %s' % ('command', 'seconds', 'budget', ''))
+    over = False
+    for name, args, budget in COMMANDS:
+        seconds = medianTime(args, runs) - baseline
+        status = 'ok' if seconds <= budget else 'OVER BUDGET'
+        if importsMatplotlib(args):
+            status += ', imports matplotlib'
+        over = over or seconds > budget
+        print('%-26s %9.3f %9.3f  %s' % (name, seconds, budget, status))
+    sys.exit(1 if over else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+# bench_suite
+#
+# Times querymerge and plot end to end and stage by stage on a synthetic
+# Processed tree (see synthetic.py), and writes the wall time and peak memory
+# of every stage to a JSON file so runs on different commits can be compared.
+# Each stage runs in a fresh process, so its peak RSS is its own and it starts
+# with empty caches (the files themselves may be in the OS page cache).
+#
+# stages:
+#   merge      querymerge.merge on the whole oTree sheet
+#   queryAfdx  querymerge.queryAfdx for every screen, one at a time
+#   queryLeda  querymerge.queryLeda for every screen, one at a time
+#   evaluate   querymerge.evaluate of 1000 windows on one loaded Affdex file
+#   normalize  plot.normalize of every Leda file
+#   plot       plot.plot of the first Leda variable around the first screen
+#
+# usage: python3 bench_suite.py [--tree DIRECTORY] [--output results.json]
+#	[--compare old_results.json] [--stages merge,plot] [--workers N]
+#	[synthetic.py options, used when the tree has to be written]
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+import synthetic
+
+STAGES = ['merge', 'queryAfdx', 'queryLeda', 'evaluate', 'normalize', 'plot']
+FCNS = ['mean', 'std', 'min', 'max']
+DELTA_TS = 20
+
+
+# returns [(ID, screen timestamp)] of every screen in the oTree sheet
+def screenTimes(manifest):
+    import pandas as pd
+    from query.querymerge import parseTimestamps
+
+    df = pd.read_csv(manifest['otree'], index_col=0)
+    IDs = ['%02d' % int(label.split('_')[1])
+           for label in df[manifest['idCol']]]
+    screens = []
+    for col in manifest['screens']:
+        for ID, ts in zip(IDs, parseTimestamps(df[col]).data):
+            screens.append((ID, int(ts)))
+    return screens
+
+def runMerge(tree, manifest, workers):
+    from query import querymerge
+    with tempfile.TemporaryDirectory() as tmp:
+        querymerge.merge(tree, manifest['otree'], manifest['idCol'],
+                         manifest['screens'],
+                         manifest['afdxVars'] + manifest['ledaVars'], FCNS,
+                         DELTA_TS, workers,
+                         output=os.path.join(tmp, 'postquery.csv'))
+
+def runQueryAfdx(tree, manifest, workers):
+    from query import querymerge
+    for ID, ts in screenTimes(manifest):
+        querymerge.queryAfdx(tree, ts, ID, manifest['afdxVars'], FCNS,
+                             DELTA_TS)
+
+def runQueryLeda(tree, manifest, workers):
+    from query import querymerge
+    for ID, ts in screenTimes(manifest):
+        querymerge.queryLeda(tree, ts, ID, manifest['ledaVars'], FCNS,
+                             DELTA_TS)
+
+# loading the file is not part of the timed stage
+def runEvaluate(tree, manifest, workers):
+    import numpy as np
+    from query import querymerge
+    from query.catalog import openCatalog
+    from query.loader import loadSensorFile
+
+    timestamp, path = openCatalog(tree).files('Afdx', '01')[0]
+    df = loadSensorFile(path, 'Afdx', manifest['afdxVars'])
+    end = df.index[-1]
+    start = time.perf_counter()
+    for offset in np.linspace(0, end - DELTA_TS, 1000):
+        querymerge.evaluate(df, timestamp + int(offset * 1000), timestamp,
+                            manifest['afdxVars'], FCNS, DELTA_TS)
+    return time.perf_counter() - start
+
+def runNormalize(tree, manifest, workers):
+    from plot import plot
+    from query.catalog import openCatalog
+
+    catalog = openCatalog(tree)
+    for (kind, ID), files in sorted(catalog.entries.items()):
+        if kind == 'Leda':
+            for timestamp, path in files:
+                plot.normalize('Leda', path, timestamp + 60000,
+                               manifest['ledaVars'])
+
+def runPlot(tree, manifest, workers):
+    import pandas as pd
+    from plot import plot
+
+    #the first screen of every row, with IDs as numbers like plot_in.csv
+    screens = screenTimes(manifest)
+    rows = len(screens) // len(manifest['screens'])
+    df_in = pd.DataFrame([(int(ID), ts) for ID, ts in screens[:rows]],
+                         columns=['ID', 'timestamp'])
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            plot.plot('Leda', df_in, manifest['ledaVars'][0], 'mean', 30,
+                      directory=tree, workers=workers)
+        finally:
+            os.chdir(cwd)
+
+RUNNERS = {'merge': runMerge, 'queryAfdx': runQueryAfdx,
+           'queryLeda': runQueryLeda, 'evaluate': runEvaluate,
+           'normalize': runNormalize, 'plot': runPlot}
+
+# returns the peak RSS in megabytes of this process and of its finished
+# children (worker processes)
+def peakRSS():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 2**20 if sys.platform == 'darwin' else 2**10
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own * unit / 2**20, children * unit / 2**20
+
+# runs one stage in this process and prints its measurements as JSON
+def runStage(stage, tree, workers):
+    manifest = synthetic.readManifest(tree)
+    start = time.perf_counter()
+    timed = RUNNERS[stage](tree, manifest, workers)
+    wall = time.perf_counter() - start
+    rss, childRss = peakRSS()
+    result = {'wall_s': round(wall, 4), 'peak_rss_mb': round(rss, 1),
+              'peak_child_rss_mb': round(childRss, 1)}
+    if timed is not None:
+        result['timed_s'] = round(timed, 4)
+    print(json.dumps(result))
+
+# runs a stage in a fresh process; returns its measurements
+def measureStage(stage, tree, workers):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__),
+                          '--run-stage', stage, '--tree', tree,
+                          '--workers', str(workers)],
+                         check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+# returns the commit the benchmarks ran on, if this is a git checkout
+def gitCommit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                             cwd=os.path.dirname(os.path.abspath(__file__)),
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, text=True).stdout
+    except OSError:
+        return None
+    return out.strip() or None
+
+# prints the stages of a run next to those of an earlier one
+def printComparison(results, old):
+    print('%-10s %10s %10s %8s %10s %10s' % ('stage', 'old s', 'new s',
+                                             'ratio', 'old MB', 'new MB'))
+    for stage, new in results['stages'].items():
+        before = old['stages'].get(stage)
+        if before is None:
+            continue
+        print('%-10s %10.3f %10.3f %7.2fx %10.1f %10.1f'
+              % (stage, before['wall_s'], new['wall_s'],
+                 new['wall_s'] / before['wall_s'], before['peak_rss_mb'],
+                 new['peak_rss_mb']))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Times querymerge and plot on a synthetic tree.')
+    parser.add_argument('--tree', help='synthetic tree to use (written with '
+                        'the options below if it has no manifest)')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='results of an earlier run')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        type=lambda arg: arg.split(','))
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--run-stage', help=argparse.SUPPRESS)
+    synthetic.addTreeArgs(parser)
+    args = parser.parse_args()
+
+    if args.run_stage is not None:
+        runStage(args.run_stage, args.tree, args.workers)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tree = args.tree if args.tree is not None else tmp
+        if not os.path.exists(os.path.join(tree, synthetic.MANIFEST)):
+            print('writing synthetic tree to ' + tree)
+            synthetic.writeTreeFromArgs(tree, args)
+        tree = os.path.join(tree, '')
+
+        results = {'commit': gitCommit(),
+                   'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'python': sys.version.split()[0], 'workers': args.workers,
+                   'tree': synthetic.readManifest(tree)['settings'],
+                   'stages': {}}
+        for stage in args.stages:
+            results['stages'][stage] = measureStage(stage, tree, args.workers)
+            print('%-10s %8.3f s %8.1f MB'
+                  % (stage, results['stages'][stage]['wall_s'],
+                     results['stages'][stage]['peak_rss_mb']))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            printComparison(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
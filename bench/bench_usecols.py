@@ -0,0 +1,123 @@
+# bench_usecols
+#
+# Compares reading a wide synthetic Affdex file the old way (every column,
+# default dtypes) with loader.readSensorFile asking only for the columns a
+# query uses (float32, pruned with usecols), and with the same pruned read
+# done by pyarrow's parser when it is installed. Each read runs in a fresh
+# process, and its wall time and peak RSS are printed; the peak RSS of a
+# process that only imports the loader is printed as the baseline. (Peak RSS
+# is used rather than tracemalloc, which does not see memory pyarrow
+# allocates.) The file is written by a process of its own as well, and this
+# one imports neither pandas nor numpy, since a child started from a process
+# keeps its peak RSS on Linux.
+#
+# usage: python3 bench_usecols.py [rows] [columns]
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from query import sidecar
+
+COLUMNS = ['var0', 'var1']
+
+# writes an Affdex-like csv with a delta_secs column (with some blank cells,
+# like real exports) and ncols random value columns
+def writeWideAffdex(path, nrows, ncols):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.random((nrows, ncols)),
+                      columns=['var' + str(i) for i in range(ncols)])
+    df.insert(0, 'delta_secs', np.arange(nrows) / 15)
+    df.loc[::97, 'delta_secs'] = np.nan
+    df.to_csv(path, index=False)
+
+# the read queryAfdx did before column pruning
+def readAll(path):
+    import pandas as pd
+    df = pd.read_csv(path)
+    df['delta_secs'] = df['delta_secs'].ffill()
+    df.set_index('delta_secs', inplace=True)
+    return df
+
+# the pruned read with pyarrow's parser
+def readPrunedArrow(path):
+    import pandas as pd
+    dtype = {col: 'float32' for col in COLUMNS}
+    dtype['delta_secs'] = 'float64'
+    return pd.read_csv(path, usecols=['delta_secs'] + COLUMNS, dtype=dtype,
+                       engine='pyarrow')
+
+def readPruned(path):
+    from query.loader import readSensorFile
+    return readSensorFile(path, 'Afdx', COLUMNS)
+
+# a process that only imports what the reads import
+def importOnly(path):
+    import pandas
+    import query.loader
+
+READS = {'baseline': importOnly, 'all': readAll, 'pruned': readPruned,
+         'pruned-pyarrow': readPrunedArrow}
+
+# returns the peak RSS of this process in megabytes
+def peakRSS():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 2**20 if sys.platform == 'darwin' else 2**10
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2**20
+
+# runs one read in this process and prints (seconds, peak MB) as JSON
+def runRead(name, path):
+    start = time.perf_counter()
+    READS[name](path)
+    print(json.dumps([time.perf_counter() - start, peakRSS()]))
+
+# runs a read in a fresh process; returns (seconds, peak MB)
+def measure(name, path):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__),
+                          '--run-read', name, path],
+                         check=True, stdout=subprocess.PIPE, text=True).stdout
+    return tuple(json.loads(out.strip().splitlines()[-1]))
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--run-read':
+        runRead(sys.argv[2], sys.argv[3])
+        return
+    if len(sys.argv) == 5 and sys.argv[1] == '--write':
+        writeWideAffdex(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+        return
+
+    nrows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    ncols = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp,
+                            'Affdex_2016-11-08_16-12_Leeps-02_1478650349944_.csv')
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--write',
+                        path, str(nrows), str(ncols)], check=True)
+        print(str(nrows) + ' rows x ' + str(ncols) + ' columns, '
+              + str(round(os.path.getsize(path) / 2**20, 1)) + ' MB')
+
+        baseline = measure('baseline', path)
+        full = measure('all', path)
+        pruned = measure('pruned', path)
+        print('imports only:             %8.1f MB peak' % baseline[1])
+        print('all columns:     %7.3f s  %8.1f MB peak' % full)
+        print('2 columns (f32): %7.3f s  %8.1f MB peak' % pruned)
+        if sidecar.available():
+            arrow = measure('pruned-pyarrow', path)
+            print('2 columns, pyarrow: %4.3f s  %8.1f MB peak' % arrow)
+        print('speedup %.1fx, memory above imports %.1fx less'
+              % (full[0] / pruned[0], (full[1] - baseline[1])
+                 / max(pruned[1] - baseline[1], 1)))
+
+
+if __name__ == '__main__':
+    main()
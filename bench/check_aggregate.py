@@ -0,0 +1,202 @@
+# check_aggregate
+#
+# Checks the window aggregates querymerge and plot compute (query/aggregate.py)
+# against numpy applied to each window's rows one at a time: every registered
+# aggregate but peaks (see check_peaks.py) over random windows of an
+# irregularly sampled array with missing values, windows whose bounds fall
+# exactly on samples (both ends are included), std with ddof=1 as plot asks
+# for it, and the names the registry takes (aliases, pNN and peaksNN
+# families, a newly registered aggregate, unknown names). A file's window
+# index (query/windowindex.py) must give the values aggregate gives on the
+# file itself, and must not be used once the file changes.
+#
+# usage: python3 check_aggregate.py
+# exits with status 1 if a check fails
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from query.aggregate import (aggregateBounds, aggregateWindows, fcnName,
+                             register, windowBounds)
+from query.loader import loadSensorFile
+from query.windowindex import buildIndex, openIndex
+
+FCNS = ['mean', 'std', 'min', 'max', 'sum', 'median', 'p0', 'p5', 'p95',
+        'p100', 'slope', 'auc']
+
+failed = []
+
+
+# prints the result of one check and remembers failures
+def check(name, ok):
+    print('%-58s %s' % (name, 'ok' if ok else 'FAILED'))
+    if not ok:
+        failed.append(name)
+
+# returns fcn of the values (and their times) of one window, skipping
+# missing values, the way numpy and pandas give it
+def reference(values, times, fcn, ddof=0):
+    valid = ~np.isnan(values)
+    values = values[valid]
+    times = times[valid]
+    if len(values) == 0:
+        return np.nan
+    if fcn == 'mean':
+        return values.mean()
+    if fcn == 'std':
+        return values.std(ddof=ddof) if len(values) > ddof else np.nan
+    if fcn == 'min':
+        return values.min()
+    if fcn == 'max':
+        return values.max()
+    if fcn == 'sum':
+        return values.sum()
+    if fcn == 'median':
+        return np.median(values)
+    if fcn.startswith('p'):
+        return np.percentile(values, float(fcn[1:]))
+    if fcn == 'slope':
+        return np.polyfit(times, values, 1)[0] if len(values) > 1 else np.nan
+    if fcn == 'auc':
+        return np.trapezoid(values, times)
+    raise ValueError(fcn)
+
+# returns True if found holds, for every window and column, the reference
+# value of the window's rows
+def matchesReference(found, values, times, lo, hi, fcns, ddof=0):
+    expected = np.empty(found.shape)
+    for w in range(len(lo)):
+        for col in range(values.shape[1]):
+            for k, fcn in enumerate(fcns):
+                expected[w, col, k] = reference(values[lo[w]:hi[w], col],
+                                                times[lo[w]:hi[w]], fcn, ddof)
+    return np.allclose(found, expected, rtol=1e-9, atol=1e-9, equal_nan=True)
+
+# returns (times, values): irregularly sampled random columns with missing
+# values, one of them empty but for a short stretch
+def randomSamples(rng, nrows=5000):
+    times = np.cumsum(rng.uniform(0.05, 0.15, nrows))
+    values = rng.normal(10, 3, (nrows, 3))
+    values[rng.random((nrows, 3)) < 0.1] = np.nan
+    values[:, 2] = np.nan
+    values[100:200, 2] = rng.normal(size=100)
+    return times, values
+
+def checkReductions(rng):
+    times, values = randomSamples(rng)
+    starts = rng.uniform(-5, times[-1], 300)
+    ends = starts + rng.uniform(0, 30, 300)
+    lo, hi = windowBounds(times, starts, ends)
+    found = aggregateBounds(values, lo, hi, FCNS, times)
+    check('every aggregate matches numpy over random windows',
+          matchesReference(found, values, times, lo, hi, FCNS))
+    found = aggregateBounds(values, lo, hi, ['std'], times, ddof=1)
+    check('std with ddof=1 matches numpy',
+          matchesReference(found, values, times, lo, hi, ['std'], ddof=1))
+    found = aggregateBounds(values, lo[:3], hi[:3], FCNS, times)
+    check('a query of a few windows matches numpy',
+          matchesReference(found, values, times, lo[:3], hi[:3], FCNS))
+
+    # windows from one sample to another take both
+    first = rng.integers(0, len(times) - 50, 200)
+    last = first + rng.integers(0, 50, 200)
+    lo, hi = windowBounds(times, times[first], times[last])
+    check('a window from one sample to another includes both',
+          (lo == first).all() and (hi == last + 1).all())
+
+    df = pd.DataFrame(values, columns=['a', 'b', 'c'],
+                      index=pd.Index(times, name='time'))
+    windows = list(zip(times[first], times[last]))
+    results, missingPos = aggregateWindows(df, windows, ['a', 'x', 'c'],
+                                           ['mean', 'max'])
+    expected = aggregateBounds(values[:, [0, 2]], first, last + 1,
+                               ['mean', 'max'], times)
+    check('aggregateWindows skips names that are not columns',
+          missingPos == [1] and np.array_equal(results, expected,
+                                               equal_nan=True))
+    try:
+        aggregateWindows(df.iloc[::-1], windows, ['a'], ['mean'])
+        check('aggregateWindows refuses an unsorted index', False)
+    except ValueError:
+        check('aggregateWindows refuses an unsorted index', True)
+
+def checkRegistry(rng):
+    check('aliases give their canonical name',
+          [fcnName(fcn) for fcn in ['np.mean', 'sd', 'np.std', 'np.min',
+                                    'np.max', 'np.sum', 'np.median']]
+          == ['mean', 'std', 'std', 'min', 'max', 'sum', 'median'])
+    check('pNN and peaksNN names are their own',
+          [fcnName(fcn) for fcn in ['p2.5', 'p100', 'peaks0.05', 'peaks5']]
+          == ['p2.5', 'p100', 'peaks0.05', 'peaks5'])
+    for fcn in ['p101', 'peaksx', 'mode', 'np.var']:
+        try:
+            fcnName(fcn)
+            check('unknown function ' + fcn + ' is refused', False)
+        except ValueError:
+            check('unknown function ' + fcn + ' is refused', True)
+
+    register('range', lambda windows, name: (windows.reduce(np.fmax)
+                                            - windows.reduce(np.fmin)),
+             aliases=('ptp',))
+    times, values = randomSamples(rng, 1000)
+    lo, hi = windowBounds(times, [0, 10, 50], [20, 10.5, 90])
+    found = aggregateBounds(values, lo, hi, ['ptp', 'max', 'min'], times)
+    check('a registered aggregate is computed with the others',
+          np.allclose(found[:, :, 0], found[:, :, 1] - found[:, :, 2],
+                      equal_nan=True))
+
+def checkIndex(rng, directory):
+    times, values = randomSamples(rng)
+    path = os.path.join(directory, 'Affdex_2016-11-08_16-12_Leeps-01_'
+                        '1478650349944_.csv')
+    df = pd.DataFrame(values, columns=['joy', 'fear', 'anger'])
+    df.insert(0, 'delta_secs', times)
+    df.to_csv(path, index=False)
+
+    columns = ['joy', 'fear', 'anger']
+    fcns = ['mean', 'std', 'min', 'max']
+    buildIndex(path, 'Afdx', columns[:2])
+    check('the index of a file opens for the columns it holds',
+          openIndex(path, columns[:2] + ['sadness'], fcns) is not None)
+    check('the index is not used for columns of the file it lacks',
+          openIndex(path, columns, fcns) is None)
+    buildIndex(path, 'Afdx', columns[2:])
+    windex = openIndex(path, columns, fcns)
+    check('building the index again adds the columns asked for',
+          windex is not None)
+    starts = np.concatenate([rng.uniform(-5, times[-1], 300),
+                             times[rng.integers(0, len(times), 100)]])
+    windows = list(zip(starts, starts + rng.uniform(0, 30, len(starts))))
+    found, missingPos = windex.aggregateWindows(windows, columns, fcns)
+    expected, missingPos = aggregateWindows(
+        loadSensorFile(path, 'Afdx', columns), windows, columns, fcns)
+    check('the index gives the values of the file',
+          np.array_equal(found[..., 2:], expected[..., 2:], equal_nan=True)
+          and np.allclose(found, expected, rtol=1e-9, atol=1e-9,
+                          equal_nan=True))
+    check('the index is not used for other aggregates',
+          openIndex(path, columns, ['median']) is None)
+
+    with open(path, 'a') as f:
+        f.write(str(times[-1] + 0.1) + ',1,2,3\n')
+    check('the index is not used once the file changes',
+          openIndex(path, columns, fcns) is None)
+
+def main():
+    rng = np.random.default_rng(0)
+    checkReductions(rng)
+    checkRegistry(rng)
+    with tempfile.TemporaryDirectory() as tmp:
+        checkIndex(rng, tmp)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# check_fused
+#
+# Checks that a variable gets the same value from a fused session
+# (fused.SensorSession, which merge uses) as from its file alone
+# (querymerge.evaluateScreens) and from the file's window index, at screen
+# offsets that put window bounds exactly on samples, where a window computed
+# with other arithmetic takes or leaves the boundary sample. The files are
+# sampled every 0.1 s (Affdex, with times summed up the way exporters write
+# them) and every 1/32 s (Leda). A session with a tolerance too small to
+# carry any value over must give the same values as well, which checks how
+# windows are mapped onto the interleaved frame.
+#
+# usage: python3 check_fused.py
+# exits with status 1 if a check fails
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from query.fused import SensorSession
+from query.loader import loadSensorFile
+from query.querymerge import evaluateScreens
+from query.windowindex import buildIndex, openIndex
+
+AFDX_START = 1478650350944
+# no Leda sample falls on an Affdex one, so nothing is carried over within
+# the tolerance of the fused session below
+LEDA_START = AFDX_START - 510
+AFDX_VARS = ['joy', 'disgust']
+LEDA_VARS = ['analysis.phasicData']
+FCNS = ['min', 'max', 'mean', 'sum']
+DELTAS = [0.1, 0.2, 0.3, 0.7, 1, 2.5, 20]
+
+failed = []
+
+
+# prints the result of one check and remembers failures
+def check(name, ok):
+    print('%-58s %s' % (name, 'ok' if ok else 'FAILED'))
+    if not ok:
+        failed.append(name)
+
+# writes an Affdex and a Leda file of integer-valued (so that sums are
+# exact) random data to directory; returns their paths
+def writeFiles(directory):
+    rng = np.random.default_rng(0)
+    times = np.cumsum(np.full(3000, 0.1)) - 0.1
+    afdx = pd.DataFrame({'delta_secs': times})
+    for var in AFDX_VARS:
+        afdx[var] = rng.integers(0, 10, len(times)).astype(float)
+    afdxPath = os.path.join(directory, 'Affdex_2016-11-08_16-12_Leeps-01_'
+                            + str(AFDX_START) + '_.csv')
+    afdx.to_csv(afdxPath, index=False)
+
+    times = np.arange(32 * 300) / 32
+    leda = pd.DataFrame({'data.time.data': times,
+                         LEDA_VARS[0]: rng.integers(0, 10, len(times))
+                         .astype(float)})
+    ledaPath = os.path.join(directory, 'Leda_GSR_2016-11-08_S2_Leeps-01_'
+                            + str(LEDA_START) + '_.csv')
+    leda.to_csv(ledaPath, index=False)
+    return afdxPath, ledaPath
+
+# returns the values of the variables of one file for every screen, as an
+# array of shape (screens, variables, fcns)
+def fileValues(source, start, screens, var_names, fcns, delta_ts):
+    results, missingPos = evaluateScreens(source, screens, start, var_names,
+                                          fcns, delta_ts)
+    return np.array(results, dtype=float)
+
+# returns True if two arrays hold the same values, with NaN where the other
+# has NaN; means may differ by rounding (the index takes them from prefix
+# sums, so a mean of zeros can come out as -1e-15)
+def same(found, expected):
+    exact = [k for k, fcn in enumerate(FCNS[:found.shape[-1]])
+             if fcn != 'mean']
+    return (np.array_equal(found[..., exact], expected[..., exact],
+                           equal_nan=True)
+            and np.allclose(found, expected, rtol=1e-12, atol=1e-12,
+                            equal_nan=True))
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        afdxPath, ledaPath = writeFiles(tmp)
+        afdx = loadSensorFile(afdxPath, 'Afdx', AFDX_VARS)
+        leda = loadSensorFile(ledaPath, 'Leda', LEDA_VARS)
+        buildIndex(afdxPath, 'Afdx', AFDX_VARS)
+        buildIndex(ledaPath, 'Leda', LEDA_VARS)
+        afdxIndex = openIndex(afdxPath, AFDX_VARS, FCNS[:3])
+        ledaIndex = openIndex(ledaPath, LEDA_VARS, FCNS[:3])
+
+        var_names = AFDX_VARS + LEDA_VARS
+        # screens every 100 ms for 18 s, on the Affdex samples
+        screens = [AFDX_START + offset for offset in range(0, 18000, 100)]
+        streams = [('Afdx', AFDX_START, afdx), ('Leda', LEDA_START, leda)]
+        session = SensorSession(streams)
+        carried = SensorSession(streams, tolerance=1e-6)
+        indexed = SensorSession([('Afdx', AFDX_START, afdxIndex),
+                                 ('Leda', LEDA_START, ledaIndex)])
+
+        for delta_ts in DELTAS:
+            alone = np.concatenate(
+                [fileValues(afdx, AFDX_START, screens, AFDX_VARS, FCNS,
+                            delta_ts),
+                 fileValues(leda, LEDA_START, screens, LEDA_VARS, FCNS,
+                            delta_ts)],
+                axis=1)
+            name = 'delta_ts ' + str(delta_ts) + ': '
+            check(name + 'session gives the values of each file',
+                  same(session.aggregate(screens, var_names, FCNS, delta_ts),
+                       alone))
+            check(name + 'fused session gives the values of each file',
+                  same(carried.aggregate(screens, var_names, FCNS, delta_ts),
+                       alone))
+            check(name + 'indexed session gives the values of each file',
+                  same(indexed.aggregate(screens, var_names, FCNS[:3],
+                                         delta_ts), alone[..., :3]))
+            check(name + 'window index gives the values of the file',
+                  same(fileValues(afdxIndex, AFDX_START, screens, AFDX_VARS,
+                                  FCNS[:3], delta_ts),
+                       alone[:, :len(AFDX_VARS), :3]))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
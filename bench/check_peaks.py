@@ -0,0 +1,95 @@
+# check_peaks
+#
+# Checks the peaks aggregate (query/aggregate.py) on made up skin conductance
+# recordings: 30 s at 32 Hz holding three responses of 0.1 microsiemens,
+# clean and with noise of 0.001 to 0.005 (where counting every noisy bump that
+# rises 0.01 found up to 30 peaks), must give three peaks, one in the window
+# of each response; a dip on the way up must not split a response, while two
+# responses apart by more than the least amplitude count twice.
+#
+# usage: python3 check_peaks.py
+# exits with status 1 if a check fails
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from query.aggregate import aggregateWindows
+
+HZ = 32
+ONSETS = [5, 15, 25]
+AMPLITUDE = 0.1
+
+failed = []
+
+
+# prints the result of one check and remembers failures
+def check(name, ok):
+    print('%-58s %s' % (name, 'ok' if ok else 'FAILED'))
+    if not ok:
+        failed.append(name)
+
+# returns a recording of seconds seconds holding a response of AMPLITUDE at
+# each onset (a rise of about a second and a decay of a few), plus white
+# noise of standard deviation sd
+def recording(seconds, onsets, sd, seed=0):
+    times = np.arange(seconds * HZ) / HZ
+    values = np.zeros(len(times))
+    rise, decay = 0.75, 4.0
+    top = rise*decay/(decay - rise) * np.log(decay/rise)
+    height = np.exp(-top/decay) - np.exp(-top/rise)
+    for onset in onsets:
+        since = np.clip(times - onset, 0, None)
+        values += AMPLITUDE/height * (np.exp(-since/decay)
+                                      - np.exp(-since/rise))
+    values += np.random.default_rng(seed).normal(0, sd, len(times))
+    return pd.DataFrame({'gsr': values}, index=pd.Index(times, name='time'))
+
+# returns the peak counts of df over windows, one row per window
+def countPeaks(df, windows, fcns=('peaks',)):
+    results, missingPos = aggregateWindows(df, windows, ['gsr'], list(fcns))
+    return results[:, 0, :]
+
+def main():
+    whole = [(0, 30)]
+    # a window from each onset to the next
+    each = [(onset, onset + 10) for onset in ONSETS]
+
+    for sd in [0, 0.001, 0.003, 0.005]:
+        for seed in range(5):
+            df = recording(30, ONSETS, sd, seed)
+            name = 'noise %g, seed %d: ' % (sd, seed)
+            check(name + 'three responses give three peaks',
+                  countPeaks(df, whole)[0, 0] == 3)
+            check(name + 'one peak in the window of each response',
+                  (countPeaks(df, each)[:, 0] == 1).all())
+
+    df = recording(30, ONSETS, 0.003)
+    check('peaks0.05 counts the responses of 0.1',
+          countPeaks(df, whole, ['peaks0.05'])[0, 0] == 3)
+    check('peaks0.2 counts no response of 0.1',
+          countPeaks(df, whole, ['peaks0.2'])[0, 0] == 0)
+
+    #a rise of 0.1 with a dip of 0.005 halfway up it
+    times = np.arange(10 * HZ) / HZ
+    values = np.interp(times, [0, 2, 3, 3.5, 4.5, 6, 10],
+                       [0, 0, 0.05, 0.045, 0.1, 0.05, 0.05])
+    df = pd.DataFrame({'gsr': values}, index=pd.Index(times, name='time'))
+    check('a small dip on the way up does not split a response',
+          countPeaks(df, [(0, 10)])[0, 0] == 1)
+    #the same with a dip of 0.02
+    values = np.interp(times, [0, 2, 3, 3.5, 4.5, 6, 10],
+                       [0, 0, 0.05, 0.03, 0.1, 0.05, 0.05])
+    df = pd.DataFrame({'gsr': values}, index=pd.Index(times, name='time'))
+    check('responses apart by more than 0.01 count twice',
+          countPeaks(df, [(0, 10)])[0, 0] == 2)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+# check_pricestore
+#
+# Checks the price store of the graph scripts (matplotlib/pricestore.py)
+# against the csv fixtures in fixtures/prices, without network access or API
+# keys: a store filled from the first half of each fixture and then updated
+# from the whole of it must hold exactly the fixture, with the new rows
+# appended to the stored files rather than written as a new version; an
+# offline store must read what is stored without asking its sources; rows
+# left by an interrupted append must not be read, and the next update must
+# write over them; and the data of btc_eth.py and btc_xrp_eth.py must be read
+# from an offline store.
+#
+# usage: python3 check_pricestore.py
+# exits with status 1 if a check fails
+
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(HERE, 'fixtures', 'prices')
+sys.path.insert(0, os.path.join(HERE, '..', 'matplotlib'))
+import pricestore
+
+# the date the first fill of the store stops at
+SPLIT = '2017-01-05'
+
+failed = []
+
+
+# prints the result of one check and remembers failures
+def check(name, ok):
+    print('%-58s %s' % (name, 'ok' if ok else 'FAILED'))
+    if not ok:
+        failed.append(name)
+
+# returns a fixture as the store reads it back
+def readFixture(symbol):
+    return pricestore.fixture_sources(FIXTURES)[symbol](None)
+
+# writes the rows of each fixture up to SPLIT to directory
+def writeFirstHalf(directory):
+    for symbol in pricestore.SOURCES:
+        df = readFixture(symbol)
+        df[df.index <= pd.Timestamp(SPLIT) + pd.Timedelta(hours=23)].to_csv(
+            os.path.join(directory, symbol + '.csv'))
+
+# sources that fail if the store asks them for anything
+def refusingSources():
+    def fetch(since):
+        raise AssertionError('an offline store fetched prices')
+    return {symbol: fetch for symbol in pricestore.SOURCES}
+
+# returns True if two frames hold the same dates and prices
+def same(found, expected):
+    return (list(found.columns) == [str(col) for col in expected.columns]
+            and (found.index == expected.index).all()
+            and (found.to_numpy() == expected.to_numpy()).all())
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        half = os.path.join(tmp, 'half')
+        os.makedirs(half)
+        writeFirstHalf(half)
+        directory = os.path.join(tmp, 'store')
+
+        store = pricestore.PriceStore(directory,
+                                      pricestore.fixture_sources(half))
+        for symbol in pricestore.SOURCES:
+            store.update(symbol)
+        tokens = {symbol: store.header(symbol)['token']
+                  for symbol in pricestore.SOURCES}
+
+        store = pricestore.PriceStore(directory,
+                                      pricestore.fixture_sources(FIXTURES))
+        for symbol in pricestore.SOURCES:
+            expected = readFixture(symbol)
+            added = store.update(symbol)
+            check(symbol + ': update adds only the new rows',
+                  added == (expected.index > pd.Timestamp(
+                      SPLIT) + pd.Timedelta(hours=23)).sum())
+            check(symbol + ': update appends to the stored files',
+                  store.header(symbol)['token'] == tokens[symbol])
+            check(symbol + ': store holds the fixture',
+                  same(store.read(symbol), expected))
+            check(symbol + ': a second update adds nothing',
+                  store.update(symbol) == 0)
+
+        offline = pricestore.PriceStore(directory, refusingSources(),
+                                        offline=True)
+        btc = readFixture('BTC')
+        inRange = btc[(btc.index >= '2017-01-01') & (btc.index <= '2017-01-10')]
+        check('offline: a date range reads the rows in it',
+              same(offline.read('BTC', '2017-01-01', '2017-01-10'), inRange))
+        check('offline: one column is read as a named series',
+              offline.series('BTC', 'Open').equals(
+                  btc['Open'].rename('BTC')))
+
+        #rows an interrupted append wrote past those the header counts
+        header = offline.header('BTC')
+        path = os.path.join(directory, 'BTC', 'c0-' + header['token']
+                            + '.npy')
+        with open(path, 'ab') as f:
+            f.write(b'\0' * 64)
+        check('offline: rows of an interrupted append are not read',
+              same(offline.read('BTC'), btc))
+        extra = pd.DataFrame({col: [1.5] for col in btc.columns},
+                             index=[btc.index[-1] + pd.Timedelta(days=1)])
+        grown = pricestore.PriceStore(
+            directory, {'BTC': lambda since: pd.concat([btc, extra])})
+        grown.update('BTC')
+        check('update writes over the rows of an interrupted append',
+              same(grown.read('BTC'), pd.concat([btc, extra])))
+
+        import btc_eth
+        import btc_xrp_eth
+        btc, eth = btc_eth.get_data(offline)
+        check('btc_eth.py reads its data offline',
+              len(btc) > 0 and len(eth) > 0)
+        btc, xrp, eth = btc_xrp_eth.get_data(offline)
+        check('btc_xrp_eth.py reads its data offline',
+              len(btc) > 0 and len(xrp) > 0 and len(eth) > 0)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+# check_store
+#
+# Checks what lets a merge be run again cheaply, on a small synthetic tree
+# (see synthetic.py): the result store (query/resultstore.py) must give back
+# the (results, missingPos) it was given and drop them once their file
+# changes, and a merge with a store must write the same output as one
+# without, reusing every window on a second run and computing again only the
+# windows of a file that changed. A chunked merge (--chunksize) stopped part
+# way and run again must write the same output as a merge in one go, serially
+# and with workers.
+#
+# usage: python3 check_store.py
+# exits with status 1 if a check fails
+
+import contextlib
+import io
+import os
+import re
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+from query import querymerge
+from query.catalog import openCatalog
+from query.resultstore import ResultStore
+from synthetic import writeTree
+
+FCNS = ['mean', 'std', 'max']
+DELTA_TS = 5
+# rows of the oTree sheet per chunk; the sheet has 6, so a chunked merge
+# stopped after 2 chunks has one left to do
+CHUNKSIZE = 2
+
+failed = []
+
+
+# prints the result of one check and remembers failures
+def check(name, ok):
+    print('%-58s %s' % (name, 'ok' if ok else 'FAILED'))
+    if not ok:
+        failed.append(name)
+
+# the arguments of a merge of every variable of the tree
+def mergeArgs(tree, manifest):
+    return (tree, manifest['otree'], manifest['idCol'], manifest['screens'],
+            manifest['afdxVars'] + manifest['ledaVars'], FCNS, DELTA_TS)
+
+# runs a merge to output, quietly; returns (output text, windows the result
+# store reused, windows it computed), the last two None without a store
+def runMerge(tree, manifest, output, **options):
+    printed = io.StringIO()
+    with contextlib.redirect_stdout(printed):
+        querymerge.merge(*mergeArgs(tree, manifest), output=output,
+                         **options)
+    with open(output) as f:
+        text = f.read()
+    counts = re.search(r'(\d+) of \d+ windows reused, (\d+) computed',
+                       printed.getvalue())
+    if counts is None:
+        return text, None, None
+    return text, int(counts.group(1)), int(counts.group(2))
+
+# runs a chunked merge to output that stops after stopAfter chunks, as if
+# the run was killed
+def interruptedMerge(tree, manifest, output, stopAfter, workers):
+    enrich = querymerge.enrich
+    chunks = []
+
+    def stopping(*args, **kwargs):
+        if len(chunks) == stopAfter:
+            raise KeyboardInterrupt
+        chunks.append(None)
+        return enrich(*args, **kwargs)
+    querymerge.enrich = stopping
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            querymerge.mergeChunks(*mergeArgs(tree, manifest), workers,
+                                   output, CHUNKSIZE)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        querymerge.enrich = enrich
+
+def checkResultStore(tree, directory):
+    timestamp, path = openCatalog(tree).files('Afdx', '01')[0]
+    store = ResultStore(os.path.join(directory, 'cells.sqlite'))
+    screens = [timestamp + 1000, timestamp + 2000]
+    var_names = ['joy', 'nothing', 'fear']
+    results = [([[1.0, 2.0, float('nan')], [4.0, 5.0, 6.0]], [1]),
+               ([[7.0, 8.0, 9.0], [10.0, 11.0, 12.0]], [1])]
+    check('store: nothing is found before it is saved',
+          store.lookup('Afdx', '01', path, screens, var_names, FCNS,
+                       DELTA_TS) == [None, None])
+    store.save('Afdx', '01', path, screens, results, var_names, FCNS,
+               DELTA_TS)
+    found = store.lookup('Afdx', '01', path, screens, var_names, FCNS,
+                         DELTA_TS)
+    check('store: saved windows are given back as they were',
+          str(found) == str(results))
+    check('store: other windows are not found',
+          store.lookup('Afdx', '01', path, screens, var_names, FCNS,
+                       DELTA_TS + 1) == [None, None])
+    os.utime(path, ns=(1, 1))
+    check('store: windows of a changed file are not found',
+          store.lookup('Afdx', '01', path, screens, var_names, FCNS,
+                       DELTA_TS) == [None, None])
+    store.close()
+
+def checkMergeStore(tree, manifest, directory):
+    output = os.path.join(directory, 'postquery.csv')
+    store = os.path.join(directory, 'results.sqlite')
+    expected, hits, misses = runMerge(tree, manifest, output)
+
+    found, hits, misses = runMerge(tree, manifest, output, store=store)
+    check('merge: a store does not change the output',
+          found == expected and hits == 0 and misses > 0)
+    windows = misses
+    found, hits, misses = runMerge(tree, manifest, output, store=store)
+    check('merge: a second run reuses every window',
+          found == expected and hits == windows and misses == 0)
+
+    timestamp, path = openCatalog(tree).files('Leda', '02')[0]
+    os.utime(path, ns=(2, 2))
+    found, hits, misses = runMerge(tree, manifest, output, store=store,
+                                   workers=2)
+    check('merge: only the windows of a changed file are computed',
+          found == expected and 0 < misses < windows
+          and hits + misses == windows)
+
+def checkResume(tree, manifest, directory):
+    output = os.path.join(directory, 'postquery.csv')
+    expected = runMerge(tree, manifest, output)[0]
+    for workers in [1, 2]:
+        name = 'resume, ' + str(workers) + ' workers: '
+        chunked = os.path.join(directory, 'chunked' + str(workers) + '.csv')
+        interruptedMerge(tree, manifest, chunked, 2, workers)
+        check(name + 'a stopped merge keeps its progress',
+              os.path.exists(chunked + querymerge.PROGRESS_EXT))
+        found, hits, misses = runMerge(tree, manifest, chunked,
+                                       chunksize=CHUNKSIZE,
+                                       workers=workers)
+        check(name + 'the resumed output is that of one run',
+              found == expected
+              and not os.path.exists(chunked + querymerge.PROGRESS_EXT))
+
+    # a stopped merge of an oTree file that changed since starts over
+    chunked = os.path.join(directory, 'changed.csv')
+    interruptedMerge(tree, manifest, chunked, 2, 1)
+    os.utime(manifest['otree'], ns=(3, 3))
+    printed = io.StringIO()
+    with contextlib.redirect_stdout(printed):
+        querymerge.mergeChunks(*mergeArgs(tree, manifest), 1, chunked,
+                               CHUNKSIZE)
+    with open(chunked) as f:
+        found = f.read()
+    check('resume: a changed oTree file starts over',
+          found == expected and 'resuming' not in printed.getvalue())
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        tree = os.path.join(tmp, 'Processed')
+        manifest = writeTree(tree, participants=6, afdxRows=1500,
+                             ledaRows=3200, afdxCols=3, ledaCols=2, screens=3)
+        checkResultStore(tree, tmp)
+        checkMergeStore(tree, manifest, tmp)
+        checkResume(tree, manifest, tmp)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
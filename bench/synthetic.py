@@ -0,0 +1,150 @@
+# synthetic
+#
+# Writes a synthetic Processed tree for benchmarks: an Affdex and a Leda csv
+# file per participant session, named the way splitFile and the catalog
+# expect (Afdx/Affdex_..._Leeps-NN_<ts>_.csv and
+# Leda/<session>/Leda_GSR_..._Leeps-NN_<ts>_.csv), and an oTree sheet with a
+# participant_label column and screen timestamps in both of the formats
+# querymerge reads. Affdex files have blank time cells like the real ones, and
+# a manifest (bench_manifest.json) records what was written so the benchmarks
+# know which IDs, screens and variables to query.
+#
+# usage: python3 synthetic.py DIRECTORY [--participants N] [--sessions N]
+#	[--afdx-rows N] [--leda-rows N] [--afdx-cols N] [--leda-cols N]
+#	[--screens N] [--seed N]
+
+import argparse
+import datetime as dt
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+MANIFEST = 'bench_manifest.json'
+
+# sample rates of the real sensors, in rows per second
+AFDX_HZ = 15
+LEDA_HZ = 32
+
+# the first columns of real Affdex and Leda files; wider files get numbered
+# extra columns
+AFDX_NAMES = ['joy', 'fear', 'disgust', 'sadness', 'anger', 'surprise',
+              'contempt', 'valence', 'engagement', 'smile', 'browRaise',
+              'browFurrow', 'noseWrinkle', 'lipCornerDepressor', 'attention']
+LEDA_NAMES = ['analysis.phasicData', 'analysis.tonicData',
+              'analysis.driver', 'data.conductance.data']
+
+# the first session starts at the time of a real one
+FIRST_TS = 1478650349944
+
+
+# returns ncols column names, starting with the real ones
+def columnNames(names, ncols):
+    return (names[:ncols]
+            + ['var' + str(i) for i in range(len(names), ncols)])
+
+# writes an Affdex csv of nrows rows, with one blank time cell in 50
+def writeAfdx(path, nrows, ncols, rng):
+    df = pd.DataFrame(rng.random((nrows, ncols), dtype=np.float32),
+                      columns=columnNames(AFDX_NAMES, ncols))
+    df.insert(0, 'delta_secs', np.arange(nrows) / AFDX_HZ)
+    df.loc[5::50, 'delta_secs'] = np.nan
+    df.to_csv(path, index=False)
+
+# writes a Leda csv of nrows rows
+def writeLeda(path, nrows, ncols, rng):
+    df = pd.DataFrame(rng.random((nrows, ncols), dtype=np.float32),
+                      columns=columnNames(LEDA_NAMES, ncols))
+    df.insert(0, 'data.time.data', np.arange(nrows) / LEDA_HZ)
+    df.to_csv(path, index=False)
+
+# formats a 13-digit timestamp the way oTree does, alternating between the two
+# formats querymerge reads
+def otreeTime(ts, zulu):
+    utc = dt.datetime.fromtimestamp(ts / 1000, dt.timezone.utc)
+    if zulu:
+        return utc.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+    return utc.strftime('%Y-%m-%d %H:%M:%S.%f') + '+00:00'
+
+# writes a Processed tree to directory and returns its manifest.
+# Each of participants computers (Leeps-01, Leeps-02...) records sessions
+# sessions, an hour apart; every session is one row of the oTree sheet, with
+# screens screen timestamps spread over the first half of its recording.
+def writeTree(directory, participants=20, sessions=1, afdxRows=27000,
+              ledaRows=57600, afdxCols=15, ledaCols=4, screens=4, seed=0):
+    rng = np.random.default_rng(seed)
+    for folder in ('Afdx', 'Leda', 'oTree'):
+        os.makedirs(os.path.join(directory, folder), exist_ok=True)
+
+    screenCols = ['player_time_screen' + str(i + 1) for i in range(screens)]
+    rows = []
+    recording = min(afdxRows / AFDX_HZ, ledaRows / LEDA_HZ) * 1000
+    for session in range(sessions):
+        ledaDir = os.path.join(directory, 'Leda', 'S' + str(session + 1))
+        os.makedirs(ledaDir, exist_ok=True)
+        for i in range(1, participants + 1):
+            ID = '%02d' % i
+            ts = FIRST_TS + session * 3600000 + i * 1000
+            writeAfdx(os.path.join(directory, 'Afdx',
+                                   'Affdex_2016-11-08_16-12_Leeps-' + ID
+                                   + '_' + str(ts) + '_.csv'),
+                      afdxRows, afdxCols, rng)
+            writeLeda(os.path.join(ledaDir, 'Leda_GSR_2016-11-08_S'
+                                   + str(session + 1) + '_Leeps-' + ID + '_'
+                                   + str(ts - 500) + '_.csv'),
+                      ledaRows, ledaCols, rng)
+
+            row = {'participant_label': 'P_' + str(i)}
+            for k, col in enumerate(screenCols):
+                offset = int((k + 1) * recording / (2 * (screens + 1)))
+                row[col] = otreeTime(ts + offset, (i + k) % 2 == 0)
+            rows.append(row)
+
+    otree = os.path.join(directory, 'oTree', 'otree.csv')
+    pd.DataFrame(rows).to_csv(otree)
+    manifest = {'otree': otree, 'idCol': 'participant_label',
+                'screens': screenCols,
+                'afdxVars': columnNames(AFDX_NAMES, afdxCols),
+                'ledaVars': columnNames(LEDA_NAMES, ledaCols),
+                'settings': {'participants': participants,
+                             'sessions': sessions, 'afdxRows': afdxRows,
+                             'ledaRows': ledaRows, 'afdxCols': afdxCols,
+                             'ledaCols': ledaCols, 'screens': screens,
+                             'seed': seed}}
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+# returns the manifest of a tree written by writeTree
+def readManifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        return json.load(f)
+
+# adds the options of writeTree to an argument parser
+def addTreeArgs(parser):
+    parser.add_argument('--participants', type=int, default=20)
+    parser.add_argument('--sessions', type=int, default=1)
+    parser.add_argument('--afdx-rows', type=int, default=27000,
+                        help='rows per Affdex file (15 per second)')
+    parser.add_argument('--leda-rows', type=int, default=57600,
+                        help='rows per Leda file (32 per second)')
+    parser.add_argument('--afdx-cols', type=int, default=15)
+    parser.add_argument('--leda-cols', type=int, default=4)
+    parser.add_argument('--screens', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+
+# calls writeTree with the options parsed by addTreeArgs
+def writeTreeFromArgs(directory, args):
+    return writeTree(directory, args.participants, args.sessions,
+                     args.afdx_rows, args.leda_rows, args.afdx_cols,
+                     args.leda_cols, args.screens, args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Writes a synthetic Processed tree for benchmarks.')
+    parser.add_argument('directory')
+    addTreeArgs(parser)
+    args = parser.parse_args()
+    writeTreeFromArgs(args.directory, args)
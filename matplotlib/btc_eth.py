@@ -4,35 +4,26 @@
 # A graph of bitcoin price compared to ether price for the year 2017,
 # with shared x axes,
 # and data retrieved from Quandl (bitcoin) and etherchain.org (ethereum)
+# through the local price store (see pricestore.py), which only downloads
+# prices it does not have yet
+#
+# usage: python3 btc_eth.py [--store DIRECTORY] [--offline]
+#	[--fixture DIRECTORY]
 
-import quandl
+import argparse
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
-import datetime as dt
-import requests
-
-def get_data():
+from pricestore import add_store_args, store_from_args
 
-	# so that I don't show my Quandl API key
-	with open('/Users/Eli/Desktop/coding/quandl_api.txt', 'r') as api:
-		key = api.read()
-	quandl.ApiConfig.api_key = key
+def get_data(store):
 
-	# pull bitcoin price data from bitstamp through quandl
-	#https://www.quandl.com/data/BCHARTS/BITSTAMPUSD-Bitcoin-Markets-bitstampUSD
-	btc = quandl.get('BCHARTS/BITSTAMPUSD', )
-	btc = btc['Weighted Price']['2017-01-01':]
+	# bitcoin price data from bitstamp through quandl
+	btc = store.series('BTC', 'Weighted Price', '2017-01-01')
 	btc = np.round(btc, 2)
 
-	#read ethereum data from https://etherchain.org/api/statistics/price
-	r = requests.get('https://etherchain.org/api/statistics/price')
-	eth = eval(r.text)
-	eth = pd.DataFrame(eth['data'])
-	eth.index = pd.to_datetime(eth.index, unit='h',
-							   origin='2015-09-01 07:56:28')
-	eth = eth['usd'].resample('D').last()
-	eth = eth.loc['2017-01-01':]
+	# hourly ethereum data from etherchain.org, one price per day
+	eth = store.series('ETH', 'usd', '2017-01-01')
+	eth = eth.resample('D').last()
 
 	return (btc, eth)
 
@@ -78,5 +69,9 @@ def plot(btc, eth):
 	plt.tight_layout()
 	plt.show()
 
-btc, eth = get_data()
-plot(btc, eth)
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+		description='Graphs the 2017 bitcoin and ether prices.')
+	add_store_args(parser)
+	btc, eth = get_data(store_from_args(parser.parse_args()))
+	plot(btc, eth)
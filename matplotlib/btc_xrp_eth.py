@@ -3,51 +3,34 @@
 #
 # A graph of bitcoin compared to xrp compared to ether for the year 2017,
 # with shared x axes, and data retrieved from Quandl (bitcoin),
-# xrpcharts.ripple.com (xrp), and etherchain.org (ether)
+# xrpcharts.ripple.com (xrp), and etherchain.org (ether) through the local
+# price store (see pricestore.py), which only downloads prices it does not
+# have yet
+#
+# usage: python3 btc_xrp_eth.py [--store DIRECTORY] [--offline]
+#	[--fixture DIRECTORY]
 
-import quandl
+import os
+import argparse
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib import style
-style.use('./elip12.mplstyle')
-import datetime as dt
-import requests
-
-def get_data():
+style.use(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+					   'elip12.mplstyle'))
+from pricestore import add_store_args, store_from_args
 
-	# so that I don't show my Quandl API key
-	with open('/Users/Eli/Desktop/coding/quandl_api.txt', 'r') as api:
-		key = api.read()
-	quandl.ApiConfig.api_key = key
+def get_data(store):
 
-	# pull bitcoin price data from bitstamp through quandl
-	#https://www.quandl.com/data/BCHARTS/BITSTAMPUSD-Bitcoin-Markets-bitstampUSD
-	btc = quandl.get('BCHARTS/BITSTAMPUSD', )
-	btc = btc['Weighted Price']['2017-01-01':]
+	# bitcoin price data from bitstamp through quandl
+	btc = store.series('BTC', 'Weighted Price', '2017-01-01')
 	btc = np.round(btc, 2)
-	btc = btc.rename('BTC')
-	btc.index = pd.to_datetime(btc.index)
-	btc.index.rename('Date', inplace=True)
-
-	# got XRP data from xrpcharts.ripple.com, saved data as CSV, and stored it
-	# locally
-	xrp = pd.read_csv('../XRP-USD.csv', index_col='start')
-	xrp.index = pd.to_datetime(xrp.index)
-	xrp = xrp['close']['2017-01-01':]
-	xrp = xrp.rename('XRP')
-	xrp.index.rename('Date,', inplace=True)
-
-	#read ethereum data from https://etherchain.org/api/statistics/price
-	r = requests.get('https://etherchain.org/api/statistics/price')
-	eth = eval(r.text)
-	eth = pd.DataFrame(eth['data'])
-	eth.index = pd.to_datetime(eth.index, unit='h',
-								origin='2015-09-01 08:00:00')
-	eth = eth['usd'].resample('D').last()
-	eth = eth.loc['2017-01-01':]
-	eth = eth.rename('ETH')
-	eth.index.rename('Date', inplace=True)
+
+	# XRP data from xrpcharts.ripple.com, saved as CSV next to this folder
+	xrp = store.series('XRP', 'close', '2017-01-01')
+
+	# hourly ethereum data from etherchain.org, one price per day
+	eth = store.series('ETH', 'usd', '2017-01-01')
+	eth = eth.resample('D').last()
 
 	return (btc, xrp, eth)
 
@@ -125,7 +108,11 @@ def plot(df1, df2, df3, color1, color2, color3):
 	plt.draw()
 	plt.show()
 
-btc, xrp, eth = get_data()
-d = {'green': '#60d515', 'red': '#d22b10', 'blue': '#1fa8e4',
-	 'yellow': '#e0cc05','orange': '#eb860d', 'magenta': '#b113ef'}
-plot(btc, xrp, eth, d['orange'], d['yellow'], d['red'])
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+		description='Graphs the 2017 bitcoin, XRP and ether prices.')
+	add_store_args(parser)
+	btc, xrp, eth = get_data(store_from_args(parser.parse_args()))
+	d = {'green': '#60d515', 'red': '#d22b10', 'blue': '#1fa8e4',
+		 'yellow': '#e0cc05','orange': '#eb860d', 'magenta': '#b113ef'}
+	plot(btc, xrp, eth, d['orange'], d['yellow'], d['red'])
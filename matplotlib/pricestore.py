@@ -0,0 +1,310 @@
+# price store
+# author: Eli Pandolfo
+#
+# Keeps the price history of each symbol (BTC, ETH, XRP) on disk, so the
+# graph scripts do not download the whole history on every run. Each symbol
+# is a folder of columnar .npy files (one for the dates and one per price
+# column) with a small JSON header; updating a symbol only asks its source for
+# the rows after the last stored date and appends them to the end of the
+# files, without rewriting the rows already stored. Reading a date range
+# memory-maps the files and copies only the rows in the range.
+#
+# A store can be read offline (nothing is downloaded), and its sources can be
+# replaced by local csv files (see fixture_sources), so the scripts run
+# without network access or API keys. bench/check_pricestore.py checks the
+# store this way against the fixtures in bench/fixtures/prices.
+#
+# usage: python3 pricestore.py [--store DIRECTORY] [--fixture DIRECTORY]
+#	[SYMBOL ...]
+# updates the given symbols (all of them by default) and prints their ranges
+
+import argparse
+import io
+import json
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# where prices are kept unless another directory is given
+STORE = os.path.join(HERE, 'prices')
+
+# XRP data from xrpcharts.ripple.com, saved as a csv file next to this folder
+XRP_CSV = os.path.join(HERE, '..', 'XRP-USD.csv')
+
+# so that I don't show my Quandl API key
+QUANDL_KEY = '/Users/Eli/Desktop/coding/quandl_api.txt'
+
+# etherchain gives one price per hour, counted from this time
+ETH_ORIGIN = '2015-09-01 08:00:00'
+
+HEADER_FILE = 'header.json'
+
+#------------------------------------sources------------------------------------
+# a source takes the last stored date (or None) and returns a DataFrame of
+# numeric price columns indexed by date, sorted, holding at least the rows
+# after that date. quandl and requests are only imported when a source
+# downloads something.
+
+# pull bitcoin price data from bitstamp through quandl, from the last stored
+# day on
+#https://www.quandl.com/data/BCHARTS/BITSTAMPUSD-Bitcoin-Markets-bitstampUSD
+def fetch_btc(since):
+	import quandl
+	with open(QUANDL_KEY, 'r') as api:
+		quandl.ApiConfig.api_key = api.read().strip()
+	if since is None:
+		return quandl.get('BCHARTS/BITSTAMPUSD')
+	return quandl.get('BCHARTS/BITSTAMPUSD',
+					  start_date=since.strftime('%Y-%m-%d'))
+
+# read ethereum data from https://etherchain.org/api/statistics/price, which
+# always sends the whole series; only its new rows are kept
+def fetch_eth(since):
+	import requests
+	r = requests.get('https://etherchain.org/api/statistics/price')
+	r.raise_for_status()
+	eth = pd.DataFrame(json.loads(r.text)['data'])
+	eth.index = pd.to_datetime(eth.index, unit='h', origin=ETH_ORIGIN)
+	return eth.select_dtypes('number')
+
+# read XRP data from the saved csv file
+def fetch_xrp(since):
+	xrp = pd.read_csv(XRP_CSV, index_col='start')
+	xrp.index = pd.to_datetime(xrp.index)
+	return xrp.select_dtypes('number').sort_index()
+
+SOURCES = {'BTC': fetch_btc, 'ETH': fetch_eth, 'XRP': fetch_xrp}
+
+# returns sources that read each symbol from directory/SYMBOL.csv (dates in
+# the first column, prices in the others) instead of the network, for running
+# the scripts offline or against a known fixture
+def fixture_sources(directory, symbols=SOURCES):
+	def source(symbol):
+		def fetch(since):
+			df = pd.read_csv(os.path.join(directory, symbol + '.csv'),
+							 index_col=0)
+			df.index = pd.to_datetime(df.index)
+			return df.select_dtypes('number').sort_index()
+		return fetch
+	return {symbol: source(symbol) for symbol in symbols}
+
+#-------------------------------------store-------------------------------------
+
+class PriceStore:
+
+	# directory holds one folder per symbol; sources maps each symbol to its
+	# source (SOURCES by default). If offline is True, nothing is fetched and
+	# only what is already stored is read.
+	def __init__(self, directory=STORE, sources=None, offline=False):
+		self.directory = directory
+		self.sources = SOURCES if sources is None else sources
+		self.offline = offline
+
+	# returns the header of a symbol, or None if it is not stored
+	def header(self, symbol):
+		return read_header(os.path.join(self.directory, symbol))
+
+	# returns the last stored date of a symbol, or None
+	def last(self, symbol):
+		header = self.header(symbol)
+		if header is None or header['rows'] == 0:
+			return None
+		return pd.Timestamp(header['last'])
+
+	# fetches the rows of a symbol after its last stored date and appends
+	# them; returns the number of rows added (0 when offline)
+	def update(self, symbol):
+		if self.offline:
+			return 0
+		last = self.last(symbol)
+		new = self.sources[symbol](last)
+		new.index = pd.DatetimeIndex(new.index).as_unit('ns')
+		if last is not None:
+			new = new[new.index > last]
+		if len(new) == 0:
+			return 0
+		if last is None:
+			self.write(symbol, new)
+		else:
+			self.append(symbol, new)
+		return len(new)
+
+	# returns the prices of a symbol from start to end (dates or strings,
+	# both included; None for no limit) as a DataFrame indexed by date, or
+	# only the given columns. The stored files are memory-mapped and only
+	# the rows in the range are copied.
+	# raises KeyError if the symbol is not stored
+	def read(self, symbol, start=None, end=None, columns=None):
+		header = self.header(symbol)
+		if header is None:
+			raise KeyError(symbol + ' is not in the price store '
+						   + self.directory)
+		folder = os.path.join(self.directory, symbol)
+		rows = header['rows']
+		dates = load_column(folder, header, 'date')[:rows]
+		lo = 0 if start is None else np.searchsorted(
+			dates, pd.Timestamp(start).to_datetime64(), side='left')
+		hi = len(dates) if end is None else np.searchsorted(
+			dates, pd.Timestamp(end).to_datetime64(), side='right')
+
+		stored = header['columns']
+		names = stored if columns is None else list(columns)
+		data = {}
+		for col in names:
+			column = load_column(folder, header, 'c' + str(stored.index(col)))
+			data[col] = np.array(column[lo:hi])
+		return pd.DataFrame(data, columns=names,
+							index=pd.DatetimeIndex(np.array(dates[lo:hi]),
+												   name='Date'))
+
+	# updates a symbol (unless offline) and returns one of its columns from
+	# start to end as a Series named after the symbol
+	def series(self, symbol, column, start=None, end=None):
+		self.update(symbol)
+		return self.read(symbol, start, end, [column])[column].rename(symbol)
+
+	# writes all the rows of a symbol as a new version of its folder (see
+	# write_columns)
+	def write(self, symbol, df):
+		header = {'columns': [str(col) for col in df.columns],
+				  'rows': len(df), 'first': str(df.index[0]),
+				  'last': str(df.index[-1])}
+		write_columns(os.path.join(self.directory, symbol),
+					  column_arrays(df), header)
+
+	# appends rows after the last stored date of a symbol to the end of its
+	# files, leaving the stored rows as they are; the header counting the new
+	# rows is replaced last, so readers see either none or all of them
+	def append(self, symbol, df):
+		header = self.header(symbol)
+		df = df[header['columns']]
+		header = dict(header, rows=header['rows'] + len(df),
+					  last=str(df.index[-1]))
+		append_columns(os.path.join(self.directory, symbol),
+					   column_arrays(df), header)
+
+# the files a symbol's rows are kept in: its dates and each price column
+def column_arrays(df):
+	arrays = {'date': df.index.to_numpy(dtype='datetime64[ns]')}
+	for pos, col in enumerate(df.columns):
+		arrays['c' + str(pos)] = df[col].to_numpy(dtype=np.float64)
+	return arrays
+
+#-------------------------------------files-------------------------------------
+# each version of a symbol's files is saved under names holding a new token,
+# and the header naming that token is replaced last, so a reader is never
+# handed half written files
+
+# returns the header of a symbol's folder, or None if it has none
+def read_header(folder):
+	try:
+		with open(os.path.join(folder, HEADER_FILE)) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return None
+
+# returns the column called name of the version of a folder its header names,
+# memory-mapped
+def load_column(folder, header, name):
+	return np.load(os.path.join(folder, name + '-' + header['token'] + '.npy'),
+				   mmap_mode='r')
+
+# saves arrays ({name: array}) as a new version of a folder, then replaces its
+# header with header plus the token of the new version, and removes the files
+# of older versions
+def write_columns(folder, arrays, header):
+	os.makedirs(folder, exist_ok=True)
+	token = uuid.uuid4().hex
+	for name, array in arrays.items():
+		np.save(os.path.join(folder, name + '-' + token + '.npy'), array)
+
+	replace_header(folder, dict(header, token=token))
+	for name in os.listdir(folder):
+		if name.endswith('.npy') and token not in name:
+			os.remove(os.path.join(folder, name))
+
+# appends rows to the files of the current version of a folder in place, then
+# replaces its header with header (which counts the new total in 'rows').
+# Each file is first cut back to the rows the old header counts, so rows left
+# behind by an interrupted append are written over, and its .npy header is
+# rewritten in place to the new length, which numpy leaves room for. Readers
+# take only the first header['rows'] rows.
+def append_columns(folder, arrays, header):
+	old = read_header(folder)
+	rows = old['rows']
+	for name, array in arrays.items():
+		path = os.path.join(folder, name + '-' + old['token'] + '.npy')
+		with open(path, 'r+b') as f:
+			version = np.lib.format.read_magic(f)
+			if version == (1, 0):
+				shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+			else:
+				shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+			start = f.tell()
+			array = np.ascontiguousarray(array, dtype=dtype)
+			if fortran or array.shape[1:] != shape[1:]:
+				raise ValueError(path + ': rows of shape ' + str(array.shape)
+								 + ' cannot be appended to ' + str(shape))
+			new_header = io.BytesIO()
+			np.lib.format.write_array_header_1_0(
+				new_header, {'descr': np.lib.format.dtype_to_descr(dtype),
+							 'fortran_order': False,
+							 'shape': (rows + len(array),) + shape[1:]})
+			if version != (1, 0) or len(new_header.getvalue()) != start:
+				raise ValueError(path + ': the header of the file cannot be '
+								 'rewritten in place')
+
+			f.seek(start + rows * dtype.itemsize * int(np.prod(shape[1:])))
+			f.truncate()
+			f.write(array.tobytes())
+			f.seek(0)
+			f.write(new_header.getvalue())
+
+	replace_header(folder, dict(header, token=old['token']))
+
+# writes the header of a folder through a temp file of its own, so readers and
+# other writers only ever see a whole header
+def replace_header(folder, header):
+	tmp = os.path.join(folder, HEADER_FILE + '.' + uuid.uuid4().hex + '.tmp')
+	with open(tmp, 'w') as f:
+		json.dump(header, f)
+	os.replace(tmp, os.path.join(folder, HEADER_FILE))
+
+# adds the options of a store (--store, --offline, --fixture) to a parser
+def add_store_args(parser):
+	parser.add_argument('--store', default=STORE,
+						help='directory the prices are kept in')
+	parser.add_argument('--offline', action='store_true',
+						help='only read the prices already stored')
+	parser.add_argument('--fixture',
+						help='read new prices from SYMBOL.csv files in this '
+							 'directory instead of downloading them')
+
+# returns the PriceStore asked for by the options of add_store_args
+def store_from_args(args):
+	sources = None
+	if args.fixture is not None:
+		sources = fixture_sources(args.fixture)
+	return PriceStore(args.store, sources, args.offline)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+		description='Updates the stored price history of each symbol.')
+	parser.add_argument('symbols', nargs='*', default=list(SOURCES))
+	add_store_args(parser)
+	args = parser.parse_args()
+	store = store_from_args(args)
+	for symbol in args.symbols:
+		added = store.update(symbol)
+		header = store.header(symbol)
+		if header is None:
+			print(symbol + ': not stored')
+		else:
+			print(symbol + ': ' + str(header['rows']) + ' rows from '
+				  + header['first'] + ' to ' + header['last'] + ' ('
+				  + str(added) + ' new)')
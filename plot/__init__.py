@@ -0,0 +1,27 @@
+# plot
+#
+# Plots Affdex or Leda data of several participants around a timestamp, with
+# an aggregate line (see plot/plot.py). normalize, batch_plot and
+# create_aggr_col can be imported straight from the package, and the plot
+# function from plot.plot (the name plot is taken by the module itself); the
+# module, and matplotlib, which it only imports when drawing, are loaded when
+# first used.
+#
+# command line: python3 -m plot Leda plot_in.csv analysis.phasicData mean 100
+#	or python3 -m plot batch plot_in.csv spec.csv (the same arguments as
+#	plot.py)
+
+from importlib import import_module
+
+# public name -> module it lives in
+_EXPORTS = {'batch_plot': 'plot', 'normalize': 'plot',
+			'create_aggr_col': 'plot'}
+
+
+def __getattr__(name):
+	if name not in _EXPORTS:
+		raise AttributeError("module 'plot' has no attribute " + repr(name))
+	return getattr(import_module('plot.' + _EXPORTS[name]), name)
+
+def __dir__():
+	return sorted(list(globals()) + list(_EXPORTS))
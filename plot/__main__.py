@@ -0,0 +1,5 @@
+# runs plot from the command line: python3 -m plot ...
+
+from plot.plot import main
+
+main()
@@ -1,13 +1,34 @@
+import os
+import sys
+if not __package__:
+	# run as a script (python3 plot/plot.py): import the query folder next to
+	# this one as the query package (see query/scriptpath.py)
+	sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+					'..', 'query'))
+	import scriptpath
 import numpy as np
 import pandas as pd
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import datetime as dt
-import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from query.aggregate import aggregateBounds, getAggregate
+from query.catalog import openCatalog, splitFile
+from query.loader import loadSensorFile
 
 # visualizes affdex or leda data for multiple players over a specified time range using matplotlib.
-# This version does not take in command line args. 
+# matplotlib is only imported when something is drawn (see pyplot), so that
+# importing this module for normalize or the loaders stays fast.
+
+# directory holding the Afdx and Leda folders, unless another one is given
+DIRECTORY = '/Users/Eli/Desktop/LEEPS/'
+
+# returns matplotlib.pyplot, importing it on first use with the Agg backend
+# (plots are only saved to files)
+def pyplot():
+	import matplotlib
+	matplotlib.use('Agg')
+	import matplotlib.pyplot as plt
+	return plt
 
 # makes IDs 1-9 into 01-09
 def make_valid_ID(num):
@@ -15,14 +36,28 @@ def make_valid_ID(num):
 		num = '0' + str(num)
 	return str(num)
 
-# takes filenames and returns initial timestamp and computer ID
-def splitFile(filename):
-    if filename is None:
-        return None
-    components = filename.split('_')
-    timestamp = components[-2]
-    compNumber = components[-3].split('-')[1]
-    return (timestamp, compNumber)
+# returns True if fcn is the name of an aggregate that can be plotted: any
+# aggregate registered in query.aggregate (mean, median, p95...) that does not
+# depend on the times of the values, since the aggregate line is taken over
+# the participants at each time
+def is_plot_fcn(fcn):
+	try:
+		return not getAggregate(fcn).usesTime
+	except ValueError:
+		return False
+
+# the same as is_plot_fcn, for argparse: returns fcn, or raises ValueError
+def plot_fcn(fcn):
+	if not is_plot_fcn(fcn):
+		raise ValueError(fcn)
+	return fcn
+
+# returns the aggregate (by a function) of every time column of a
+# participants x time array, as a float64 array. Missing values are skipped,
+# and a column without any is NaN; std has ddof=1, as the pandas method.
+def aggregate_grid(grid, fcn):
+	grid = grid.astype(np.float64)
+	return aggregateBounds(grid, [0], [grid.shape[0]], [fcn], ddof=1)[0, :, 0]
 
 # creates a dataframe with one column, the aggregate (by a function) of all
 # columns in the df passed as an argument
@@ -30,67 +65,53 @@ def create_aggr_col(df, fcn):
 	df_aggr = pd.DataFrame()
 	if len(df) == 0:
 		return df_aggr
-	if fcn  == 'mean':
-		df_aggr[fcn] = df.mean(axis=1)
-	elif fcn  == 'median':
-		df_aggr[fcn] = df.median(axis=1)
-	elif fcn  == 'max':
-		df_aggr[fcn] = df.max(axis=1)
-	elif fcn  == 'min':
-		df_aggr[fcn] = df.min(axis=1)
-	elif fcn  == 'std':
-		df_aggr[fcn] = df.std(axis=1)
-	elif fcn == 'sum':
-		df_aggr[fcn] = df.sum(axis=1)
+	if is_plot_fcn(fcn):
+		df_aggr[fcn] = pd.Series(aggregate_grid(df.to_numpy().T, fcn),
+								 index=df.index)
 	return df_aggr
 
-#used to find closest file_ts before or up to 10 minutes after ts
-#returns difference in time
-def time_range(ts, file_ts):
-	if int(file_ts) <= ts + 600000:
-		return abs(int(file_ts) - ts)
-	else:
-		return -1
+# returns how many decimals the index of a df resampled at rate needs (at
+# least 1, so 200 ms steps give the usual 0.2 second index)
+def rate_decimals(rate):
+	step = pd.Timedelta(rate).total_seconds()
+	decimals = 1
+	while decimals < 3 and round(step, decimals) != step:
+		decimals += 1
+	return decimals
 
 # normalizes a dataframe from a csv file:
 # 1) pads all missing index data by filling forward
-# 2) resamples the timestamp index to 5 samples per second
+# 2) resamples the timestamp index to 5 samples per second (or to rate)
 # 3) makes the index a range from -x to y, with 0 being the
 # 	 timestamp given as an arg
-def normalize(afdxleda, fname, timestamp):
-
-	if afdxleda == 'Afdx':
-		index_col = 'delta_secs'
-	elif afdxleda == 'Leda':
-		index_col = 'data.time.data'
+# if columns is given, only those columns are read from the file
+def normalize(afdxleda, fname, timestamp, columns=None, rate='200ms'):
 
 	# make timestamp a 13 digit (millisecond) number (used in case a 9-digit
 	# timestamp accurate to seconds is given)
 	while timestamp / 1000000000000 < 1:
 		timestamp *= 10
 
-	#prepare df
-	df = pd.read_csv(fname)
+	#prepare df (loadSensorFile fills the index forward, drops rows before
+	# the first deltatime and sorts it)
+	df = loadSensorFile(fname, afdxleda, columns)
 	file_ts, compNumber = splitFile(fname)
-	df[index_col].fillna(method='pad', inplace=True)
 
-	#convert deltatimes to timestamps
-	for index in df.index:
-		new_ts = int(float(df[index_col][index]) * 1000 + int(file_ts))
-		df.set_value(index, index_col, new_ts)
+	#convert deltatimes to timestamps, all at once
+	timestamps = (df.index.to_numpy() * 1000 + int(file_ts)).astype(np.int64)
 
 	# convert index to datetime, resample data to 5x per second,
 	# reconvert back to timestamps
-	df[index_col] = pd.to_datetime(df[index_col], unit = 'ms')
-	df.set_index(index_col, inplace=True)
-	df = df.resample('200L').mean()
+	df = df.set_axis(pd.to_datetime(timestamps, unit='ms'), axis=0)
+	df = df.resample(rate).mean()
 
-	#c onvert index back to timestamps
-	df.index = df.index.astype(np.int64) / 10**6
+	#convert index back to timestamps
+	ms = (df.index - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1)
 
 	# normalize df's timestamps to have -n < timestamp < m; convert timestamps
 	# back to normalized deltatimes
-	df.set_index(np.round((df.index - timestamp) / 1000, 1), inplace=True)
+	df.index = np.round((ms.to_numpy(dtype=np.float64) - timestamp) / 1000,
+						rate_decimals(rate))
 	return df
 
 # finds a csv file with matching type (afdx or leda), matching leeps ID, and
@@ -101,88 +122,303 @@ def find_csv(afdxleda, directory, ID, ts):
 	filename = 'NaN'
 
 	#error handling
-	if afdxleda == 'Afdx':
-		name_start = 'Affd'
-	elif afdxleda == 'Leda':
-		name_start = 'Leda'
-	else:
+	if afdxleda != 'Afdx' and afdxleda != 'Leda':
 		print('afdxleda must be either "Afdx" or "Leda"')
 		return
 
-	#get file matching ID from given directory
-	closest = -1
+	#get the closest file matching ID from the catalog of the given directory
+	# (a file may start any time before ts, or up to 10 minutes after it)
 	directory += afdxleda + '/'
-	for _, dirnames, filenames in os.walk(directory):
-		for filen in filenames:
-			name, ext = os.path.splitext(filen)
-			if ext == '.csv' and name[0:4] == name_start:
-				timestamp, compNumber = splitFile(filen)
-				if compNumber == ID and time_range(int(ts), timestamp) != -1
-						and (time_range(int(ts), timestamp) < closest
-						or closest == -1):
-					filename = filen
-					closest = time_range(int(ts), timestamp)
-
-	if(filename != 'NaN'):
-		filename = directory + filename
+	match = openCatalog(directory).closest(afdxleda, ID, ts, after=600000)
+	if match is not None:
+		filename = match[1]
 
 	return filename
 
+# returns (step, first, last): the resampling step in seconds, and the first
+# and last multiples of it between -delta_t and delta_t
+def axis_steps(delta_t, rate='200ms'):
+	step = pd.Timedelta(rate).total_seconds()
+	first = int(np.ceil(-delta_t / step - 1e-9))
+	last = int(np.floor(delta_t / step + 1e-9))
+	return step, first, last
+
+# returns the fixed time axis of a plot: every multiple of the resampling
+# step from -delta_t to delta_t, in seconds
+def time_axis(delta_t, rate='200ms'):
+	step, first, last = axis_steps(delta_t, rate)
+	return np.round(np.arange(first, last + 1) * step, rate_decimals(rate))
+
+# returns (positions, keep): the position on time_axis(delta_t, rate) of each
+# value of a normalized index, and which values fall on the axis. Values
+# between two steps go to the earlier one, which lines up resampled indices
+# that are off by a fraction of a step (1.1, 1.3 vs 1.0, 1.2, 1.4).
+def axis_positions(index, delta_t, rate='200ms'):
+	step, first, last = axis_steps(delta_t, rate)
+	index = np.asarray(index, dtype=np.float64)
+	steps = np.floor(index / step + 1e-6).astype(np.int64)
+	keep = ((index >= -delta_t - 1e-9) & (index <= delta_t + step / 2)
+			& (steps >= first) & (steps <= last))
+	return steps - first, keep
+
+# finds and normalizes the file of one participant once, and places the values
+# of each (var, delta_t) in var_ranges within its x range on the time axis.
+# Runs in a worker process when plots are given several workers.
+# returns a list with, for each (var, delta_t), (name, positions, values), or
+# (None, error message, None) if the participant has no data to plot for it
+# (no file, a file that cannot be read, or no values in range)
+def load_participant_vars(afdxleda, directory, ID, ts, var_ranges,
+						  rate='200ms'):
+	#find closest csv file
+	fname = find_csv(afdxleda, directory, ID, ts)
+	if fname == 'NaN':
+		error = ('ERROR: no ' + afdxleda + ' file found for ID ' + ID
+				 + ' near timestamp ' + str(ts))
+		return [(None, error, None)] * len(var_ranges)
+
+	#normalize it to a 0-timestamp and 5 samples per second; a file that
+	# cannot be read is reported for this participant only
+	variables = list(dict.fromkeys(var for var, delta_t in var_ranges))
+	try:
+		df_temp = normalize(afdxleda, fname, ts, variables, rate)
+	except KeyError as e:
+		error = ('ERROR: ' + afdxleda + ' file ' + fname + ' has no column'
+				 + ' header ' + str(e))
+		return [(None, error, None)] * len(var_ranges)
+	except (ValueError, OSError) as e:
+		error = 'ERROR: could not read ' + fname + ': ' + str(e)
+		return [(None, error, None)] * len(var_ranges)
+
+	results = []
+	for var, delta_t in var_ranges:
+		#check that the variable name is an existing column
+		if var not in df_temp.columns.values:
+			results.append((None, 'ERROR: "' + var + '" is not a column in '
+							+ 'dataframe ' + fname, None))
+			continue
+
+		#get the values within the x range and their places on the time axis
+		positions, keep = axis_positions(df_temp.index, delta_t, rate)
+		if not keep.any():
+			results.append((None, 'ERROR: no ' + var + ' data in range -'
+							+ str(delta_t) + ' to ' + str(delta_t)
+							+ ' in file ' + fname, None))
+			continue
+		values = df_temp[var].to_numpy(dtype=np.float32)[keep]
+		results.append((splitFile(fname)[1], positions[keep], values))
+	return results
+
+# runs load_participant_vars for every row of df_in, on a pool of workers
+# processes if workers > 1; returns the results in the order of the rows
+def load_participants(afdxleda, directory, df_in, var_ranges, rate='200ms',
+					  workers=1):
+	jobs = []
+	for row in range(len(df_in.index)):
+		jobs.append((afdxleda, directory, make_valid_ID(df_in.iloc[row, 0]),
+					 df_in.iloc[row, 1], var_ranges, rate))
+
+	if workers <= 1:
+		return [load_participant_vars(*job) for job in jobs]
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		futures = [pool.submit(load_participant_vars, *job) for job in jobs]
+		return [future.result() for future in futures]
+
+# writes the participants' results for one plot into a participants x time
+# float32 array on the time axis; returns (grid, names, errors), leaving out
+# the participants that have no data
+def build_grid(results, axis):
+	grid = np.full((len(results), len(axis)), np.nan, dtype=np.float32)
+	names = []
+	errors = []
+	for name, positions, values in results:
+		if name is None:
+			errors.append(positions)
+		else:
+			#write the participant straight into its row
+			grid[len(names), positions] = values
+			names.append(name)
+	return grid[:len(names)], names, errors
+
+# prints the errors of the participants that were left out of a plot
+def print_errors(errors, total):
+	if len(errors) > 0:
+		print(str(len(errors)) + ' of ' + str(total)
+			  + ' participants were left out:')
+		for error in errors:
+			print('    ' + error)
+
+# draws the participants of a grid and their aggregate on ax
+def draw_plot(ax, axis, grid, names, var, fcn, message=''):
+	#create aggregate col
+	df_aggr = pd.DataFrame({fcn: aggregate_grid(grid, fcn)}, index=axis)
+
+	#plot data
+	df = pd.DataFrame(grid.T, index=axis, columns=names)
+	df.plot(ax=ax, zorder=1, alpha=.55)
+	ax.axvline(x=0, color='#999999', linewidth=3, zorder=0)
+	df_aggr.plot(ax=ax, color='#1c5b7d', linewidth=3, zorder=2)
+	ax.legend(loc='best')
+	ax.set_xlabel('delta seconds\n' + message)
+	ax.set_ylabel(var)
+	ax.set_title(fcn + ' of ' + var)
+
 # takes in a toggle for afdx or leda, a csv file with timestamps and IDs,
 # a variable (column header), a function, a time ramge, and an optional message
 # finds matching csv files, normalizes them, and plots them within the time
 # range (from the now normalized 0 timestamp)
+# every participant is written straight into its row of a participants x time
+# float32 array on a fixed time axis, and the aggregate is computed over it.
+# Files are loaded by workers processes at once; participants that cannot be
+# plotted are left out and reported together at the end.
 # saves the plot to a file called plot.pf
-def plot(afdxleda, df_in, var, fcn, delta_t, message=''):
+def plot(afdxleda, df_in, var, fcn, delta_t, message='', rate='200ms',
+		 directory=DIRECTORY, workers=1):
 
-	df = pd.DataFrame()
+	if not is_plot_fcn(fcn):
+		print('ERROR: fcn must be an aggregate that does not use time, such '
+			  'as mean, std, min, max, sum, median or a percentile (p95)')
+		return
+	if afdxleda != 'Afdx' and afdxleda != 'Leda':
+		print('afdxleda must be either "Afdx" or "Leda"')
+		return
 	if not isinstance(df_in, pd.DataFrame):
 		df_in = pd.read_csv(df_in)
-	directory = '/Users/Eli/Desktop/LEEPS/'
-	for row in df_in.index:
-		#find closest csv file
-		fname = find_csv(afdxleda, directory, make_valid_ID(df_in.iloc[row, 0]),
-						 df_in.iloc[row, 1])
-		if fname != 'NaN':
-			#normalize it to a 0-timestamp and 5 samples per second
-			df_temp = normalize(afdxleda, fname, df_in.iloc[row, 1])
-			#check that the variable name is an existing column
-			if var in df_temp.columns.values:
-				col_name = splitFile(fname)[1]
-				#create series with variable info and x range
-				column = pd.Series(df_temp[var][-delta_t:delta_t + .1],
-							name=col_name)
-				if (len(column) == 0):
-					print('ERROR: no ' + var + ' data in range -'
-						  + str(delta_t) + ' to ' + str(delta_t)
-						  + ' in file ' + fname)
-				else:
-					#align all indices to be even decimals (1.0, 1.2, 1.4
-					# vs 1.1, 1.3, 1.5)
-					if column.index[0] * 10 % 2 == 1:
-				 		column.index = (10 * column.index - 1) / 10
-					df[col_name] = column
-			else:
-				print('ERROR: "' + var + '" is not a column in dataframe')
-				return
 
-	#create aggregate col
-	df_aggr = create_aggr_col(df, fcn)
-	if len(df) == 0:
+	axis = time_axis(delta_t, rate)
+	results = load_participants(afdxleda, directory, df_in, [(var, delta_t)],
+								rate, workers)
+	grid, names, errors = build_grid([result[0] for result in results], axis)
+
+	print_errors(errors, len(results))
+	if len(names) == 0:
 		print('ERROR: no data in dataframe')
 		return
-	#plot data
-	ax1 = df.plot(zorder=1, alpha=.55)
-	plt.axvline(x=0, color='#999999', linewidth=3, zorder=0)
-	df_aggr.plot(ax=ax1, color='#1c5b7d', linewidth=3, zorder=2)
-	plt.legend(loc='best')
-	plt.xlabel('delta seconds\n' + message)
-	plt.ylabel(var)
-	plt.title(fcn + ' of ' + var)
-	plt.savefig('plot.pdf', bbox_inches='tight')
-
-def main():
-	plot('Leda', '/Users/Eli/Desktop/LEEPS/plot_in.csv', 'analysis.phasicData',
-		 'mean', 100, '"this is a sample message"')
-
-main()
+
+	plt = pyplot()
+	fig = plt.figure()
+	draw_plot(fig.add_subplot(1, 1, 1), axis, grid, names, var, fcn, message)
+	fig.savefig('plot.pdf', bbox_inches='tight')
+	plt.close(fig)
+
+# plots every job of a spec from one load of each participant's file. spec is
+# a DataFrame (or csv file) with columns afdxleda, var, fcn and delta_t, one
+# row per plot. Each participant's Afdx and Leda files are found and
+# normalized once, for all the variables the spec asks of them, and every
+# figure is drawn from memory on one reused figure. If output ends in .pdf,
+# the plots are the pages of that file; otherwise they are written to
+# numbered files (plots.png -> plots_1.png, plots_2.png, ...).
+def batch_plot(spec, df_in, output='plots.pdf', message='', rate='200ms',
+			   directory=DIRECTORY, workers=1):
+	if not isinstance(spec, pd.DataFrame):
+		spec = pd.read_csv(spec)
+	if not isinstance(df_in, pd.DataFrame):
+		df_in = pd.read_csv(df_in)
+	jobs = list(spec[['afdxleda', 'var', 'fcn', 'delta_t']]
+				.itertuples(index=False, name=None))
+	for afdxleda, var, fcn, delta_t in jobs:
+		if afdxleda not in ('Afdx', 'Leda') or not is_plot_fcn(fcn):
+			print('ERROR: cannot plot ' + str(fcn) + ' of ' + str(var)
+				  + ' from ' + str(afdxleda))
+			return
+
+	#load every participant once per kind of file, for all of its jobs
+	loaded = {}
+	for afdxleda in dict.fromkeys(job[0] for job in jobs):
+		var_ranges = list(dict.fromkeys((var, delta_t) for kind, var, fcn,
+										delta_t in jobs if kind == afdxleda))
+		results = load_participants(afdxleda, directory, df_in, var_ranges,
+									rate, workers)
+		for i, var_range in enumerate(var_ranges):
+			loaded[(afdxleda,) + var_range] = [result[i] for result
+											   in results]
+
+	base, ext = os.path.splitext(output)
+	plt = pyplot()
+	from matplotlib.backends.backend_pdf import PdfPages
+	pages = PdfPages(output) if ext == '.pdf' else None
+	fig = plt.figure()
+	try:
+		for number, (afdxleda, var, fcn, delta_t) in enumerate(jobs, 1):
+			results = loaded[(afdxleda, var, delta_t)]
+			axis = time_axis(delta_t, rate)
+			grid, names, errors = build_grid(results, axis)
+			print(afdxleda + ' ' + fcn + ' of ' + var + ' (' + str(delta_t)
+				  + ' s): ' + str(len(names)) + ' participants')
+			print_errors(errors, len(results))
+			if len(names) == 0:
+				continue
+
+			fig.clf()
+			draw_plot(fig.add_subplot(1, 1, 1), axis, grid, names, var, fcn,
+					  message)
+			if pages is not None:
+				pages.savefig(fig, bbox_inches='tight')
+			else:
+				fig.savefig(base + '_' + str(number) + ext,
+							bbox_inches='tight')
+	finally:
+		plt.close(fig)
+		if pages is not None:
+			pages.close()
+
+# parses command line arguments for plot, for example:
+# python3 plot.py Leda /Users/Eli/Desktop/LEEPS/plot_in.csv
+#	analysis.phasicData mean 100 --message "this is a sample message"
+#	--workers 8
+def parse_args(args):
+	parser = argparse.ArgumentParser(
+		description='Plots Affdex or Leda data of several participants around '
+					'a timestamp, with an aggregate line.')
+	parser.add_argument('afdxleda', choices=['Afdx', 'Leda'])
+	parser.add_argument('input', help='csv file of IDs and timestamps')
+	parser.add_argument('var')
+	parser.add_argument('fcn', type=plot_fcn,
+						help='mean, std, min, max, sum, median or a percentile '
+							 '(p95)')
+	parser.add_argument('delta_t', type=float)
+	add_common_args(parser)
+	return parser.parse_args(args)
+
+# parses command line arguments for a batch of plots, for example:
+# python3 plot.py batch /Users/Eli/Desktop/LEEPS/plot_in.csv spec.csv
+#	--output plots.pdf --workers 8
+# where spec.csv has the columns afdxleda,var,fcn,delta_t
+def parse_batch_args(args):
+	parser = argparse.ArgumentParser(
+		prog='plot.py batch',
+		description='Renders many plots from one load of each file.')
+	parser.add_argument('input', help='csv file of IDs and timestamps')
+	parser.add_argument('spec', help='csv file with the columns afdxleda, '
+						'var, fcn and delta_t, one row per plot')
+	parser.add_argument('--output', default='plots.pdf',
+						help='multi-page pdf, or any other file name to get '
+							 'numbered files')
+	add_common_args(parser)
+	return parser.parse_args(args)
+
+# adds the options shared by single and batch plots
+def add_common_args(parser):
+	parser.add_argument('--message', default='')
+	parser.add_argument('--directory', default=DIRECTORY,
+						help='directory holding the Afdx and Leda folders')
+	parser.add_argument('--rate', default='200ms',
+						help='resampling rate, e.g. 200ms or 1s')
+	parser.add_argument('--workers', type=int, default=1,
+						help='number of processes loading files at once')
+
+# runs a plot or a batch of plots from command line arguments (sys.argv if
+# args is None); this is what python3 -m plot and python3 plot.py run
+def main(args=None):
+	if args is None:
+		args = sys.argv[1:]
+	if len(args) > 0 and args[0] == 'batch':
+		args = parse_batch_args(args[1:])
+		batch_plot(args.spec, args.input, args.output, args.message,
+				   args.rate, args.directory, args.workers)
+	else:
+		args = parse_args(args)
+		plot(args.afdxleda, args.input, args.var, args.fcn, args.delta_t,
+			 args.message, args.rate, args.directory, args.workers)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,37 @@
+# query
+#
+# Pulls Affdex and Leda sensor data around oTree screen timestamps and merges
+# aggregates of it into the oTree sheet (see querymerge), along with the file
+# catalog, loaders, window aggregates and converters it is built on.
+#
+# The names below can be imported straight from the package
+# (from query import merge); their modules are only imported when a name is
+# first used, so importing the package costs nothing until then.
+#
+# command line: python3 -m query DIRECTORY OTREEFILE IDCOL SCREENS VARS FCNS
+#	DELTA_TS [options] (the same arguments as querymerge.py)
+
+from importlib import import_module
+
+# public name -> module it lives in
+_EXPORTS = {
+    'merge': 'querymerge', 'enrich': 'querymerge',
+    'evaluate': 'querymerge', 'evaluateScreens': 'querymerge',
+    'queryAfdx': 'querymerge', 'queryLeda': 'querymerge',
+    'parse_ts': 'querymerge', 'parseTimestamps': 'querymerge',
+    'openCatalog': 'catalog', 'splitFile': 'catalog',
+    'loadSensorFile': 'loader', 'readSensorFile': 'loader',
+    'setCacheBudget': 'loader',
+    'aggregateWindows': 'aggregate', 'register': 'aggregate',
+    'SensorSession': 'fused',
+    'ResultStore': 'resultstore',
+}
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError("module 'query' has no attribute " + repr(name))
+    return getattr(import_module('query.' + _EXPORTS[name]), name)
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS))
@@ -0,0 +1,5 @@
+# runs querymerge from the command line: python3 -m query ...
+
+from query.querymerge import main
+
+main()
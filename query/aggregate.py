@@ -0,0 +1,539 @@
+# aggregate
+#
+# Computes aggregates (mean, std, median, percentiles, slope, area under the
+# curve, peak count...) of several columns of a sensor DataFrame over many
+# time windows at once. The window bounds are found with one searchsorted on
+# the sorted time index, and every aggregate is computed for all windows
+# together from arrays built once per query and shared between aggregates:
+# running counts and sums for mean, std and sum, one reduceat per column
+# block for min and max, one sort of each window's rows for median and all
+# percentiles, running sums over each column's samples for area, and one
+# pass over each column's turning points for peaks. So the cost is a few
+# passes over the data no matter how many windows (screens) or aggregates are
+# asked for.
+#
+# Missing values are skipped and std has ddof=0, the same results np.mean,
+# np.std, np.min and np.max give when they are applied to a pandas Series.
+#
+# Aggregates are kept in a registry (see register), which plot uses as well,
+# so a new one is added once and can be used by both.
+
+import re
+
+import numpy as np
+
+from query import instrument
+
+# values a block of windows may hold when the rows of each window are gathered
+# (for quantiles and slope)
+BLOCK_SIZE = 2**22
+
+
+# a registered aggregate. compute(windows, name) returns an array of shape
+# (windows, columns) for a Windows and the canonical name of the aggregate.
+# usesTime is True for aggregates that depend on the times of the values (so
+# they need the time index), pattern is a regular expression of the names of
+# a family of aggregates (such as p95), and quantile, if given, returns the
+# quantile (0 to 100) a name asks for, so that every quantile of a query
+# shares one sort of its windows
+class Aggregate:
+
+    def __init__(self, name, compute, usesTime=False, pattern=None,
+                 quantile=None):
+        self.name = name
+        self.compute = compute
+        self.usesTime = usesTime
+        self.pattern = None if pattern is None else re.compile(pattern)
+        self.quantile = quantile
+
+
+# canonical name -> Aggregate, and the aggregates that are families of names
+AGGREGATES = {}
+PATTERNS = []
+
+# the names each function can be given as on the command line
+FCN_NAMES = {}
+
+
+# adds an aggregate under its canonical name and aliases (or, with a
+# pattern, every name matching it); returns the Aggregate
+def register(name, compute, aliases=(), usesTime=False, pattern=None,
+             quantile=None):
+    aggregate = Aggregate(name, compute, usesTime, pattern, quantile)
+    if pattern is None:
+        AGGREGATES[name] = aggregate
+        FCN_NAMES[name] = name
+        for alias in aliases:
+            FCN_NAMES[alias] = name
+    else:
+        PATTERNS.append(aggregate)
+    return aggregate
+
+# returns the canonical name of a function name (such as 'mean' for
+# 'np.mean'; a name of a family, such as p95, is its own); raises ValueError
+# for functions that are not registered
+def fcnName(fcn):
+    if fcn in FCN_NAMES:
+        return FCN_NAMES[fcn]
+    for aggregate in PATTERNS:
+        if aggregate.pattern.fullmatch(str(fcn)):
+            return fcn
+    raise ValueError('unsupported function ' + str(fcn) + '; use one of '
+                     + ', '.join(sorted(FCN_NAMES)
+                                 + [aggregate.name for aggregate in PATTERNS]))
+
+# returns the Aggregate of a function name; raises ValueError for functions
+# that are not registered
+def getAggregate(fcn):
+    name = fcnName(fcn)
+    if name in AGGREGATES:
+        return AGGREGATES[name]
+    for aggregate in PATTERNS:
+        if aggregate.pattern.fullmatch(name):
+            return aggregate
+
+# returns (lo, hi) arrays such that rows lo[i]:hi[i] of a sorted index are the
+# rows with start[i] <= index <= end[i]. Both bounds come from one
+# searchsorted: searching left for the next float after end is the same as
+# searching right for end.
+def windowBounds(index, starts, ends):
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.nextafter(np.asarray(ends, dtype=np.float64), np.inf)
+    bounds = np.searchsorted(index, np.concatenate([starts, ends]))
+    return bounds[:len(starts)], bounds[len(starts):]
+
+# computes fcns over the given columns of values (a rows x columns float
+# array) for each window of rows lo[i]:hi[i]. times are the times of the rows
+# in seconds, which the aggregates that use them need, and ddof the delta
+# degrees of freedom of std.
+# returns an array of shape (windows, columns, fcns); empty windows are NaN
+def aggregateBounds(values, lo, hi, fcns, times=None, ddof=0):
+    nwindows = len(lo)
+    nrows, ncols = values.shape
+    names = [fcnName(fcn) for fcn in fcns]
+    if nwindows == 0 or ncols == 0:
+        return np.full((nwindows, ncols, len(names)), np.nan)
+
+    # only rows lo.min():hi.max() are in any window, so the shared arrays are
+    # built over those alone and a query of a few windows costs little
+    lo = np.asarray(lo, dtype=np.intp)
+    hi = np.asarray(hi, dtype=np.intp)
+    first = int(lo.min())
+    last = max(int(hi.max()), first)
+    if first > 0 or last < nrows:
+        values = values[first:last]
+        times = None if times is None else times[first:last]
+        lo = lo - first
+        hi = hi - first
+
+    windows = Windows(values, lo, hi, names, times, ddof)
+    computed = {}
+    for name in names:
+        if name not in computed:
+            computed[name] = getAggregate(name).compute(windows, name)
+    return collectResults(names, windows.counts() == 0, computed)
+
+
+# the windows of rows lo[i]:hi[i] of values (rows x columns) that one query
+# computes the aggregates in names over, with the arrays the aggregates
+# share, each built the first time one of them asks for it
+class Windows:
+
+    def __init__(self, values, lo, hi, names, times=None, ddof=0):
+        self.values = values
+        self.lo = np.asarray(lo, dtype=np.intp)
+        self.hi = np.asarray(hi, dtype=np.intp)
+        self.names = names
+        self.times = times
+        self.ddof = ddof
+        self.built = {}
+
+    # returns the array built by build(), building it on first use
+    def shared(self, key, build):
+        if key not in self.built:
+            self.built[key] = build()
+        return self.built[key]
+
+    # returns the number of values of each column in each window
+    def counts(self):
+        def build():
+            counts = prefixCounts(self.values)
+            return counts[self.hi] - counts[self.lo]
+        return self.shared('counts', build)
+
+    # returns the (shift, sums, squares) of prefixSums
+    def sums(self):
+        return self.shared('sums', lambda: prefixSums(self.values))
+
+    # returns (mean, std) of each column in each window, std with ddof=0
+    def meanStd(self):
+        def build():
+            shift, sums, squares = self.sums()
+            return prefixMeanStd(self.counts(), shift, sums, squares, self.lo,
+                                 self.hi)
+        return self.shared('meanStd', build)
+
+    # returns ufunc (np.fmin or np.fmax) of each column in each window
+    def reduce(self, ufunc):
+        # reduceat over interleaved (lo, hi) pairs reduces each window at the
+        # even positions; a row of NaN is appended so hi may equal nrows
+        def build():
+            ncols = self.values.shape[1]
+            padded = np.vstack([self.values, np.full((1, ncols), np.nan)])
+            pairs = np.empty(2 * len(self.lo), dtype=np.intp)
+            pairs[0::2] = self.lo
+            pairs[1::2] = self.hi
+            return padded, pairs
+        padded, pairs = self.shared('pairs', build)
+        return ufunc.reduceat(padded, pairs, axis=0)[0::2]
+
+    # returns the times of the rows in seconds; raises ValueError if they
+    # were not given
+    def rowTimes(self):
+        if self.times is None:
+            raise ValueError(', '.join(self.names) + ': the times of the '
+                             'values are needed')
+        return self.times
+
+    # returns {q: value at quantile q of each column in each window} for
+    # every quantile asked for by the aggregates in names. The rows of each
+    # window are sorted once, a block of windows at a time, and every
+    # quantile is interpolated from them the way np.nanpercentile does.
+    def quantiles(self):
+        return self.shared('quantiles', self.buildQuantiles)
+
+    def buildQuantiles(self):
+        qs = set()
+        for name in self.names:
+            aggregate = getAggregate(name)
+            if aggregate.quantile is not None:
+                qs.add(aggregate.quantile(name))
+        found = {q: np.full((len(self.lo), self.values.shape[1]), np.nan)
+                 for q in qs}
+        counts = self.counts().astype(np.intp)
+        for block, rows, window in self.blocks():
+            # missing values sort to the end of each window
+            window.sort(axis=1)
+            last = np.maximum(counts[block] - 1, 0)
+            for q in qs:
+                position = q / 100 * last
+                below = np.floor(position).astype(np.intp)
+                above = np.minimum(below + 1, last)
+                t = position - below
+                a = np.take_along_axis(window, below[:, None, :], axis=1)[:, 0]
+                b = np.take_along_axis(window, above[:, None, :], axis=1)[:, 0]
+                diff = b - a
+                found[q][block] = np.where(t >= 0.5, b - diff * (1 - t),
+                                           a + diff * t)
+        return found
+
+    # yields (block, rows, window) for blocks of at most BLOCK_SIZE values:
+    # block is a slice of the windows, and window[i, j] holds the values of
+    # row rows[i, j], the jth row of window i, or NaN past the end of it
+    def blocks(self):
+        nrows, ncols = self.values.shape
+        if nrows == 0:
+            return
+        length = max(int((self.hi - self.lo).max()), 1)
+        step = max(1, BLOCK_SIZE // (length * ncols))
+        for first in range(0, len(self.lo), step):
+            block = slice(first, first + step)
+            rows = self.lo[block, None] + np.arange(length)
+            past = rows >= self.hi[block, None]
+            rows = np.minimum(rows, nrows - 1)
+            window = self.values[rows]
+            window[past] = np.nan
+            yield block, rows, window
+
+    # returns, for each column, (rank, times, values) of its non-missing
+    # values, where rank[r] is the number of them before row r, so rows lo:hi
+    # hold the ones at positions rank[lo]:rank[hi]
+    def samples(self):
+        def build():
+            times = self.rowTimes()
+            ranks = prefixCounts(self.values).astype(np.intp)
+            found = []
+            for col in range(self.values.shape[1]):
+                valid = ~np.isnan(self.values[:, col])
+                found.append((ranks[:, col], times[valid],
+                              self.values[valid, col]))
+            return found
+        return self.shared('samples', build)
+
+# returns the running count of non-missing values of each column, with a
+# leading row of zeros, so counts[hi] - counts[lo] counts rows lo:hi
+def prefixCounts(values):
+    counts = np.zeros((values.shape[0] + 1, values.shape[1]))
+    np.cumsum(~np.isnan(values), axis=0, out=counts[1:])
+    return counts
+
+# returns (shift, sums, squares): the mean of each column, and the running
+# sums and sums of squares of the columns minus it, with a leading row of
+# zeros. Missing values count as zero.
+def prefixSums(values):
+    # shift each column by its mean before summing, so that the sums of
+    # squares do not lose precision for columns far from zero
+    nrows, ncols = values.shape
+    valid = ~np.isnan(values)
+    shift = np.zeros(ncols)
+    hasData = valid.any(axis=0)
+    shift[hasData] = np.nanmean(values[:, hasData], axis=0)
+    centered = np.where(valid, values - shift, 0.0)
+    sums = np.zeros((nrows + 1, ncols))
+    np.cumsum(centered, axis=0, out=sums[1:])
+    squares = np.zeros((nrows + 1, ncols))
+    np.cumsum(centered * centered, axis=0, out=squares[1:])
+    return shift, sums, squares
+
+# returns (mean, std) of the windows lo:hi from the output of prefixSums,
+# given the number n of values in each window
+def prefixMeanStd(n, shift, sums, squares, lo, hi):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centeredMean = (sums[hi] - sums[lo]) / n
+        variance = (squares[hi] - squares[lo]) / n - centeredMean**2
+    mean = centeredMean + shift
+    std = np.sqrt(np.maximum(variance, 0.0))
+    std[n == 1] = 0.0
+    return mean, std
+
+# puts the array computed for each function name in names into an array of
+# shape (windows, columns, fcns), with NaN for empty windows
+def collectResults(names, empty, computed):
+    results = np.full(empty.shape + (len(names),), np.nan)
+    for k, name in enumerate(names):
+        results[:, :, k] = np.where(empty, np.nan, computed[name])
+    return results
+
+# builds a segment tree of the columns of values for ufunc (np.fmin or
+# np.fmax): row size + i holds row i of values, and row j < size holds ufunc
+# of rows 2j and 2j + 1, where size is the smallest power of two >= the
+# number of rows. Missing values and padding are NaN, which fmin and fmax skip.
+def buildTree(values, ufunc):
+    nrows, ncols = values.shape
+    size = 1
+    while size < nrows:
+        size *= 2
+    tree = np.full((2 * size, ncols), np.nan)
+    tree[size:size + nrows] = values
+    level = size
+    while level > 1:
+        half = level // 2
+        tree[half:level] = ufunc(tree[level:2 * level:2],
+                                 tree[level + 1:2 * level:2])
+        level = half
+    return tree
+
+# reduces rows lo[i]:hi[i] of the values a segment tree was built from with
+# its ufunc, for all windows at once, visiting O(log rows) tree rows per
+# window. Only the visited rows are read, so tree can be memory-mapped.
+# returns an array of shape (windows, columns); empty windows are NaN
+def queryTree(tree, lo, hi, ufunc):
+    size = tree.shape[0] // 2
+    result = np.full((len(lo), tree.shape[1]), np.nan)
+    left = np.asarray(lo, dtype=np.intp) + size
+    right = np.asarray(hi, dtype=np.intp) + size
+    while True:
+        active = left < right
+        if not active.any():
+            return result
+        take = active & (left % 2 == 1)
+        result[take] = ufunc(result[take], tree[left[take]])
+        left[take] += 1
+        take = active & (right % 2 == 1)
+        right[take] -= 1
+        result[take] = ufunc(result[take], tree[right[take]])
+        left //= 2
+        right //= 2
+
+# computes fcns on the columns var_names of a DataFrame indexed by time in
+# ascending order (as loader returns them), for each (start, end) window of
+# index values (both ends inclusive). unit is the length of one unit of the
+# index in seconds, for the aggregates that use the times of the values.
+# returns (results, missingPos): results has shape
+# (windows, found var_names, fcns) and missingPos holds the positions in
+# var_names of the names that are not columns of df; raises ValueError if the
+# index of df is not sorted
+def aggregateWindows(df, windows, var_names, fcns, unit=1.0):
+    if not df.index.is_monotonic_increasing:
+        raise ValueError('the time index must be sorted in ascending order; '
+                         'read files with loader.loadSensorFile')
+    index = df.index.to_numpy(dtype=np.float64)
+    starts = [window[0] for window in windows]
+    ends = [window[1] for window in windows]
+    with instrument.stage('window'):
+        lo, hi = windowBounds(index, starts, ends)
+    return aggregateRows(df, lo, hi, var_names, fcns, unit)
+
+# same as aggregateWindows, for the windows of rows lo[i]:hi[i] of df
+def aggregateRows(df, lo, hi, var_names, fcns, unit=1.0):
+    names = set(df.columns.values)
+    missingPos = []
+    present = []
+    for pos, var_name in enumerate(var_names):
+        if var_name in names:
+            present.append(var_name)
+        else:
+            missingPos.append(pos)
+
+    # only the rows some window holds are copied (see aggregateBounds)
+    lo = np.asarray(lo, dtype=np.intp)
+    hi = np.asarray(hi, dtype=np.intp)
+    first = int(lo.min()) if len(lo) > 0 else 0
+    last = max(int(hi.max()), first) if len(hi) > 0 else 0
+    values = df[present].iloc[first:last].to_numpy(dtype=np.float64)
+    times = df.index[first:last].to_numpy(dtype=np.float64) * unit
+    with instrument.stage('aggregate'):
+        results = aggregateBounds(values, lo - first, hi - first, fcns, times)
+    instrument.count('aggregate', rows=last - first)
+    return results, missingPos
+
+
+#-----------------------------------aggregates----------------------------------
+
+def computeStd(windows, name):
+    std = windows.meanStd()[1]
+    if windows.ddof == 0:
+        return std
+    n = windows.counts()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n > windows.ddof,
+                        std * np.sqrt(n / (n - windows.ddof)), np.nan)
+
+def computeSum(windows, name):
+    shift, sums, squares = windows.sums()
+    return sums[windows.hi] - sums[windows.lo] + shift * windows.counts()
+
+# the q of a percentile name pNN
+def percentileOf(name):
+    return float(name[1:])
+
+# least squares slope of the values against their times, in units per second.
+# Times and values are centered on each window's means before they are
+# multiplied, so that windows far from time 0 keep their precision.
+def computeSlope(windows, name):
+    times = windows.rowTimes()
+    slope = np.full((len(windows.lo), windows.values.shape[1]), np.nan)
+    for block, rows, window in windows.blocks():
+        valid = ~np.isnan(window)
+        n = valid.sum(axis=1)
+        t = np.where(valid, times[rows][:, :, None], 0.0)
+        v = np.where(valid, window, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.where(valid, t - (t.sum(axis=1) / n)[:, None], 0.0)
+            v = np.where(valid, v - (v.sum(axis=1) / n)[:, None], 0.0)
+            spread = (t * t).sum(axis=1)
+            found = (t * v).sum(axis=1) / spread
+        #one value, or values all at the same time, have no slope
+        found[(n < 2) | (spread <= 0)] = np.nan
+        slope[block] = found
+    return slope
+
+# area under the values between the first and last value of each window, by
+# the trapezoidal rule, in units times seconds
+def computeAuc(windows, name):
+    auc = np.empty((len(windows.lo), windows.values.shape[1]))
+    for col, (ranks, times, values) in enumerate(windows.samples()):
+        if len(values) == 0:
+            auc[:, col] = np.nan
+            continue
+        area = np.zeros(len(values))
+        np.cumsum(np.diff(times) * (values[:-1] + values[1:]) / 2,
+                  out=area[1:])
+        first = ranks[windows.lo]
+        last = np.maximum(ranks[windows.hi] - 1, first)
+        auc[:, col] = (area[np.minimum(last, len(area) - 1)]
+                       - area[np.minimum(first, len(area) - 1)])
+    return auc
+
+# the least rise that peaks counts as a peak, from the lowest value since the
+# previous peak: 0.01, the usual least amplitude of a skin conductance
+# response in microsiemens. peaksNN counts peaks of at least NN instead.
+MIN_PEAK = 0.01
+
+# seconds over which peaks averages the values before looking for peaks, so
+# that noise of a few hundredths of the least amplitude does not split a
+# response (which rises over one to a few seconds) into several
+PEAK_SMOOTHING = 0.25
+
+# the least amplitude of a peak count name, peaks or peaksNN
+def peakAmplitude(name):
+    return MIN_PEAK if name == 'peaks' else float(name[len('peaks'):])
+
+# number of peaks in each window, found on the values averaged over
+# PEAK_SMOOTHING seconds (see risePeaks); a peak counts in a window if the
+# values before and after it are in the window as well
+def computePeaks(windows, name):
+    minimum = peakAmplitude(name)
+    peaks = np.empty((len(windows.lo), windows.values.shape[1]))
+    for col, (ranks, times, values) in enumerate(windows.samples()):
+        if len(values) == 0:
+            peaks[:, col] = np.nan
+            continue
+        isPeak = np.zeros(len(values), dtype=bool)
+        isPeak[risePeaks(smoothValues(times, values, PEAK_SMOOTHING),
+                         minimum)] = True
+        total = np.zeros(len(values) + 1)
+        np.cumsum(isPeak, out=total[1:])
+        first = np.minimum(ranks[windows.lo] + 1, len(values))
+        last = np.maximum(ranks[windows.hi] - 1, first)
+        peaks[:, col] = total[last] - total[first]
+    return peaks
+
+# returns the mean of the values within seconds/2 of the time of each value
+def smoothValues(times, values, seconds):
+    sums = np.zeros(len(values) + 1)
+    np.cumsum(values, out=sums[1:])
+    lo = np.searchsorted(times, times - seconds/2, side='left')
+    hi = np.searchsorted(times, times + seconds/2, side='right')
+    return (sums[hi] - sums[lo]) / (hi - lo)
+
+# returns the positions of the peaks of values, from onset to peak: a peak is
+# the highest value (the first of a flat top) of a rise of at least minimum
+# above the lowest value since the previous peak, and the signal must fall at
+# least minimum below it before the next rise starts, so small dips on the way
+# up or down do not count as peaks of their own. A rise still going on at the
+# last value ends in a peak as well.
+def risePeaks(values, minimum):
+    # the lowest and highest values of a rise are among the values that are
+    # lower (or higher) than the one before them and at most as low (or at
+    # least as high) as the one after them
+    before = values[1:-1] - values[:-2]
+    after = values[1:-1] - values[2:]
+    turns = np.flatnonzero(((before > 0) & (after >= 0))
+                           | ((before < 0) & (after <= 0))) + 1
+    found = []
+    trough = values[0]
+    top = None
+    for pos, value in zip(turns.tolist(), values[turns].tolist()):
+        if top is None:
+            if value < trough:
+                trough = value
+            elif value - trough >= minimum:
+                top = pos
+        elif value > values[top]:
+            top = pos
+        elif values[top] - value >= minimum:
+            found.append(top)
+            trough = value
+            top = None
+    if top is not None:
+        found.append(top)
+    return np.array(found, dtype=np.intp)
+
+register('mean', lambda windows, name: windows.meanStd()[0],
+         aliases=('np.mean',))
+register('std', computeStd, aliases=('np.std', 'sd'))
+register('min', lambda windows, name: windows.reduce(np.fmin),
+         aliases=('np.min',))
+register('max', lambda windows, name: windows.reduce(np.fmax),
+         aliases=('np.max',))
+register('sum', computeSum, aliases=('np.sum',))
+register('median', lambda windows, name: windows.quantiles()[50.0],
+         aliases=('np.median',), quantile=lambda name: 50.0)
+register('pNN', lambda windows, name: windows.quantiles()[percentileOf(name)],
+         pattern=r'p(100(\.0*)?|\d?\d(\.\d*)?)', quantile=percentileOf)
+register('slope', computeSlope, usesTime=True)
+register('auc', computeAuc, usesTime=True)
+register('peaks', computePeaks, usesTime=True)
+register('peaksNN', computePeaks, usesTime=True,
+         pattern=r'peaks(\d+(\.\d*)?|\.\d+)')
@@ -0,0 +1,67 @@
+# arrayfiles
+#
+# Folders of .npy arrays described by a small JSON header, written so that a
+# process reading or memory-mapping them is never handed a half written
+# version: each version's arrays are saved under file names holding a new
+# token, and the header naming that token is replaced last. The memory-mapped
+# sensor files (sensorarrays) and the window indexes (windowindex) are kept
+# this way.
+
+import json
+import os
+import uuid
+
+import numpy as np
+
+
+# returns the version of a source file an array folder is made from: its
+# size and modification time
+def sourceVersion(path):
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime': st.st_mtime_ns}
+
+# returns the header of an array folder, or None if it has none. If
+# sourcePath is given, None is also returned when the arrays were not made
+# from the current version of that file (see sourceVersion).
+def readHeader(folder, headerFile, sourcePath=None):
+    try:
+        with open(os.path.join(folder, headerFile)) as f:
+            header = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if sourcePath is not None:
+        version = sourceVersion(sourcePath)
+        if any(header.get(key) != value for key, value in version.items()):
+            return None
+    return header
+
+# returns the array called name of the version of a folder its header names,
+# memory-mapped by default
+def loadArray(folder, header, name, mmapMode='r'):
+    return np.load(os.path.join(folder, name + '-' + header['token'] + '.npy'),
+                   mmap_mode=mmapMode)
+
+# saves arrays ({name: array}) as a new version of a folder, then replaces
+# its header with header plus the token of the new version, and removes the
+# arrays of older versions (processes that still have them mapped keep their
+# pages until they let go of them). Returns the header written.
+def writeArrays(folder, headerFile, arrays, header):
+    os.makedirs(folder, exist_ok=True)
+    token = uuid.uuid4().hex
+    for name, array in arrays.items():
+        np.save(os.path.join(folder, name + '-' + token + '.npy'), array)
+
+    header = replaceHeader(folder, headerFile, dict(header, token=token))
+    for name in os.listdir(folder):
+        if name.endswith('.npy') and token not in name:
+            os.remove(os.path.join(folder, name))
+    return header
+
+# writes the header of a folder through a temp file of its own, so readers and
+# other writers only ever see a whole header; returns the header
+def replaceHeader(folder, headerFile, header):
+    tmp = os.path.join(folder, headerFile + '.' + uuid.uuid4().hex + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(header, f)
+    os.replace(tmp, os.path.join(folder, headerFile))
+    return header
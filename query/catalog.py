@@ -0,0 +1,249 @@
+# catalog
+#
+# An index of the Affdex and Leda csv files in a Processed directory. The
+# directory is walked once (or the index is loaded from disk) and every
+# filename is parsed into (kind, computer ID, start timestamp, path). Files are
+# kept sorted by start timestamp for each (kind, ID) pair, so finding the file
+# closest to a screen timestamp is a binary search instead of an os.walk.
+
+import bisect
+import json
+import os
+import uuid
+
+# name of the persisted index, stored at the top of the indexed directory
+INDEX_FILE = '.sensor_catalog.json'
+INDEX_VERSION = 1
+
+# filename prefixes for each kind of sensor file, the same prefixes querymerge
+# and plot have always matched on
+PREFIXES = {'Affd': 'Afdx', 'Leda': 'Leda'}
+
+# endings of the folders written next to sensor files (window indexes and
+# array folders), which hold no sensor files and are not scanned
+ARTIFACT_DIRS = ('.windex', '.arrays')
+
+# catalogs that have already been opened in this process, by directory
+_catalogs = {}
+
+
+# face_sample =  "Affdex_2016-11-08_16-12_Leeps-02_1478650349944_.csv"
+# leda_sample = "Leda_GSR_2016-11-08_S2_Leeps-02_1478649825471_.csv"
+
+# takes filenames and returns initial time and computer ID
+def splitFile(filename):
+    if filename is None:
+        return None
+    components = filename.split('_')
+    timestamp = components[-2]
+    compNumber = components[-3].split('-')[1]
+    return (timestamp, compNumber)
+
+# returns (kind, compNumber, timestamp) for an Affdex or Leda csv filename, or
+# None if the filename is not a sensor file or does not follow the naming scheme
+def parseFilename(filename):
+    name, ext = os.path.splitext(filename)
+    kind = PREFIXES.get(name[0:4])
+    if ext != '.csv' or kind is None:
+        return None
+    try:
+        timestamp, compNumber = splitFile(filename)
+        return (kind, compNumber, int(timestamp))
+    except (IndexError, ValueError):
+        return None
+
+
+class SensorCatalog:
+
+    def __init__(self, directory):
+        self.directory = directory
+        # dirpath -> {'mtime': ..., 'subdirs': [...], 'files': [...]}
+        self.dirs = {}
+        # (kind, compNumber) -> [(timestamp, path)...] sorted by timestamp
+        self.entries = {}
+
+    # adds one csv file to the index; returns True if it is a sensor file
+    def add(self, path):
+        parsed = parseFilename(os.path.basename(path))
+        if parsed is None:
+            return False
+        kind, compNumber, timestamp = parsed
+        files = self.entries.setdefault((kind, compNumber), [])
+        entry = (timestamp, path)
+        pos = bisect.bisect_left(files, entry)
+        if pos == len(files) or files[pos] != entry:
+            files.insert(pos, entry)
+        return True
+
+    # removes one csv file from the index, if it is there
+    def remove(self, path):
+        parsed = parseFilename(os.path.basename(path))
+        if parsed is None:
+            return
+        kind, compNumber, timestamp = parsed
+        files = self.entries.get((kind, compNumber), [])
+        entry = (timestamp, path)
+        pos = bisect.bisect_left(files, entry)
+        if pos < len(files) and files[pos] == entry:
+            del files[pos]
+
+    # brings the index up to date with the directory. Only directories whose
+    # mtime changed since the last scan are listed again (adding or removing a
+    # file changes the mtime of its directory), so refreshing an index that is
+    # already current costs one stat per directory. The folders in
+    # ARTIFACT_DIRS are skipped.
+    # returns the number of files added plus the number removed
+    def refresh(self):
+        changed = 0
+        seen = set()
+        stack = [self.directory]
+        while stack:
+            dirpath = stack.pop()
+            seen.add(dirpath)
+            try:
+                mtime = os.stat(dirpath).st_mtime
+            except OSError:
+                continue
+            known = self.dirs.get(dirpath)
+            if known is not None and known['mtime'] == mtime:
+                # an index saved before ARTIFACT_DIRS were skipped lists them
+                stack.extend(subdir for subdir in known['subdirs']
+                             if not subdir.endswith(ARTIFACT_DIRS))
+                continue
+
+            subdirs = []
+            files = []
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        if not entry.name.endswith(ARTIFACT_DIRS):
+                            subdirs.append(entry.path)
+                    elif parseFilename(entry.name) is not None:
+                        files.append(entry.name)
+
+            oldFiles = set(known['files']) if known is not None else set()
+            for filen in oldFiles.difference(files):
+                self.remove(os.path.join(dirpath, filen))
+                changed += 1
+            for filen in files:
+                if filen not in oldFiles:
+                    self.add(os.path.join(dirpath, filen))
+                    changed += 1
+
+            self.dirs[dirpath] = {'mtime': mtime, 'subdirs': subdirs,
+                                  'files': files}
+            stack.extend(subdirs)
+
+        # forget directories that were deleted since the last scan
+        for dirpath in set(self.dirs).difference(seen):
+            for filen in self.dirs[dirpath]['files']:
+                self.remove(os.path.join(dirpath, filen))
+                changed += 1
+            del self.dirs[dirpath]
+        return changed
+
+    # returns (timestamp, path) of the file of the given kind ('Afdx' or 'Leda')
+    # and computer ID whose start timestamp is closest to ts, or None if there
+    # is none. before and after (in ms) optionally limit how far before or
+    # after ts the file may start.
+    def closest(self, kind, ID, ts, before=None, after=None):
+        files = self.entries.get((kind, str(ID)))
+        if not files:
+            return None
+        ts = int(ts)
+        pos = bisect.bisect_left(files, (ts, ''))
+
+        best = None
+        for candidate in files[max(pos - 1, 0):pos + 1]:
+            diff = candidate[0] - ts
+            if before is not None and diff < -before:
+                continue
+            if after is not None and diff > after:
+                continue
+            if best is None or abs(diff) < abs(best[0] - ts):
+                best = candidate
+        return best
+
+    # returns every (timestamp, path) for the given kind and computer ID
+    def files(self, kind, ID):
+        return list(self.entries.get((kind, str(ID)), []))
+
+    # writes the index to disk as json
+    def save(self, path=None):
+        if path is None:
+            path = os.path.join(self.directory, INDEX_FILE)
+        index = {'version': INDEX_VERSION, 'directory': self.directory,
+                 'dirs': self.dirs}
+        # a temp file of its own, so processes saving at once do not collide
+        tmp = path + '.' + uuid.uuid4().hex + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    # reads an index written by save; the entries are rebuilt from the stored
+    # filenames, which does not touch the disk. Call refresh afterwards to pick
+    # up files added since the index was saved.
+    @classmethod
+    def load(cls, directory, path=None):
+        if path is None:
+            path = os.path.join(directory, INDEX_FILE)
+        with open(path) as f:
+            index = json.load(f)
+        catalog = cls(directory)
+        if (index.get('version') != INDEX_VERSION
+                or index.get('directory') != directory):
+            return catalog
+        catalog.dirs = index['dirs']
+        for dirpath, known in catalog.dirs.items():
+            for filen in known['files']:
+                catalog.add(os.path.join(dirpath, filen))
+        return catalog
+
+
+# returns the catalog for a directory, walking it at most once per process.
+# The first call in a process loads the persisted index if there is one and
+# refreshes it (one stat per directory when nothing changed), so a run picks
+# up the files added since the last one; later calls return the same catalog
+# without touching the disk unless refresh is True. The catalog is saved back
+# if a refresh changed it, unless the directory is not writable.
+def openCatalog(directory, indexFile=None, refresh=False):
+    catalog = _catalogs.get(directory)
+    if catalog is None:
+        try:
+            catalog = SensorCatalog.load(directory, indexFile)
+        except (OSError, ValueError, KeyError):
+            catalog = SensorCatalog(directory)
+        _catalogs[directory] = catalog
+        refresh = True
+
+    if refresh and catalog.refresh() > 0:
+        try:
+            catalog.save(indexFile)
+        except OSError:
+            pass
+    return catalog
+
+# runs convert(path, kind) on every Affdex and Leda file in a directory
+# (refreshing its catalog first) for which isDone(path) is False. A file that cannot be converted is reported and
+# skipped. Returns (converted, failed) counts.
+def convertFiles(directory, convert, isDone, action='convert'):
+    catalog = openCatalog(directory, refresh=True)
+    converted = 0
+    failed = 0
+    for (kind, compNumber), files in sorted(catalog.entries.items()):
+        for timestamp, path in files:
+            if isDone(path):
+                continue
+            try:
+                convert(path, kind)
+                converted += 1
+            except (KeyError, ValueError, OSError) as e:
+                print('ERROR: could not ' + action + ' ' + path + ': '
+                      + str(e))
+                failed += 1
+    return converted, failed
@@ -0,0 +1,197 @@
+# fused
+#
+# The Affdex and Leda recordings of one participant session, queried
+# together. Each screen's window is found on each file's own time index, in
+# seconds since the start timestamp in its filename, the same way
+# querymerge.evaluateScreens finds it on a file, so a variable gets the same
+# value whether it is queried through a session, on its own file or through
+# the file's index.
+#
+# Each variable is taken from the first stream that has it as a column
+# (Affdex before Leda), and by default aggregated over its own stream's rows
+# only, so the streams are never copied into one table. Given a tolerance,
+# each stream's last value is also carried onto the other stream's rows for up
+# to that many seconds (an as-of join), so both streams have a value at every
+# sample of either. Only then are the streams interleaved into one frame, on
+# a clock in milliseconds since the earlier of them started; each window is
+# found on each stream's own index as above and then mapped to the rows of
+# the interleaved frame.
+
+import numpy as np
+import pandas as pd
+
+from query import instrument
+from query.aggregate import aggregateRows, aggregateWindows, windowBounds
+from query.windowindex import WindowIndex
+
+# the kinds of sensor files, in the order their columns take precedence
+KINDS = ('Afdx', 'Leda')
+
+# name of the index of a fused frame
+CLOCK = 'session_ms'
+
+
+# the sensor data of one session. streams is a list of (kind, start timestamp
+# in ms, source) in order of precedence, where each source is either a
+# DataFrame from loader.loadSensorFile or a WindowIndex. tolerance is in
+# seconds; with a tolerance, the DataFrames are fused into one frame (see
+# fuseFrames).
+class SensorSession:
+
+    def __init__(self, streams, tolerance=0):
+        # column -> kind of the stream it is taken from
+        self.owners = {}
+        for kind, start, source in streams:
+            for col in source.columns:
+                self.owners.setdefault(col, kind)
+        self.streams = [(kind, int(start), source)
+                        for kind, start, source in streams]
+
+        # the streams in the fused frame, each with the position in the frame
+        # of each of its rows
+        self.fused = []
+        self.frame = None
+        frames = [stream for stream in self.streams
+                  if not isinstance(stream[2], WindowIndex)]
+        if tolerance > 0 and len(frames) > 1:
+            with instrument.stage('fuse'):
+                self.frame, positions = fuseFrames(frames, self.owners,
+                                                   tolerance)
+            self.fused = [(kind, start, df, position) for (kind, start, df),
+                          position in zip(frames, positions)]
+
+    # computes fcns on var_names over the window of delta_ts seconds starting
+    # at each screen timestamp (in ms), with one window search and one pass
+    # over each stream (or over the fused frame) for all of its variables.
+    # returns an array of shape (screens, var_names, fcns), NaN for variables
+    # that no stream has
+    def aggregate(self, ts_screens, var_names, fcns, delta_ts):
+        values = np.full((len(ts_screens), len(var_names), len(fcns)), np.nan)
+        fusedKinds = [kind for kind, start, df, position in self.fused]
+        for kind, start, source in self.streams:
+            owned = self.ownedPositions(var_names, [kind])
+            if kind in fusedKinds or len(owned) == 0:
+                continue
+            windows = screenWindows(ts_screens, start, delta_ts)
+            ownedNames = [var_names[pos] for pos in owned]
+            if isinstance(source, WindowIndex):
+                values[:, owned] = source.aggregateWindows(
+                    windows, ownedNames, fcns)[0]
+            else:
+                values[:, owned] = aggregateWindows(
+                    source, windows, ownedNames, fcns)[0]
+
+        owned = self.ownedPositions(var_names, fusedKinds)
+        if len(owned) > 0:
+            lo, hi = self.fusedBounds(ts_screens, delta_ts)
+            values[:, owned] = aggregateRows(
+                self.frame, lo, hi, [var_names[pos] for pos in owned], fcns,
+                unit=0.001)[0]
+        return values
+
+    # returns (lo, hi) arrays such that rows lo[i]:hi[i] of the fused frame
+    # span the rows of every fused stream in the window of screen i, each
+    # window found on its stream's own index (see screenWindows)
+    def fusedBounds(self, ts_screens, delta_ts):
+        lo = np.full(len(ts_screens), np.iinfo(np.intp).max)
+        hi = np.zeros(len(ts_screens), dtype=np.intp)
+        for kind, start, df, position in self.fused:
+            windows = screenWindows(ts_screens, start, delta_ts)
+            streamLo, streamHi = windowBounds(
+                df.index.to_numpy(dtype=np.float64),
+                [window[0] for window in windows],
+                [window[1] for window in windows])
+            # a stream's rows keep their order in the fused frame, so its rows
+            # in a window are between the positions of its first and last one
+            found = streamHi > streamLo
+            lo[found] = np.minimum(lo[found], position[streamLo[found]])
+            hi[found] = np.maximum(hi[found],
+                                   position[streamHi[found] - 1] + 1)
+        lo = np.minimum(lo, hi)
+        return lo, hi
+
+    # returns the positions in var_names of the variables taken from the
+    # streams of the given kinds
+    def ownedPositions(self, var_names, kinds):
+        return [pos for pos, var in enumerate(var_names)
+                if self.owners.get(var) in kinds]
+
+    # returns values (from aggregate) as a list of (results, missingPos) per
+    # screen, holding only the variables taken from kind, the way
+    # querymerge.evaluateScreens returns them for that kind's file alone
+    def kindResults(self, values, var_names, kind):
+        owned = self.ownedPositions(var_names, [kind])
+        missingPos = [pos for pos in range(len(var_names)) if pos not in owned]
+        return [([screenValues[pos].tolist() for pos in owned], missingPos)
+                for screenValues in values]
+
+
+# returns the (start, end) window, in seconds of a file's index, of delta_ts
+# seconds from each screen timestamp (in ms), for a file starting at start
+# (in ms). querymerge.evaluateScreens finds its windows with it as well.
+def screenWindows(ts_screens, start, delta_ts):
+    windows = []
+    for ts_screen in ts_screens:
+        start_ts = (ts_screen - start)/1000
+        windows.append((start_ts, start_ts + delta_ts))
+    return windows
+
+# interleaves the rows of the DataFrames of streams on one clock (ms since the
+# earliest start) in time order, keeping the rows of earlier streams first
+# where times are equal. owners gives the stream each column is taken from,
+# and each stream's columns are carried onto the rows of the other streams
+# from its last row at most tolerance seconds before them.
+# returns (frame, positions), where positions[s][r] is the row of the frame
+# that row r of stream s was put in
+def fuseFrames(streams, owners, tolerance):
+    origin = min(start for kind, start, df in streams)
+    clocks = []
+    for kind, start, df in streams:
+        clock = df.index.to_numpy(dtype=np.float64) * 1000
+        clocks.append(clock + float(start - origin))
+    clock = np.concatenate(clocks)
+    offsets = np.cumsum([0] + [len(c) for c in clocks])
+
+    columns = list(owners)
+    # the frame keeps the float32 the loader reads query columns as (aggregate
+    # widens only the rows of its windows), unless a stream has other columns
+    dtype = np.float32
+    for kind, start, df in streams:
+        if any(df[col].dtype != np.float32 for col in df.columns
+               if owners[col] == kind):
+            dtype = np.float64
+    values = np.full((len(clock), len(columns)), np.nan, dtype=dtype)
+    for s, (kind, start, df) in enumerate(streams):
+        own = [pos for pos, col in enumerate(columns) if owners[col] == kind]
+        if len(own) == 0:
+            continue
+        data = df[[columns[pos] for pos in own]].to_numpy(dtype=dtype)
+        values[offsets[s]:offsets[s + 1], own] = data
+        carryOver(values, clock, offsets, s, own, data, tolerance*1000)
+
+    order = np.argsort(clock, kind='mergesort')
+    position = np.empty(len(order), dtype=np.intp)
+    position[order] = np.arange(len(order))
+    frame = pd.DataFrame(values[order], columns=columns,
+                         index=pd.Index(clock[order], name=CLOCK), copy=False)
+    return frame, [position[offsets[s]:offsets[s + 1]]
+                   for s in range(len(streams))]
+
+# fills the columns own of every stream but stream s with the row of data
+# (stream s's values of those columns) at or before each of their rows,
+# if it is at most tolerance ms before it
+def carryOver(values, clock, offsets, s, own, data, tolerance):
+    streamClock = pd.DataFrame({CLOCK: clock[offsets[s]:offsets[s + 1]],
+                                'row': np.arange(len(data))})
+    for other in range(len(offsets) - 1):
+        if other == s or offsets[other] == offsets[other + 1]:
+            continue
+        #both clocks are sorted, since loader sorts every file by time
+        otherClock = pd.DataFrame(
+            {CLOCK: clock[offsets[other]:offsets[other + 1]]})
+        joined = pd.merge_asof(otherClock, streamClock, on=CLOCK,
+                               direction='backward', tolerance=tolerance)
+        row = joined['row'].to_numpy()
+        matched = ~np.isnan(row)
+        rows = offsets[other] + np.flatnonzero(matched)
+        values[np.ix_(rows, own)] = data[row[matched].astype(np.intp)]
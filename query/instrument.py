@@ -0,0 +1,129 @@
+# instrument
+#
+# Opt-in timers and counters for the stages of a merge: finding files
+# (discovery), parsing screen timestamps, reading sensor files (parse), finding
+# window bounds (window), computing aggregates (aggregate) and writing the
+# results (output). For each stage it counts calls, seconds, bytes read or
+# written and rows scanned, and it can also write a trace file with one JSON
+# line per oTree row and screen and per sensor file read.
+#
+# Nothing is recorded until enable() is called. While it is off, stage()
+# returns one shared do-nothing context manager and count() and trace()
+# return right away, so the calls left in the code cost next to nothing.
+
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+# the order stages are listed in by report(); other names come after them
+STAGES = ['discovery', 'timestamps', 'parse', 'window', 'aggregate', 'output']
+
+_enabled = False
+# stage name -> [calls, seconds, bytes, rows]
+_stats = {}
+_tracePath = None
+_traceFile = None
+_noop = nullcontext()
+# counters are also updated from the threads reading files ahead
+_lock = threading.Lock()
+
+
+# starts recording, forgetting anything recorded before. If tracePath is
+# given, trace() appends lines to that file (several processes may append to
+# the same file).
+def enable(tracePath=None):
+    global _enabled, _tracePath, _traceFile
+    disable()
+    _stats.clear()
+    _enabled = True
+    _tracePath = tracePath
+    if tracePath is not None:
+        _traceFile = open(tracePath, 'a', buffering=1)
+
+# stops recording and closes the trace file
+def disable():
+    global _enabled, _tracePath, _traceFile
+    _enabled = False
+    _tracePath = None
+    if _traceFile is not None:
+        _traceFile.close()
+        _traceFile = None
+
+# returns True if recording is on
+def enabled():
+    return _enabled
+
+# returns True if trace() writes to a file
+def tracing():
+    return _traceFile is not None
+
+# returns what a worker process needs to record the same way as this one, or
+# None if recording is off
+def settings():
+    return {'tracePath': _tracePath} if _enabled else None
+
+
+class _Timer:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        count(self.name, seconds=time.perf_counter() - self.start, calls=1)
+        return False
+
+
+# returns a context manager that times the code in its block as one call of
+# the named stage
+def stage(name):
+    if not _enabled:
+        return _noop
+    return _Timer(name)
+
+# adds to the counters of the named stage
+def count(name, nbytes=0, rows=0, seconds=0.0, calls=0):
+    if not _enabled:
+        return
+    with _lock:
+        stats = _stats.setdefault(name, [0, 0.0, 0, 0])
+        stats[0] += calls
+        stats[1] += seconds
+        stats[2] += nbytes
+        stats[3] += rows
+
+# writes one line to the trace file, if there is one
+def trace(event, **fields):
+    if _traceFile is None:
+        return
+    fields['event'] = event
+    fields['pid'] = os.getpid()
+    line = json.dumps(fields, default=str) + '\n'
+    with _lock:
+        _traceFile.write(line)
+
+# returns a copy of the counters, to be sent back from a worker process
+def snapshot():
+    return {name: list(stats) for name, stats in _stats.items()}
+
+# adds the counters of a snapshot (from a worker process) to this process's
+def absorb(snapshot):
+    for name, (calls, seconds, nbytes, rows) in snapshot.items():
+        count(name, nbytes, rows, seconds, calls)
+
+# returns the counters as a table, one line per stage
+def report():
+    names = [name for name in STAGES if name in _stats]
+    names += sorted(name for name in _stats if name not in STAGES)
+    lines = ['%-12s %8s %10s %12s %12s' % ('stage', 'calls', 'seconds',
+                                           'MB', 'rows')]
+    for name in names:
+        calls, seconds, nbytes, rows = _stats[name]
+        lines.append('%-12s %8d %10.3f %12.1f %12d'
+                     % (name, calls, seconds, nbytes / 2**20, rows))
+    return '\n'.join(lines)
@@ -0,0 +1,189 @@
+# loader
+#
+# Reads Affdex and Leda csv files into DataFrames indexed by their time column,
+# and keeps the parsed frames in a bounded LRU cache so that a file used by
+# several screens (or several plots) is parsed at most once per run.
+# Frames handed out by loadSensorFile are shared with the cache, so callers
+# must copy them before modifying them.
+#
+# Every frame is indexed by a contiguous float64 array of times sorted in
+# ascending order, so windows can be found with a binary search of the index
+# (see aggregate.windowBounds). Files whose times go backwards are sorted once
+# here, with a warning, instead of by every query.
+
+import os
+import threading
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from query import instrument, sensorarrays, sidecar
+
+# the time column of each kind of sensor file, in seconds since the start
+# timestamp in the filename
+INDEX_COLS = {'Afdx': 'delta_secs', 'Leda': 'data.time.data'}
+
+# default memory budget of the frame cache, in megabytes
+CACHE_MB = 1024
+
+# csv parser of whole-file reads. pandas' C parser by default; 'pyarrow' is
+# faster on big files but peaks at several times the memory and starts a
+# thread per core in every --workers process, so it is only used when asked
+# for. Reads of a few columns always use the C parser, which keeps the least
+# in memory (see bench/bench_usecols.py).
+CSV_ENGINE = 'c'
+
+
+# an LRU cache of DataFrames with a memory budget in bytes. Frames are evicted
+# least recently used first once the budget is exceeded; a frame bigger than
+# the whole budget is never cached. It can be used from several threads (files
+# read ahead by prefetch).
+class FrameCache:
+
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.frames = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.frames:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.frames.move_to_end(key)
+            return self.frames[key][0]
+
+    def put(self, key, df):
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.maxBytes:
+            return
+        with self.lock:
+            if key in self.frames:
+                self.nbytes -= self.frames.pop(key)[1]
+            self.frames[key] = (df, size)
+            self.nbytes += size
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.nbytes = 0
+
+    # changes the budget, evicting frames if the cache is now over it
+    def resize(self, maxBytes):
+        with self.lock:
+            self.maxBytes = maxBytes
+            self.evict()
+
+    # evicts least recently used frames until the cache is within its budget;
+    # the caller holds the lock
+    def evict(self):
+        while self.nbytes > self.maxBytes:
+            _, (_, evicted) = self.frames.popitem(last=False)
+            self.nbytes -= evicted
+
+
+_cache = FrameCache(CACHE_MB * 2**20)
+
+# sets the memory budget of the frame cache, in megabytes
+def setCacheBudget(megabytes):
+    _cache.resize(int(megabytes * 2**20))
+
+# returns the memory budget of the frame cache, in megabytes
+def cacheBudget():
+    return _cache.maxBytes / 2**20
+
+# returns the frame cache used by loadSensorFile
+def getCache():
+    return _cache
+
+# warned about when a file's time column is not in ascending order
+class UnsortedTimeWarning(UserWarning):
+    pass
+
+# reads a sensor csv file of the given kind ('Afdx' or 'Leda'), pads missing
+# time values by filling forward, and indexes it by time (see sortByTime).
+# If columns is given, only those columns (and the time column) are parsed, as
+# float32; requested names that are not in the file are skipped.
+# raises KeyError if the file has no time column
+def readSensorFile(path, kind, columns=None):
+    index_col = INDEX_COLS[kind]
+    if columns is None:
+        df = pd.read_csv(path, engine=CSV_ENGINE)
+    else:
+        df = readColumns(path, index_col, columns)
+    df[index_col] = df[index_col].ffill()
+    df.set_index(index_col, inplace=True)
+    return sortByTime(df, path)
+
+# makes the index of a frame read from path a contiguous float64 array in
+# ascending order. Rows before the first time value (which filling forward
+# leaves without one) are dropped; if the times go backwards anywhere, the
+# rows are sorted (keeping the order of equal times) and a warning is given.
+def sortByTime(df, path):
+    index = df.index.to_numpy(dtype=np.float64)
+    hasTime = ~np.isnan(index)
+    if not hasTime.all():
+        df = df[hasTime]
+        index = index[hasTime]
+    if (np.diff(index) < 0).any():
+        warnings.warn(path + ': time column is not in ascending order; '
+                      'sorting it', UnsortedTimeWarning)
+        order = np.argsort(index, kind='mergesort')
+        df = df.iloc[order]
+        index = index[order]
+    df.index = pd.Index(np.ascontiguousarray(index), name=df.index.name)
+    return df
+
+# parses only the time column and the given columns of a csv file. The header
+# is read first so the parser is given an exact column list. Value columns
+# are declared float32 and the time column float64; if a value column turns
+# out not to be numeric, it is read again without the declared types.
+def readColumns(path, index_col, columns):
+    header = pd.read_csv(path, nrows=0).columns
+    wanted = set(columns)
+    usecols = [col for col in header if col in wanted or col == index_col]
+    dtype = {col: 'float32' for col in usecols}
+    dtype[index_col] = 'float64'
+    try:
+        return pd.read_csv(path, usecols=usecols, dtype=dtype, engine='c')
+    except ValueError:
+        return pd.read_csv(path, usecols=usecols, engine='c')
+
+# same as readSensorFile, but attaches to the file's memory-mapped arrays (see
+# sensorarrays) or reads its Parquet sidecar instead of the csv when there is
+# an up to date one, and returns the cached frame if this version of the file
+# (same path and modification time) was already read.
+# If columns is given, the frame only holds those of them the file has.
+# Frames attached to arrays are read-only and are not put in the cache: they
+# take no memory of their own and attaching again is cheap.
+def loadSensorFile(path, kind, columns=None):
+    if columns is not None:
+        columns = tuple(columns)
+    df = sensorarrays.attachArrays(path, columns)
+    if df is not None:
+        instrument.count('attach', rows=len(df), calls=1)
+        return df
+    key = (path, os.stat(path).st_mtime_ns, kind, columns)
+    df = _cache.get(key)
+    if df is None:
+        with instrument.stage('parse'):
+            if sidecar.available() and sidecar.hasFreshSidecar(path):
+                source = sidecar.sidecarPath(path)
+                df = sortByTime(sidecar.readSidecar(path, columns), path)
+            else:
+                source = path
+                df = readSensorFile(path, kind, columns)
+        if instrument.enabled():
+            instrument.count('parse', nbytes=os.path.getsize(source),
+                             rows=len(df))
+            instrument.trace('parse', path=source, rows=len(df),
+                             columns=len(df.columns))
+        _cache.put(key, df)
+    return df
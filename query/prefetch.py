@@ -0,0 +1,99 @@
+# prefetch
+#
+# Reads sensor files ahead on background threads while the file before them
+# is being aggregated, so that reading (mostly waiting on the disk and the
+# csv parser, which let go of the GIL) overlaps with computing. At most depth
+# files are read ahead of the one being aggregated, on threads threads, so
+# memory use stays bounded.
+#
+# The time spent reading and the time the aggregation had to wait for a file
+# are counted: the difference is the reading time the prefetch hid.
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# default number of files read ahead, and of threads reading them
+DEPTH = 2
+THREADS = 1
+
+_depth = DEPTH
+_threads = THREADS
+_lock = threading.Lock()
+# files read, seconds spent reading them, seconds waited for them
+_stats = {'files': 0, 'read': 0.0, 'waited': 0.0}
+
+
+# sets how many files are read ahead (0 reads every file when it is needed)
+# and how many threads read them
+def configure(depth=DEPTH, threads=THREADS):
+    global _depth, _threads
+    _depth = max(0, int(depth))
+    _threads = max(1, int(threads))
+
+# returns the settings, to be handed to worker processes
+def settings():
+    return {'depth': _depth, 'threads': _threads}
+
+# returns a copy of the counters and sets them back to zero
+def takeStats():
+    with _lock:
+        stats = dict(_stats)
+        _stats.update(files=0, read=0.0, waited=0.0)
+    return stats
+
+# adds counters (from takeStats in a worker process) to this process's
+def addStats(stats):
+    with _lock:
+        for name, value in stats.items():
+            _stats[name] += value
+
+# returns a one line summary of the counters, or None if nothing was read
+# ahead
+def summary():
+    with _lock:
+        files, read, waited = _stats['files'], _stats['read'], _stats['waited']
+    if files == 0:
+        return None
+    return ('prefetch: read ' + str(files) + ' files in %.2f s, %.2f s of it '
+            'hidden behind aggregation, waited %.2f s for files'
+            % (read, max(read - waited, 0.0), waited))
+
+# calls load(item) once for each item, in order, and yields (item, result)
+# pairs where result() returns what load returned (or raises what it
+# raised). While the caller works on one item, up to depth of the next ones
+# are loaded on background threads.
+def readAhead(load, items):
+    if _depth == 0:
+        for item in items:
+            yield item, (lambda item=item: load(item))
+        return
+
+    def timedLoad(item):
+        start = time.perf_counter()
+        try:
+            return load(item)
+        finally:
+            addStats({'files': 1, 'read': time.perf_counter() - start})
+
+    def result(future):
+        start = time.perf_counter()
+        try:
+            return future.result()
+        finally:
+            addStats({'waited': time.perf_counter() - start})
+
+    items = iter(items)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=_threads) as pool:
+        for item in items:
+            pending.append((item, pool.submit(timedLoad, item)))
+            if len(pending) > _depth:
+                break
+        while pending:
+            item, future = pending.popleft()
+            for nextItem in items:
+                pending.append((nextItem, pool.submit(timedLoad, nextItem)))
+                break
+            yield item, (lambda future=future: result(future))
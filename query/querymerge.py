@@ -5,27 +5,35 @@
 # analysis (applies a statistical function, e.g. mean, sum, min) on a slice
 # of the data, and appends the results of the analysis to another CSV file
 
+import os
+import sys
+
+if not __package__:
+    import scriptpath  # run as a script: see scriptpath.py
+
 import numpy as np
 import pandas as pd
-import matplotlib
-import matplotlib.pyplot as plt
-import os
-from math import isnan
-from sys import argv
 import datetime as dt
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+from query import instrument, loader, prefetch
+from query.catalog import openCatalog, splitFile
+from query.fused import KINDS, SensorSession, screenWindows
+from query.loader import loadSensorFile
+from query.aggregate import aggregateWindows
+from query.resultstore import ResultStore
+from query.windowindex import WindowIndex, openIndex
+
+# files are matched to a screen if they start within this many minutes of it
+MATCH_MINUTES = 30
 
+# where merge writes its results unless it is given another file
+DEFAULT_OUTPUT = '/data/KLAB/EEE_data/Processed/oTree/EEE_otree_postquery.csv'
 
-# face_sample =  "Affdex_2016-11-08_16-12_Leeps-02_1478650349944_.csv"
-# leda_sample = "Leda_GSR_2016-11-08_S2_Leeps-02_1478649825471_.csv"
+# extension of the file that records how far a chunked merge got
+PROGRESS_EXT = '.progress'
 
-# takes filenames and returns initial time and computer ID
-def splitFile(filename):
-    if filename is None:
-        return None
-    components = filename.split('_')
-    timestamp = components[-2]
-    compNumber = components[-3].split('-')[1]
-    return (timestamp, compNumber)
 
 #returns a 13-digit timestamp given a utc datetime in format:
 # YYYY-mm-ddTHH:MM:SS.fffZ or format: YYYY-mm-dd HH:MM:SS.ffffff+00:00
@@ -39,155 +47,461 @@ def parse_ts(utc_dt):
 					'%Y-%m-%d %H:%M:%S.%f+00:00').replace(
 					tzinfo=dt.timezone.utc).timestamp()*1000)
 
-#returns true if two different timestamps are within 30 minutes of each other
-def isWithinTimeRange(base, compare, diff=30):
-    minutes_range = diff  # this is the key parameter to test difference in time
-    ms_range = minutes_range*60*1000
-    ibase = int(base)
-    icompare = int(compare)
-    return abs(ibase - icompare) <= ms_range
+#same as parse_ts, but converts a whole column of utc datetimes at once, in
+# either format or any mix of them. Returns a masked array of 13-digit int64
+# timestamps, where blank or invalid cells are masked instead of raising
+def parseTimestamps(column):
+    text = pd.Series(column).astype(str).str.strip()
+
+    # both formats are 'YYYY-mm-dd HH:MM:SS.f' with a different separator and
+    # suffix; checking those and taking them off lets pandas use its fast
+    # parser instead of going through strptime for every cell
+    isZ = text.str.endswith('Z') & (text.str[10] == 'T')
+    isUtc = text.str.endswith('+00:00') & (text.str[10] == ' ')
+    body = text.str[:-1].where(isZ, text.str[:-6])
+    body = body.str[:10] + ' ' + body.str[11:]
+    parsed = pd.to_datetime(body.where(isZ | isUtc),
+                            format='%Y-%m-%d %H:%M:%S.%f', errors='coerce')
+
+    invalid = parsed.isna().to_numpy()
+    ms = (parsed - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1)
+    ms = ms.fillna(0).to_numpy(dtype=np.int64)
+    return np.ma.masked_array(ms, mask=invalid)
 
 def tsname(ts):
     start_ = ts.find('time_') + 5
     return ts[start_:]
 
-# converts a string input into a numpy fcn that can be applied to a DataFrame or
-# Series. This is better than getattr because np functions are not attributes of
-# pandas objects and the pandas min, max, mean, etc don't work in the way we
-# want them to
-def fcnConvert(fcn):
-    if fcn == 'mean' or fcn == 'np.mean':
-        fcn = np.mean
-    if fcn == 'std' or fcn == 'np.std' or fcn == 'sd':
-        fcn = np.std
-    if fcn == 'min' or fcn == 'np.min':
-        fcn = np.min
-    if fcn == 'max' or fcn == 'max':
-        fcn = np.max
-    return fcn
-
 #evaulates fcns on given columns in a DataFrame for a given time window
 def evaluate(df, ts_screen, timestamp, var_names, fcns, delta_ts):
+    results, missingPos = evaluateScreens(df, [ts_screen], timestamp,
+                                          var_names, fcns, delta_ts)
+    return results[0], missingPos
+
+#evaluates fcns on given columns in a DataFrame (or the WindowIndex of a file)
+# for the time window of each screen, all in one pass over the data. If a
+# var_name is not a column in the csv file, it is ignored, but its position is
+# recorded in missingPos
+# returns ([results of screen 1, ... results of screen N], missingPos)
+def evaluateScreens(df, ts_screens, timestamp, var_names, fcns, delta_ts):
     #get range of data from ts arguments
-    start_ts = (ts_screen - int(timestamp))/1000
-    end_ts = start_ts + delta_ts
-
-    #error handling: if a var_name is not a column in the csv file, ignore it,
-    # but record its position
-    missingPos = []
-    names = df.columns.values
-    var_names2 = [var_name for var_name in var_names]
-    for var_name in var_names2:
-        if var_name not in names:
-            missingPos.append(var_names2.index(var_name))
-
-    # delete the elements in var_names the indices in missingPos; ugly but it
-	# works and I think it's the shortest solution
-    for i in range(len(missingPos)-1, -1,-1):
-        del var_names2[missingPos[i]]
-
-    # get columns corresponding to var_names
-    varcols = df[var_names2]
-
-    #get dataframe of values from the range within that column (inclusive)
-    values = varcols[start_ts:end_ts]
-
-    #perform fcn on values, store into list
-    results = []
-    for valuecol in values:
-        varlist = []
-        for fcn in fcns:
-            fcn = fcnConvert(fcn) # converts from string to np function
-            varlist.append(fcn(values[valuecol]))
-        results.append(varlist)
-
-    return results, missingPos
+    windows = screenWindows(ts_screens, int(timestamp), delta_ts)
+
+    #perform fcns on the values of each window (inclusive)
+    if isinstance(df, WindowIndex):
+        aggregated, missingPos = df.aggregateWindows(windows, var_names, fcns)
+    else:
+        aggregated, missingPos = aggregateWindows(df, windows, var_names,
+                                                  fcns)
+    return [screenResults.tolist() for screenResults in aggregated], missingPos
+
+# the result of a screen with no matching file
+def noFileError(afdxleda, ID, ts_screen):
+    return ('ERROR: No ' + afdxleda + ' file found with ID=' + str(ID)
+            + ' and timestamp within 30 minutes of ' + str(ts_screen), [])
+
+# finds the file of the given kind ('Afdx' or 'Leda') matching ID for each
+# screen timestamp, and evaluates each screen's window on it. Screens that
+# match the same file are evaluated together, so each file is loaded once.
+# returns [(results, missingPos) of screen 1, ...], where results is
+# [[var1_fcn1, var1_fcn2... ,var1_fcnN]..., [varM_fcn1... ,varM_fcnN]] or an
+# error message if no file could be used
+def queryScreens(afdxleda, directory, ts_screens, ID, var_names, fcns,
+                 delta_ts=20):
+    ID = str(ID)
+    ms_range = MATCH_MINUTES*60*1000
+    with instrument.stage('discovery'):
+        catalog = openCatalog(directory)
+    screenResults = [None] * len(ts_screens)
+
+    #get file matching ID from the catalog of the given directory, grouping
+    # screens by file
+    screensByFile = {}
+    with instrument.stage('discovery'):
+        for pos, ts_screen in enumerate(ts_screens):
+            match = catalog.closest(afdxleda, ID, ts_screen, ms_range,
+                                    ms_range)
+            if match is None:
+                #error handling
+                screenResults[pos] = noFileError(afdxleda, ID, ts_screen)
+            else:
+                screensByFile.setdefault(match, []).append(pos)
+
+    evaluateFiles(afdxleda, screensByFile, ts_screens, var_names, fcns,
+                  delta_ts, screenResults)
+    return screenResults
+
+# evaluates the windows of the screens matched to each file, loading each file
+# once. screensByFile maps (timestamp, path) of a file to the positions in
+# ts_screens of the screens it matched; each screen's (results, missingPos)
+# is stored at its position in screenResults
+def evaluateFiles(afdxleda, screensByFile, ts_screens, var_names, fcns,
+                  delta_ts, screenResults):
+    jobs = [(timestamp, filepath, positions) for (timestamp, filepath),
+            positions in screensByFile.items()]
+
+    #use the file's window index if it has an up to date one, otherwise
+    # read csv file (or reuse it if it was already read), padding missing
+    # index values to prevent indexing errors. The next files are read ahead
+    # while the current one is evaluated.
+    def load(job):
+        df = openIndex(job[1], var_names, fcns)
+        if df is None:
+            df = loadSensorFile(job[1], afdxleda, var_names)
+        return df
+
+    for (timestamp, filepath, positions), result in prefetch.readAhead(load, jobs):
+        try:
+            df = result()
+        except KeyError as e:
+            for pos in positions:
+                screenResults[pos] = ('ERROR: ' + afdxleda + ' file has'
+                                      + ' no column header ' + str(e), [])
+            continue
+
+        #perform functions on given cols and ts ranges
+        results, missingPos = evaluateScreens(
+            df, [ts_screens[pos] for pos in positions], timestamp, var_names,
+            fcns, delta_ts)
+        for pos, result in zip(positions, results):
+            screenResults[pos] = (result, missingPos)
 
 #--------------------------------------------Afdx------------------------------
 
 # returns [[var1_fcn1, var1_fcn2... ,var1_fcnN]...,
 # 		   [varM_fcn1, varM_fcn2... ,varM_fcnM]]
 def queryAfdx(directory, ts_screen, ID, var_names, fcns, delta_ts=20):
-    filename = 'NaN'
-    ID = str(ID)
-
-    #get file matching ID from given directory
-    for dirname, dirpath, filenames in os.walk(directory):
-        for filen in filenames:
-            name, ext = os.path.splitext(filen)
-            if(ext == '.csv' and name[0:4] == ('Affd')):
-                timestamp, compNumber = splitFile(filen)
-                if(compNumber == ID and isWithinTimeRange(timestamp, ts_screen, 30)):
-                    filename = filen
-
-    #error handling
-    if(filename == 'NaN'):
-        return ('ERROR: No Afdx file found with ID=' + ID + ' and timestamp \
-				within 30 minutes of' + str(ts_screen), [])
-
-    #read csv file, and open as a pandas dataframe
-    filepath = directory + 'Afdx/' + filename
-    df = pd.read_csv(filepath)
-
-    #pad missing index values to prevent indexing errors
-    try:
-        df['delta_secs'].fillna(method='pad', inplace=True)
-    except Exception as e:
-        return 'ERROR: Adfx file has no column header ' + str(e), []
-
-    df.set_index('delta_secs', inplace=True)
-
-    #perform functions on given cols and ts ranges
-    return evaluate(df, ts_screen, timestamp, var_names, fcns, delta_ts)
+    return queryScreens('Afdx', directory, [ts_screen], ID, var_names, fcns,
+                        delta_ts)[0]
 
 #-------------------------------------------Leda---------------------------------
 
 # returns [[var1_fcn1, var1_fcn2... ,var1_fcnN]... ,
 #		   [varM_fcn1, varM_fcn2... ,varM_fcnM]]
 def queryLeda(directory, ts_screen, ID, var_names, fcns, delta_ts=20):
-    filename = 'NaN'
-    ID = str(ID)
-
-    #get file matching ID from given directory
-    for dirname, dirpath, filenames in os.walk(directory):
-        for filen in filenames:
-            name, ext = os.path.splitext(filen)
-            if(ext == '.csv' and name[0:4] == ('Leda')):
-                timestamp, compNumber = splitFile(filen)
-                if(compNumber == ID and isWithinTimeRange(timestamp, ts_screen, 30)):
-                    filename = filen
-                    dr = dirname
-
-    #error handling
-    if(filename == 'NaN'):
-        return 'ERROR: No Leda file found with ID=' + ID + ' and timestamp \
-				within 30 minutes of ' + str(ts_screen), []
-
-    #read csv file, and open as a pandas dataframe
-    filepath = dr + '/' + filename
-    df = pd.read_csv(filepath)
-
-    #pad missing index values to prevent indexing errors
-    try:
-        df['data.time.data'].fillna(method='pad', inplace=True)
-    except Exception as e:
-        return 'ERROR: Adfx file has no column header ' + str(e), []
-
-    df.set_index('data.time.data', inplace=True)
-
-    #perform functions on given cols and ts ranges
-    return evaluate(df, ts_screen, timestamp, var_names, fcns, delta_ts)
+    return queryScreens('Leda', directory, [ts_screen], ID, var_names, fcns,
+                        delta_ts)[0]
 
 #----------------------------merge----------------------------------------------
 
-# merges pulled afdx and leda aggregates into columns of a new df, that gets
-# appended to a csv file
-def merge(directory, merge_df_file, ID_col, ts_screens, variables, fcns, delta_ts):
-
-    #open dataframe
-    merge_df = pd.read_csv(merge_df_file, index_col=0)
-
+# merges are run from a plan: every (row, screen) of the oTree file is first
+# resolved to a task (row, screen column, ID, screen timestamp), then the
+# tasks are grouped by the afdx and leda file they match, and each session
+# (pair of afdx and leda file) is loaded once, fused (see fused) and evaluated
+# for all of its tasks together
+
+# resolves every screen of the given rows of merge_df to a task. All
+# timestamps of a screen column are parsed at once; screens whose timestamp
+# is blank or invalid get no task (their values stay NaN).
+# returns (tasks, invalid), where invalid lists the (row, screen column) of
+# those screens
+def planTasks(merge_df, rows, ID_col, ts_screens):
+    screenNums = {}
+    with instrument.stage('timestamps'):
+        for ts in ts_screens:
+            if ts in merge_df:
+                column = parseTimestamps(merge_df[ts].loc[rows])
+                screenNums[ts] = (column.data, np.ma.getmaskarray(column))
+    instrument.count('timestamps', rows=len(rows) * len(screenNums))
+
+    tasks = []
+    invalid = []
+    for i, row in enumerate(rows):
+        #get ID at current row
+        ID = int(merge_df[ID_col][row].split('_')[1])
+        if(ID<10):
+            ID = '0' + str(ID)
+
+        #get ts for each screen of the current row
+        for ts, (column, mask) in screenNums.items():
+            if mask[i]:
+                invalid.append((row, ts))
+            else:
+                tasks.append((row, ts, str(ID), int(column[i])))
+    return tasks, invalid
+
+# groups tasks by the file of each kind they match.
+# returns {kind: (filesToTasks, unmatched)}, where filesToTasks maps the
+# (timestamp, path) of each file to the positions in tasks of its tasks, and
+# unmatched holds the positions of tasks with no file of that kind
+def planFiles(directory, tasks):
+    ms_range = MATCH_MINUTES*60*1000
+    with instrument.stage('discovery'):
+        catalog = openCatalog(directory)
+        plan = {}
+        for afdxleda in KINDS:
+            filesToTasks = {}
+            unmatched = []
+            for pos, (row, ts, ID, screenNum) in enumerate(tasks):
+                match = catalog.closest(afdxleda, ID, screenNum, ms_range,
+                                        ms_range)
+                if match is None:
+                    unmatched.append(pos)
+                else:
+                    filesToTasks.setdefault(match, []).append(pos)
+            plan[afdxleda] = (filesToTasks, unmatched)
+    return plan
+
+# groups the tasks of a plan by session: the afdx and leda file they matched.
+# returns {(afdx file, leda file): positions in tasks of its tasks}, where
+# each file is its (timestamp, path), or None if the tasks matched no file of
+# that kind; tasks that matched no file of either kind are left out
+def planSessions(plan):
+    matched = {}
+    for afdxleda in KINDS:
+        for match, positions in plan[afdxleda][0].items():
+            for pos in positions:
+                matched.setdefault(pos, {})[afdxleda] = match
+    sessions = {}
+    for pos in sorted(matched):
+        files = tuple(matched[pos].get(afdxleda) for afdxleda in KINDS)
+        sessions.setdefault(files, []).append(pos)
+    return sessions
+
+# opens the files of a session (see planSessions) as a SensorSession holding
+# the variables in var_names: a file's window index if it has an up to date
+# one that can answer fcns, otherwise the file itself (or the copy already
+# read). A file without a time column adds nothing to the session. With a tolerance (in seconds),
+# streams are carried onto each other's rows (see fused), which needs the
+# rows, so indexes are not used.
+def openSession(files, var_names, fcns, tolerance=0):
+    streams = []
+    for afdxleda, match in zip(KINDS, files):
+        if match is None:
+            continue
+        timestamp, filepath = match
+        source = None
+        if tolerance == 0:
+            source = openIndex(filepath, var_names, fcns)
+        if source is None:
+            try:
+                source = loadSensorFile(filepath, afdxleda, var_names)
+            except KeyError:
+                continue
+        streams.append((afdxleda, int(timestamp), source))
+    return SensorSession(streams, tolerance)
+
+# evaluates the windows of the tasks of each session, loading each session
+# once; while one session is evaluated, the next are read ahead (see
+# prefetch). The values of each task are stored at its position in values,
+# an array of shape (tasks, var_names, fcns) of NaN.
+# If a ResultStore is given, tasks whose values it holds for these versions
+# of the files are not evaluated again, and the new ones are added to it
+def evaluateSessions(sessions, screenNums, var_names, fcns, delta_ts, values,
+                     store=None, tolerance=0):
+    jobs = []
+    for files, positions in sessions.items():
+        if store is not None:
+            positions = lookupSession(store, files, positions, screenNums,
+                                      var_names, fcns, delta_ts, values)
+            if len(positions) == 0:
+                continue
+        jobs.append((files, positions))
+
+    def load(job):
+        return openSession(job[0], var_names, fcns, tolerance)
+
+    for (files, positions), result in prefetch.readAhead(load, jobs):
+        session = result()
+        screens = [screenNums[pos] for pos in positions]
+        values[positions] = session.aggregate(screens, var_names, fcns,
+                                              delta_ts)
+        if store is not None:
+            for afdxleda, match in zip(KINDS, files):
+                if match is not None:
+                    store.save(afdxleda, splitFile(match[1])[1], match[1],
+                               screens,
+                               session.kindResults(values[positions],
+                                                   var_names, afdxleda),
+                               var_names, fcns, delta_ts)
+
+# fills values with the stored values of the tasks of a session whose files
+# all have them, each variable taken from the first kind that has it (as in
+# a fused session); returns the positions of the tasks that are left to
+# evaluate
+def lookupSession(store, files, positions, screenNums, var_names, fcns,
+                  delta_ts, values):
+    screens = [screenNums[pos] for pos in positions]
+    stored = []
+    for afdxleda, match in zip(KINDS, files):
+        if match is not None:
+            stored.append(store.lookup(afdxleda, splitFile(match[1])[1],
+                                       match[1], screens, var_names, fcns,
+                                       delta_ts))
+    left = []
+    for i, pos in enumerate(positions):
+        found = [kindStored[i] for kindStored in stored]
+        if None in found:
+            left.append(pos)
+            continue
+        taken = set()
+        for results, missingPos in found:
+            missing = set(missingPos)
+            present = [p for p in range(len(var_names)) if p not in missing]
+            for p, varResults in zip(present, results):
+                if p not in taken:
+                    values[pos, p] = varResults
+                    taken.add(p)
+    return left
+
+# prints what a plan will do: the files it reads, how many windows are
+# evaluated on each, and the screens that have no valid timestamp or no file
+# of either kind
+def printPlan(plan, tasks, invalid):
+    print(str(len(tasks)) + ' screens to query')
+    print(str(len(invalid)) + ' screens have a blank or invalid timestamp')
+    for row, ts in invalid:
+        print('    row ' + str(row) + ', ' + ts)
+    for afdxleda, (filesToTasks, unmatched) in plan.items():
+        print(afdxleda + ': ' + str(len(filesToTasks)) + ' files, '
+              + str(len(tasks) - len(unmatched)) + ' windows, '
+              + str(len(unmatched)) + ' screens without a file')
+        for (timestamp, filepath), positions in sorted(filesToTasks.items()):
+            print('    ' + filepath + ': ' + str(len(positions)) + ' windows')
+
+    noFile = sorted(set(plan['Afdx'][1]).intersection(plan['Leda'][1]))
+    print(str(len(noFile)) + ' screens match no Afdx or Leda file')
+    for pos in noFile:
+        row, ts, ID, screenNum = tasks[pos]
+        print('    row ' + str(row) + ', ID ' + ID + ', ' + ts + ' ('
+              + str(screenNum) + ')')
+
+# computes the new values of the given rows of merge_df;
+# returns a float64 array with one row per row in rows and one column per
+# column in augmentedCols, holding NaN where there was no data
+# store is an optional ResultStore to reuse and keep the computed values in,
+# and tolerance the seconds afdx and leda values are carried onto each
+# other's rows (see fused)
+def mergeRows(directory, merge_df, rows, ID_col, ts_screens, variables, fcns,
+              delta_ts, augmentedCols, store=None, tolerance=0):
+    tasks, invalid = planTasks(merge_df, rows, ID_col, ts_screens)
+    plan = planFiles(directory, tasks)
+    screenNums = [screenNum for row, ts, ID, screenNum in tasks]
+    taskValues = np.full((len(tasks), len(variables), len(fcns)), np.nan)
+    evaluateSessions(planSessions(plan), screenNums, variables, fcns,
+                     delta_ts, taskValues, store, tolerance)
+    if instrument.tracing():
+        traceTasks(merge_df, plan, tasks, invalid)
+
+    #positions of each screen's columns, and of each row
+    screenCols = {}
+    for colPos, (col, ts_name) in enumerate(augmentedCols):
+        screenCols.setdefault(ts_name, []).append(colPos)
+    rowPos = {row: i for i, row in enumerate(rows)}
+
+    values = np.full((len(rows), len(augmentedCols)), np.nan)
+    for pos, (row, ts, ID, screenNum) in enumerate(tasks):
+        values[rowPos[row], screenCols[tsname(ts)]] = taskValues[pos].ravel()
+
+    return values
+
+# writes a trace line for every screen of a merge: its row, participant and
+# timestamp, and the Afdx and Leda files it was matched to
+def traceTasks(merge_df, plan, tasks, invalid):
+    files = {}
+    for afdxleda, (filesToTasks, unmatched) in plan.items():
+        for (timestamp, filepath), positions in filesToTasks.items():
+            for pos in positions:
+                files[(afdxleda, pos)] = filepath
+    for pos, (row, ts, ID, screenNum) in enumerate(tasks):
+        instrument.trace('screen', row=row, ID=ID, screen=ts,
+                         timestamp=screenNum, afdx=files.get(('Afdx', pos)),
+                         leda=files.get(('Leda', pos)))
+    for row, ts in invalid:
+        instrument.trace('screen', row=row, screen=ts, timestamp=None)
+
+# runs mergeRows in a worker process with its own connection to the result
+# store at storePath (if any) and the given tolerance, reading ahead and
+# recording with the settings of the parent process (see workerSettings),
+# whose frame cache budget it keeps as well.
+# returns (values, counters), where counters are the worker's result store
+# hits and misses and its prefetch and instrument counters
+def mergeRowsWorker(storePath, settings, tolerance, *args):
+    prefetch.configure(**settings['prefetch'])
+    prefetch.takeStats()
+    loader.setCacheBudget(settings['cacheMB'])
+    if settings['instrument'] is not None:
+        instrument.enable(**settings['instrument'])
+    store = None if storePath is None else ResultStore(storePath)
+    try:
+        values = mergeRows(*args, store=store, tolerance=tolerance)
+    finally:
+        if store is not None:
+            store.close()
+
+    counters = {'prefetch': prefetch.takeStats(), 'instrument': None,
+                'hits': 0, 'misses': 0}
+    if settings['instrument'] is not None:
+        counters['instrument'] = instrument.snapshot()
+        instrument.disable()
+    if store is not None:
+        counters['hits'] = store.hits
+        counters['misses'] = store.misses
+    return values, counters
+
+# returns the settings of this process that worker processes copy
+def workerSettings():
+    return {'prefetch': prefetch.settings(),
+            'instrument': instrument.settings(),
+            'cacheMB': loader.cacheBudget()}
+
+# splits the row labels of merge_df into at most n groups, keeping all rows
+# of a participant in the same group so that each participant's files are
+# only loaded by one process. Participants are handed out largest first to
+# the group with the fewest rows.
+def splitRows(merge_df, ID_col, n):
+    participants = {}
+    for row in merge_df.index:
+        participants.setdefault(merge_df[ID_col][row], []).append(row)
+
+    groups = [[] for i in range(min(n, len(participants)))]
+    for rows in sorted(participants.values(), key=len, reverse=True):
+        smallest = min(groups, key=len)
+        smallest.extend(rows)
+    return [sorted(group) for group in groups]
+
+# same as mergeRows over all of merge_df, but splits the rows across a pool of
+# worker processes. Each worker only gets the columns it needs. The results
+# are put back in the order of merge_df's rows, so the output is the same as
+# the serial one. Workers reuse and fill the result store if one is given.
+def mergeParallel(directory, merge_df, ID_col, ts_screens, variables, fcns,
+                  delta_ts, augmentedCols, workers, store=None, tolerance=0):
+    neededCols = [ID_col] + [ts for ts in ts_screens if ts in merge_df]
+    query_df = merge_df[neededCols]
+
+    rowPos = {row: i for i, row in enumerate(merge_df.index)}
+    storePath = None if store is None else store.path
+    values = np.full((len(merge_df.index), len(augmentedCols)), np.nan)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for rows in splitRows(query_df, ID_col, workers):
+            futures.append((rows, pool.submit(mergeRowsWorker, storePath,
+                                              workerSettings(), tolerance,
+                                              directory, query_df.loc[rows],
+                                              rows, ID_col, ts_screens,
+                                              variables, fcns, delta_ts,
+                                              augmentedCols)))
+        for rows, future in futures:
+            rowValues, counters = future.result()
+            values[[rowPos[row] for row in rows]] = rowValues
+            prefetch.addStats(counters['prefetch'])
+            if counters['instrument'] is not None:
+                instrument.absorb(counters['instrument'])
+            if store is not None:
+                store.hits += counters['hits']
+                store.misses += counters['misses']
+
+    return values
+
+# adds the afdx and leda aggregates of every row of merge_df as new columns;
+# returns the enlarged DataFrame
+# workers is the number of processes to split the rows across, store an
+# optional ResultStore of values computed by earlier runs, and tolerance the
+# seconds afdx and leda values are carried onto each other's rows (see fused)
+def enrich(directory, merge_df, ID_col, ts_screens, variables, fcns, delta_ts,
+           workers=1, store=None, tolerance=0):
     numrows = len(merge_df.index)
+    newCols = []
     augmentedCols = []
 
     for ts in ts_screens:
@@ -195,80 +509,166 @@ def merge(directory, merge_df_file, ID_col, ts_screens, variables, fcns, delta_t
         for var in variables:
             for fcn in fcns:
                 colname = str(ts_name) + '_' + str(var) + '_' + str(fcn)
+                newCols.append((colname, ts))
                 if ts in merge_df:
                     augmentedCols.append((colname,ts_name))
-                newcol = np.zeros(numrows)
-                joincol = pd.DataFrame(newcol,
-									   index=merge_df.index,
-									   columns=[colname])
-                merge_df = merge_df.join(joincol)
 
 #player_time_EmoQuestPage1_2
 
-    for row in range(numrows):
-        for ts in ts_screens:
-            if ts in merge_df:
-                #get ts for the current screen
-                screen_dt = str(merge_df[ts][row])
-                screenNum = parse_ts(screen_dt)
-
-                #get ID at current row
-                ID = int(merge_df[ID_col][row].split('_')[1])
-                if(ID<10):
-                    ID = '0' + str(ID)
-                #query for afdx and leda results
-                afdxResults, afdxMissingPos = queryAfdx(directory, screenNum,
-					ID, variables, fcns, delta_ts)
-                ledaResults, ledaMissingPos = queryLeda(directory, screenNum,
-					ID, variables, fcns, delta_ts)
-
-                #splice affdex and leda results together
-                if isinstance(afdxResults, list)
-						and not isnan(afdxResults[0][0])
-						and isinstance(ledaResults, list)
-						and not isnan(ledaResults[0][0]):
-                    splicedList = afdxResults
-                    for i in range(len(ledaResults)):
-                        splicedList.insert(afdxMissingPos[i], ledaResults[i])
-                elif isinstance(afdxResults, list)
-						and not isnan(afdxResults[0][0])
-						and (not isinstance(ledaResults, list)
-						or isnan(ledaResults[0][0])):
-                    splicedList = afdxResults
-                    for i in afdxMissingPos:
-                        splicedList.insert(i, np.repeat('NaN',
-											len(fcns)).tolist())
-                elif (not isinstance(afdxResults, list)
-						or isnan(afdxResults[0][0]))
-						and isinstance(ledaResults, list)
-						and not isnan(ledaResults[0][0]):
-                    splicedList = ledaResults
-                    for i in ledaMissingPos:
-                        splicedList.insert(i, np.repeat('NaN',
-											len(fcns)).tolist())
-                else:
-                    splicedList = []
-                    innerList = np.repeat('NaN', len(fcns)).tolist()
-                    for i in variables:
-                        splicedList.append(innerList)
-
-                listIndex = 0
-                flatSplicedList = [num for sublist in splicedList
-									for num in sublist]
-
-                for col, ts_name in augmentedCols:
-                    if(tsname(ts)) == ts_name:
-                        merge_df.loc[row,col] = flatSplicedList[listIndex]
-                        listIndex += 1
-
+    #compute the new values of every row, on one process or split by
+    # participant across several
+    if workers > 1:
+        values = mergeParallel(directory, merge_df, ID_col, ts_screens,
+                               variables, fcns, delta_ts, augmentedCols,
+                               workers, store, tolerance)
+    else:
+        values = mergeRows(directory, merge_df, merge_df.index, ID_col,
+                           ts_screens, variables, fcns, delta_ts,
+                           augmentedCols, store, tolerance)
+
+    #attach all new columns at once; columns of screens that are not in the
+    # oTree file are zero
+    columns = {}
+    augmentedPos = 0
+    for colname, ts in newCols:
+        if ts in merge_df:
+            columns[colname] = values[:, augmentedPos]
+            augmentedPos += 1
+        else:
+            columns[colname] = np.zeros(numrows)
+    return pd.concat([merge_df, pd.DataFrame(columns, index=merge_df.index)],
+                     axis=1)
 
-    merge_df.to_csv('/data/KLAB/EEE_data/Processed/oTree/ \
-					EEE_otree_postquery.csv')
+# merges pulled afdx and leda aggregates into columns of a new df, that gets
+# written to the csv file output
+# workers is the number of processes to split the rows across; if dryRun is
+# True, the plan of the merge is printed and nothing is computed or written;
+# if chunksize is given, the oTree file is streamed chunksize rows at a time
+# (see mergeChunks); if store is the path of a result store (see resultstore),
+# windows computed by earlier runs on unchanged files are reused from it.
+# Each process reads up to depth files ahead on threads threads while it
+# aggregates (see prefetch); depth=0 reads each file when it is needed.
+# With a tolerance (in seconds), the last afdx and leda values are carried
+# onto each other's rows for up to that long (see fused); the result store
+# only holds values computed without one. cacheMB, if given, is the memory
+# budget of each process's cache of loaded files (see loader.setCacheBudget).
+def merge(directory, merge_df_file, ID_col, ts_screens, variables, fcns, delta_ts,
+          workers=1, dryRun=False, output=DEFAULT_OUTPUT, chunksize=None,
+          store=None, depth=prefetch.DEPTH, threads=prefetch.THREADS,
+          tolerance=0, cacheMB=None):
+    if store is not None and tolerance > 0:
+        raise ValueError('a result store cannot be used with a tolerance')
+
+    if dryRun:
+        merge_df = pd.read_csv(merge_df_file, index_col=0)
+        tasks, invalid = planTasks(merge_df, merge_df.index, ID_col,
+                                   ts_screens)
+        printPlan(planFiles(directory, tasks), tasks, invalid)
+        return
+
+    prefetch.configure(depth, threads)
+    prefetch.takeStats()
+    if cacheMB is not None:
+        loader.setCacheBudget(cacheMB)
+    resultStore = None if store is None else ResultStore(store)
+    try:
+        if chunksize is not None:
+            mergeChunks(directory, merge_df_file, ID_col, ts_screens,
+                        variables, fcns, delta_ts, workers, output, chunksize,
+                        resultStore, tolerance)
+        else:
+            #open dataframe
+            merge_df = pd.read_csv(merge_df_file, index_col=0)
+            merge_df = enrich(directory, merge_df, ID_col, ts_screens,
+                              variables, fcns, delta_ts, workers, resultStore,
+                              tolerance)
+            with instrument.stage('output'):
+                merge_df.to_csv(output)
+            instrument.count('output', nbytes=os.path.getsize(output),
+                             rows=len(merge_df.index))
+    finally:
+        if resultStore is not None:
+            resultStore.close()
+            print(resultStore.summary())
+        if prefetch.summary() is not None:
+            print(prefetch.summary())
     return
+
+# same as merge, but reads the oTree file chunksize rows at a time, enriches
+# each chunk and appends it to output, so memory use is bounded by the chunk
+# size and the frame cache instead of the size of the oTree file.
+# After every chunk, the number of rows done and the size of output are
+# recorded in output + '.progress'. If a run stops part way, output up to
+# that size is a valid csv file, and running the same merge again truncates
+# output to it and resumes after those rows. A merge with other arguments,
+# another directory or an oTree file that changed since (its size or
+# modification time) starts over instead.
+def mergeChunks(directory, merge_df_file, ID_col, ts_screens, variables, fcns,
+                delta_ts, workers, output, chunksize, store=None, tolerance=0):
+    progressFile = output + PROGRESS_EXT
+    st = os.stat(merge_df_file)
+    settings = {'directory': os.path.abspath(directory),
+                'input': os.path.abspath(merge_df_file),
+                'inputSize': st.st_size, 'inputMtime': st.st_mtime_ns,
+                'ID_col': ID_col, 'ts_screens': ts_screens,
+                'variables': variables, 'fcns': fcns, 'delta_ts': delta_ts,
+                'tolerance': tolerance}
+
+    rowsDone, size = readProgress(progressFile, settings)
+    if rowsDone > 0:
+        print('resuming after ' + str(rowsDone) + ' rows')
+    with open(output, 'a'):
+        pass
+    os.truncate(output, size)
+
+    with open(output, 'a', newline='') as f:
+        rowsSeen = 0
+        for chunk in pd.read_csv(merge_df_file, index_col=0,
+                                 chunksize=chunksize):
+            chunkStart = rowsSeen
+            rowsSeen += len(chunk)
+            if rowsSeen <= rowsDone:
+                continue
+            chunk = chunk.iloc[max(rowsDone - chunkStart, 0):]
+
+            chunk = enrich(directory, chunk, ID_col, ts_screens, variables,
+                           fcns, delta_ts, workers, store, tolerance)
+            with instrument.stage('output'):
+                start = f.tell()
+                chunk.to_csv(f, header=(start == 0))
+                f.flush()
+                os.fsync(f.fileno())
+            instrument.count('output', nbytes=f.tell() - start,
+                             rows=len(chunk.index))
+            writeProgress(progressFile, settings, rowsSeen, f.tell())
+
+    os.remove(progressFile)
+
+# returns (rows done, bytes of output written) recorded by an earlier run of
+# the same merge, or (0, 0) if there is none
+def readProgress(progressFile, settings):
+    try:
+        with open(progressFile) as f:
+            progress = json.load(f)
+    except (OSError, ValueError):
+        return 0, 0
+    if progress.get('settings') != settings:
+        return 0, 0
+    return progress['rows'], progress['bytes']
+
+# records the progress of a chunked merge, replacing the file atomically so a
+# crash never leaves it half written
+def writeProgress(progressFile, settings, rows, size):
+    tmp = progressFile + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'settings': settings, 'rows': rows, 'bytes': size}, f)
+    os.replace(tmp, progressFile)
 #-----------------------------------------------------------------------------------------------------------------------------------------
 
 #parse command line arguments for merge fcn: directory, otreefile, idCol,
-#varlist, screenlist, fcnlist, delta_ts
+#screenlist, varlist, fcnlist, delta_ts, and optionally --workers N,
+#--dry-run, --output FILE, --chunksize N, --store FILE, --tolerance SECONDS,
+#--prefetch N, --prefetch-threads N, --profile and --trace FILE
 #IMPORTANT: separate separate command line args with spaces, but separate
 # in lists with commas and no spaces
 # example command line:
@@ -280,13 +680,69 @@ def merge(directory, merge_df_file, ID_col, ts_screens, variables, fcns, delta_t
 #	disgust,analysis.phasicData
 #	mean,std
 #	20
-directory = str(argv[1])
-otreeFile = str(argv[2])
-idCol = str(argv[3])
-screenList = argv[4].split(',')
-varList = argv[5].split(',')
-fcnList = argv[6].split(',')
-delta_ts = argv[7]
-
-
-merge(directory, otreeFile, idCol, varList, screenList, fcnList, delta_ts)
+#	--workers 8
+def parseArgs(args):
+    parser = argparse.ArgumentParser(
+        description='Appends aggregates of Affdex and Leda data around each '
+                    'screen timestamp to an oTree csv file.')
+    parser.add_argument('directory')
+    parser.add_argument('otreeFile')
+    parser.add_argument('idCol')
+    parser.add_argument('screenList', type=lambda arg: arg.split(','))
+    parser.add_argument('varList', type=lambda arg: arg.split(','))
+    parser.add_argument('fcnList', type=lambda arg: arg.split(','))
+    parser.add_argument('delta_ts', type=float)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes to split the rows across')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print which files would be read for how many '
+                             'windows, and which screens match no file')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT,
+                        help='csv file to write the results to')
+    parser.add_argument('--chunksize', type=int,
+                        help='stream the oTree file this many rows at a time; '
+                             'an interrupted run resumes where it stopped')
+    parser.add_argument('--store',
+                        help='sqlite file of results kept between runs; only '
+                             'windows of new or changed files are computed')
+    parser.add_argument('--tolerance', type=float, default=0,
+                        help='carry the last Affdex and Leda values onto each '
+                             "other's samples for up to this many seconds")
+    parser.add_argument('--prefetch', type=int, default=prefetch.DEPTH,
+                        help='number of files each process reads ahead while '
+                             'it aggregates (0 to read each file when needed)')
+    parser.add_argument('--prefetch-threads', type=int,
+                        default=prefetch.THREADS,
+                        help='number of threads reading ahead')
+    parser.add_argument('--cache-mb', type=float, default=loader.CACHE_MB,
+                        help='memory each process may keep loaded files in, '
+                             'in megabytes')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time, calls, bytes and rows of each '
+                             'stage at the end')
+    parser.add_argument('--trace',
+                        help='with --profile, also write a JSON line per '
+                             'screen and per file read to this file')
+    return parser.parse_args(args)
+
+# runs a merge from command line arguments (sys.argv if args is None); this is
+# what python3 -m query and python3 querymerge.py run
+def main(args=None):
+    args = parseArgs(sys.argv[1:] if args is None else args)
+    if args.profile or args.trace is not None:
+        instrument.enable(args.trace)
+    try:
+        merge(args.directory, args.otreeFile, args.idCol, args.screenList,
+              args.varList, args.fcnList, args.delta_ts, args.workers,
+              args.dry_run, args.output, args.chunksize, args.store,
+              args.prefetch, args.prefetch_threads, args.tolerance,
+              args.cache_mb)
+    finally:
+        if instrument.enabled():
+            print(instrument.report())
+            instrument.disable()
+
+# the guard keeps worker processes, which import this file, from starting a
+# merge of their own
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# resultstore
+#
+# Keeps the aggregates computed by querymerge in an sqlite file so that a merge
+# run again after new sessions were added only computes the new windows. Every
+# value is stored under the participant ID, the screen timestamp, the sensor
+# file it was computed from (path, size and modification time), the variable,
+# the function and the window length. A file that changed on disk no longer
+# matches its stored values, so its windows are computed again and the old
+# values are dropped.
+#
+# Values of variables that are not columns of the file are stored too (as not
+# present), so a stored window gives back the same (results, missingPos) pair
+# evaluateScreens returns.
+
+import math
+import os
+import sqlite3
+
+from query.aggregate import fcnName
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cells (
+    kind TEXT, ID TEXT, screen INTEGER, path TEXT, size INTEGER,
+    mtime INTEGER, var TEXT, fcn TEXT, delta_ts REAL, present INTEGER,
+    value REAL,
+    PRIMARY KEY (path, size, mtime, kind, delta_ts, screen, var, fcn, ID)
+)
+'''
+
+
+# returns (size, modification time in ns) of a file
+def fingerprint(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+class ResultStore:
+
+    def __init__(self, path):
+        self.path = path
+        # several worker processes may write at once; wait for the lock
+        self.db = sqlite3.connect(path, timeout=600)
+        self.db.execute(SCHEMA)
+        self.db.commit()
+        # windows (one screen on one file) reused and computed
+        self.hits = 0
+        self.misses = 0
+
+    # looks up the windows of screens on a sensor file of the given kind.
+    # returns a list with, for each screen, its (results, missingPos) or None
+    # if any of its values is not stored
+    def lookup(self, kind, ID, path, screens, var_names, fcns, delta_ts):
+        size, mtime = fingerprint(path)
+        fcns = [fcnName(fcn) for fcn in fcns]
+        stored = {}
+        for screen, var, fcn, present, value in self.db.execute(
+                'SELECT screen, var, fcn, present, value FROM cells WHERE '
+                'path=? AND size=? AND mtime=? AND kind=? AND delta_ts=? AND '
+                'ID=?', (path, size, mtime, kind, float(delta_ts), str(ID))):
+            stored[(screen, var, fcn)] = (present,
+                                          math.nan if value is None else value)
+
+        found = []
+        for screen in screens:
+            results = []
+            missingPos = []
+            for pos, var in enumerate(var_names):
+                cells = [stored.get((int(screen), var, fcn)) for fcn in fcns]
+                if None in cells:
+                    results = None
+                    break
+                if cells[0][0]:
+                    results.append([value for present, value in cells])
+                else:
+                    missingPos.append(pos)
+            if results is None:
+                self.misses += 1
+                found.append(None)
+            else:
+                self.hits += 1
+                found.append((results, missingPos))
+        return found
+
+    # stores the (results, missingPos) of each screen computed on a sensor
+    # file, and drops the values of older versions of the file
+    def save(self, kind, ID, path, screens, screenResults, var_names, fcns,
+             delta_ts):
+        size, mtime = fingerprint(path)
+        fcns = [fcnName(fcn) for fcn in fcns]
+        rows = []
+        for screen, (results, missingPos) in zip(screens, screenResults):
+            missing = set(missingPos)
+            found = iter(results)
+            for pos, var in enumerate(var_names):
+                values = [None] * len(fcns) if pos in missing else next(found)
+                for fcn, value in zip(fcns, values):
+                    if value is not None and math.isnan(value):
+                        value = None
+                    rows.append((kind, str(ID), int(screen), path, size, mtime,
+                                 var, fcn, float(delta_ts),
+                                 int(pos not in missing), value))
+        with self.db:
+            self.db.execute('DELETE FROM cells WHERE path=? AND '
+                            '(size!=? OR mtime!=?)', (path, size, mtime))
+            self.db.executemany('INSERT OR REPLACE INTO cells VALUES '
+                                '(?,?,?,?,?,?,?,?,?,?,?)', rows)
+
+    def close(self):
+        self.db.close()
+
+    # returns a one line summary of the windows reused and computed
+    def summary(self):
+        total = self.hits + self.misses
+        return ('result store: ' + str(self.hits) + ' of ' + str(total)
+                + ' windows reused, ' + str(self.misses) + ' computed')
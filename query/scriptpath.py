@@ -0,0 +1,35 @@
+# scriptpath
+#
+# Lets the modules of this folder run as scripts (python3 querymerge.py)
+# wherever the folder is and whatever it is called, such as
+# /data/KLAB/ptt_express_analysis/MergeFunctions/. The modules import each
+# other through the query package (from query.catalog import ...), so a script
+# imports this module as a sibling (Python puts the folder of a script on
+# sys.path), and importing it registers this folder as the query package.
+#
+#   if not __package__:
+#       import scriptpath  # run as a script: see scriptpath.py
+
+import importlib.util
+import os
+import sys
+
+# name the modules of this folder are imported under
+PACKAGE = 'query'
+
+
+# imports the package folder directory under name, unless a package of that
+# name is imported already; returns the package
+def registerPackage(name, directory):
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(directory, '__init__.py'),
+        submodule_search_locations=[directory])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[name] = package
+    spec.loader.exec_module(package)
+    return package
+
+
+registerPackage(PACKAGE, os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,109 @@
+# sensorarrays
+#
+# Converts processed Affdex and Leda csv files into raw arrays that can be
+# memory-mapped: the sorted, forward-filled time index and every numeric
+# column are saved as .npy files in a folder next to the csv
+# (Affdex_..._.csv -> Affdex_..._.arrays/), with a small JSON header of the
+# column names and the start timestamp from the filename. loader attaches
+# DataFrames straight to these arrays without copying them, so any number of
+# processes reading the same session (worker processes, several analysts on
+# the server) share one copy of it in the OS page cache instead of each
+# parsing and holding its own.
+#
+# Values are stored as float32 and the index as float64, the same types
+# loader reads the columns of a query as. Attaching saves parsing the file and
+# holding a private copy of it, but not every copy: aggregate still copies
+# the rows its windows span to float64, and a session with both an Affdex and
+# a Leda file interleaves them into one frame (see fused).
+#
+# usage: python3 sensorarrays.py /data/KLAB/EEE_data/Processed/
+
+import os
+import sys
+
+if not __package__:
+    import scriptpath  # run as a script: see scriptpath.py
+
+import numpy as np
+import pandas as pd
+
+from query import arrayfiles, loader
+from query.catalog import convertFiles, splitFile
+
+ARRAYS_EXT = '.arrays'
+HEADER_FILE = 'header.json'
+
+
+# returns the arrays folder of a csv file
+def arraysPath(csvPath):
+    return os.path.splitext(csvPath)[0] + ARRAYS_EXT
+
+# returns the header of the arrays of a csv file if they were converted from
+# the current version of the csv (same size and modification time), otherwise
+# None
+def readHeader(csvPath):
+    return arrayfiles.readHeader(arraysPath(csvPath), HEADER_FILE, csvPath)
+
+# returns True if the csv file has up to date arrays
+def hasFreshArrays(csvPath):
+    return readHeader(csvPath) is not None
+
+# returns a DataFrame whose index and columns are memory-mapped views of the
+# arrays of a csv file, or None if it has no up to date arrays or they do not
+# hold all of the requested columns the file has. If columns is given, only
+# those columns are attached; names that are not in the file are skipped.
+def attachArrays(csvPath, columns=None):
+    header = readHeader(csvPath)
+    if header is None:
+        return None
+    stored = header['columns']
+    if columns is None:
+        names = stored
+    else:
+        wanted = set(columns)
+        names = [col for col in stored if col in wanted]
+        # a requested column of the file that is not numeric is not stored
+        if any(col in header['fileColumns'] and col not in stored
+               for col in wanted):
+            return None
+
+    folder = arraysPath(csvPath)
+    try:
+        index = arrayfiles.loadArray(folder, header, 'index')
+        data = {}
+        for col in names:
+            data[col] = arrayfiles.loadArray(folder, header,
+                                             'c' + str(stored.index(col)))
+    except (OSError, ValueError):
+        return None
+    return pd.DataFrame(data, index=pd.Index(index, name=header['index'],
+                                             copy=False),
+                        columns=names, copy=False)
+
+# writes the arrays of a csv file of the given kind ('Afdx' or 'Leda'), as a
+# new version of its arrays folder (see arrayfiles.writeArrays)
+# raises KeyError if the file has no time column
+def writeArrays(csvPath, kind):
+    version = arrayfiles.sourceVersion(csvPath)
+    df = loader.readSensorFile(csvPath, kind)
+    fileColumns = list(df.columns)
+    df = df.select_dtypes('number')
+
+    arrays = {'index': df.index.to_numpy(dtype=np.float64)}
+    for pos, col in enumerate(df.columns):
+        arrays['c' + str(pos)] = df[col].to_numpy(dtype=np.float32)
+    timestamp, compNumber = splitFile(os.path.basename(csvPath))
+    header = dict(version, kind=kind, start=int(timestamp),
+                  rows=len(df.index), index=df.index.name,
+                  columns=list(df.columns), fileColumns=fileColumns)
+    arrayfiles.writeArrays(arraysPath(csvPath), HEADER_FILE, arrays, header)
+
+# writes the arrays of every Affdex and Leda file in a directory whose arrays
+# are missing or older than the csv. Returns (converted, failed) counts.
+def convertDirectory(directory):
+    return convertFiles(directory, writeArrays, hasFreshArrays)
+
+if __name__ == '__main__':
+    converted, failed = convertDirectory(str(sys.argv[1]))
+    print('converted ' + str(converted) + ' files, '
+          + str(failed) + ' failed')
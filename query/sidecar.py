@@ -0,0 +1,84 @@
+# sidecar
+#
+# Converts processed Affdex and Leda csv files into Parquet sidecars stored
+# next to them (Affdex_..._.csv -> Affdex_..._.parquet). A sidecar holds the
+# same data as loader.readSensorFile returns, with the time index already
+# filled forward and sorted, so reading it skips csv parsing entirely and can
+# load only the columns a query asks for.
+#
+# Parquet support comes from pyarrow, which is optional: without it no
+# sidecars are written and the loader keeps reading the csv files. pyarrow is
+# only imported when a sidecar is read or written.
+#
+# usage: python3 sidecar.py /data/KLAB/EEE_data/Processed/
+
+import os
+import sys
+from importlib.util import find_spec
+
+if not __package__:
+    import scriptpath  # run as a script: see scriptpath.py
+
+import pandas as pd
+
+from query import loader
+from query.catalog import convertFiles
+
+SIDECAR_EXT = '.parquet'
+
+# whether pyarrow is installed, looked up without importing it
+_available = find_spec('pyarrow') is not None
+
+
+# returns True if pyarrow is installed, so sidecars can be read and written
+def available():
+    return _available
+
+# returns the sidecar path for a csv file
+def sidecarPath(csvPath):
+    return os.path.splitext(csvPath)[0] + SIDECAR_EXT
+
+# returns True if the csv file has a sidecar at least as new as it is
+def hasFreshSidecar(csvPath):
+    try:
+        sidecarTime = os.stat(sidecarPath(csvPath)).st_mtime_ns
+    except OSError:
+        return False
+    return sidecarTime >= os.stat(csvPath).st_mtime_ns
+
+# writes the sidecar for a csv file of the given kind ('Afdx' or 'Leda').
+# raises KeyError if the file has no time column
+def writeSidecar(csvPath, kind):
+    df = loader.readSensorFile(csvPath, kind)
+    path = sidecarPath(csvPath)
+    tmp = path + '.tmp'
+    df.to_parquet(tmp)
+    os.replace(tmp, path)
+
+# reads the sidecar of a csv file. If columns is given, only those columns
+# (plus the time index) are read, and numeric ones as float32, the same as
+# loader.readSensorFile reads them from the csv; names that are not in the
+# file are skipped, so callers can still report them as missing.
+def readSidecar(csvPath, columns=None):
+    path = sidecarPath(csvPath)
+    if columns is None:
+        return pd.read_parquet(path)
+    import pyarrow.parquet as pq
+    names = pq.read_schema(path).names
+    columns = [col for col in columns if col in names]
+    df = pd.read_parquet(path, columns=columns)
+    numeric = df.select_dtypes('number').columns
+    return df.astype({col: 'float32' for col in numeric})
+
+# writes a sidecar for every Affdex and Leda file in a directory whose sidecar
+# is missing or older than the csv. Returns (converted, failed) counts.
+def convertDirectory(directory):
+    return convertFiles(directory, writeSidecar, hasFreshSidecar)
+
+if __name__ == '__main__':
+    if not available():
+        print('ERROR: writing sidecars needs pyarrow (conda install pyarrow)')
+    else:
+        converted, failed = convertDirectory(str(sys.argv[1]))
+        print('converted ' + str(converted) + ' files, '
+              + str(failed) + ' failed')
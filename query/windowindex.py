@@ -0,0 +1,170 @@
+# windowindex
+#
+# Precomputes, once per Affdex or Leda file, everything aggregate needs to
+# answer window queries without going over the data again: the sorted time
+# index, running counts, sums and sums of squares of each column (for mean and
+# std), and a segment tree of each column for min and max. The arrays are
+# saved as .npy files in a folder next to the csv (Affdex_..._.csv ->
+# Affdex_..._.windex/) and memory-mapped when they are used, so later runs and
+# other processes share them through the page cache instead of each loading
+# the file.
+#
+# With an index, a window costs a binary search of the time index plus O(1)
+# rows of the running sums and O(log rows) rows of the trees, so sweeping
+# delta_ts or screen offsets no longer touches the whole file each time.
+# querymerge uses the index of a file automatically when it is up to date and
+# covers the requested variables.
+#
+# usage: python3 windowindex.py /data/KLAB/EEE_data/Processed/ [var1,var2]
+# builds (or extends) the index of every file for the given variables, or for
+# all numeric columns if no variables are given
+
+import os
+import sys
+
+if not __package__:
+    import scriptpath  # run as a script: see scriptpath.py
+
+import numpy as np
+import pandas as pd
+
+from query import arrayfiles, instrument, loader
+from query.aggregate import (fcnName, windowBounds, prefixCounts, prefixSums,
+                             prefixMeanStd, collectResults, buildTree,
+                             queryTree)
+from query.catalog import convertFiles
+
+INDEX_EXT = '.windex'
+# the functions an index can answer; other aggregates need the data itself
+INDEX_FCNS = ('mean', 'std', 'min', 'max')
+META_FILE = 'meta.json'
+ARRAYS = ('index', 'counts', 'shift', 'sums', 'squares', 'mins', 'maxs')
+
+
+# returns the index folder of a csv file
+def indexPath(csvPath):
+    return os.path.splitext(csvPath)[0] + INDEX_EXT
+
+# returns the metadata of the index of a csv file if it was built from the
+# current version of the csv (same size and modification time), otherwise None
+def readMeta(csvPath):
+    return arrayfiles.readHeader(indexPath(csvPath), META_FILE, csvPath)
+
+# the window index of one file, with its arrays memory-mapped
+class WindowIndex:
+
+    def __init__(self, folder, meta):
+        # the columns that have running sums and trees, and all the columns
+        # of the file
+        self.columns = meta['columns']
+        self.fileColumns = set(meta['fileColumns'])
+        self.positions = {col: pos for pos, col in enumerate(self.columns)}
+        for name in ARRAYS:
+            setattr(self, name, arrayfiles.loadArray(folder, meta, name))
+
+    # returns True if every name in var_names is indexed or is not a column
+    # of the file at all
+    def covers(self, var_names):
+        return all(var in self.positions or var not in self.fileColumns
+                   for var in var_names)
+
+    # same as aggregate.aggregateWindows on the file's DataFrame
+    def aggregateWindows(self, windows, var_names, fcns):
+        missingPos = []
+        cols = []
+        for pos, var_name in enumerate(var_names):
+            if var_name in self.positions:
+                cols.append(self.positions[var_name])
+            else:
+                missingPos.append(pos)
+
+        names = [fcnName(fcn) for fcn in fcns]
+        if len(windows) == 0 or len(cols) == 0:
+            return (np.full((len(windows), len(cols), len(names)), np.nan),
+                    missingPos)
+
+        with instrument.stage('window'):
+            lo, hi = windowBounds(self.index,
+                                  [window[0] for window in windows],
+                                  [window[1] for window in windows])
+        with instrument.stage('aggregate'):
+            return self.aggregateBounds(lo, hi, cols, names), missingPos
+
+    # computes the functions in names on the columns at positions cols, for
+    # the windows of rows lo:hi
+    def aggregateBounds(self, lo, hi, cols, names):
+        # read only the rows at the window bounds, then pick the columns
+        bounds = np.concatenate([lo, hi])
+        first = np.arange(len(lo))
+        last = first + len(lo)
+        counts = self.counts[bounds][:, cols]
+        n = counts[last] - counts[first]
+        computed = {}
+        if 'mean' in names or 'std' in names:
+            computed['mean'], computed['std'] = prefixMeanStd(
+                n, self.shift[cols], self.sums[bounds][:, cols],
+                self.squares[bounds][:, cols], first, last)
+        if 'min' in names:
+            computed['min'] = queryTree(self.mins, lo, hi, np.fmin)[:, cols]
+        if 'max' in names:
+            computed['max'] = queryTree(self.maxs, lo, hi, np.fmax)[:, cols]
+        return collectResults(names, n == 0, computed)
+
+
+# returns the up to date index of a csv file if it covers var_names (and can
+# answer all of fcns, if they are given), otherwise None
+def openIndex(csvPath, var_names, fcns=None):
+    if fcns is not None and any(fcnName(fcn) not in INDEX_FCNS
+                                for fcn in fcns):
+        return None
+    meta = readMeta(csvPath)
+    if meta is None:
+        return None
+    try:
+        windex = WindowIndex(indexPath(csvPath), meta)
+    except (OSError, ValueError):
+        return None
+    return windex if windex.covers(var_names) else None
+
+# builds the index of a csv file of the given kind ('Afdx' or 'Leda') for the
+# given columns (all numeric columns if None), adding them to the columns of
+# an up to date index the file already has, as a new version of its index
+# folder (see arrayfiles.writeArrays).
+# raises KeyError if the file has no time column
+def buildIndex(csvPath, kind, columns=None):
+    meta = readMeta(csvPath)
+    fileColumns = list(pd.read_csv(csvPath, nrows=0).columns)
+    if columns is not None:
+        columns = [col for col in fileColumns if col in set(columns)
+                   or (meta is not None and col in meta['columns'])]
+    version = arrayfiles.sourceVersion(csvPath)
+
+    df = loader.loadSensorFile(csvPath, kind, columns)
+    if columns is None:
+        df = df.select_dtypes('number')
+    # from float32, the precision queries read the columns with, whichever
+    # file (csv, sidecar or arrays) they came from
+    values = df.to_numpy(dtype=np.float32).astype(np.float64)
+    shift, sums, squares = prefixSums(values)
+    arrays = {'index': df.index.to_numpy(dtype=np.float64),
+              'counts': prefixCounts(values), 'shift': shift, 'sums': sums,
+              'squares': squares, 'mins': buildTree(values, np.fmin),
+              'maxs': buildTree(values, np.fmax)}
+    arrayfiles.writeArrays(indexPath(csvPath), META_FILE, arrays,
+                           dict(version, columns=list(df.columns),
+                                fileColumns=fileColumns))
+
+# builds or extends the index of every Affdex and Leda file in a directory
+# whose index is missing, out of date or lacks some of the columns.
+# Returns (built, failed) counts.
+def indexDirectory(directory, columns=None):
+    def isDone(path):
+        return columns is not None and openIndex(path, columns) is not None
+    return convertFiles(directory,
+                        lambda path, kind: buildIndex(path, kind, columns),
+                        isDone, 'index')
+
+if __name__ == '__main__':
+    columns = sys.argv[2].split(',') if len(sys.argv) > 2 else None
+    built, failed = indexDirectory(str(sys.argv[1]), columns)
+    print('indexed ' + str(built) + ' files, ' + str(failed) + ' failed')